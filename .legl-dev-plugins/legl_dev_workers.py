@@ -0,0 +1,7 @@
+import os
+
+
+def pytest_runtest_setup(item):
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "master")
+    if ('xdist_worker', worker) not in item.user_properties:
+        item.user_properties.append(('xdist_worker', worker))
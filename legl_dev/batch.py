@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import json
+import subprocess
+from typing import List, Optional
+
+from legl_dev import timing
+from legl_dev.capture import stream
+from legl_dev.command import Command
+
+MARKER = "@@legl-dev@@"
+
+# Runs inside `manage.py shell -c`, so Django is only set up once for the batch
+SCRIPT = """
+import sys, traceback
+from django.core.management import call_command
+
+for argv in {commands}:
+    print({marker!r} + "start:" + " ".join(argv), flush=True)
+    try:
+        call_command(*argv)
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    sys.stderr.flush()
+    print({marker!r} + "end:" + str(code), flush=True)
+    if code:
+        sys.exit(code)
+"""
+
+
+class ManagementCommands(Command):
+    # The batch gets no stdin, so only non-interactive commands can go in it,
+    # e.g. makemigrations has to run on its own so it can ask its questions
+    def __init__(
+        self,
+        docker_cmd: str,
+        commands: List[str],
+        service: str = "server",
+        name: Optional[str] = None,
+        depends_on: Optional[List[str]] = None,
+    ) -> None:
+        self.commands = commands
+        self.args = docker_cmd.split() + [
+            "exec",
+            "-T",
+            service,
+            "python",
+            "manage.py",
+            "shell",
+            "-c",
+            SCRIPT.format(
+                commands=json.dumps([command.split() for command in commands]),
+                marker=MARKER,
+            ),
+        ]
+        super().__init__(
+            command=f"{docker_cmd} exec {service} python manage.py "
+            + " && ".join(commands),
+            name=name or f"manage.py {', '.join(commands)}",
+            depends_on=depends_on,
+        )
+
+    def _report(self, command: Command, returncode: int, prefix: bool) -> None:
+        command.returncode = returncode
+        if returncode:
+            command._error_output(
+                subprocess.CalledProcessError(returncode, command.command), prefix
+            )
+        else:
+            command._success_output(prefix)
+
+    def _handle(self, lines: List[str], prefix: bool) -> None:
+        for line in lines:
+            if not line.startswith(MARKER):
+                self._echo(line, prefix=prefix)
+                continue
+            kind, _, value = line[len(MARKER) :].partition(":")
+            if kind == "start":
+                self.current = Command(command=f"manage.py {value}", name=self.name)
+                self.current._command_output(prefix)
+            else:
+                self._report(self.current, int(value), prefix)
+                self.failure_reported = bool(self.current.returncode)
+                self.current = None
+
+    def run(self, prefix: bool = False) -> bool:
+        self.current = None
+        self.failure_reported = False
+        capture = self._start_capture()
+        try:
+            process = subprocess.Popen(
+                self.args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+        except OSError as e:
+            capture.close()
+            self._not_found_output(e, prefix)
+            return False
+        with process:
+            stream(
+                process.stdout.fileno(),
+                capture,
+                on_lines=lambda lines: self._handle(lines, prefix),
+            )
+            self.peak_rss = timing.reap(process)
+
+        self.returncode = process.returncode
+        if self.returncode and not self.failure_reported:
+            # the process died between markers, e.g. Django failed to start
+            self._report(self.current or self, self.returncode, prefix)
+        return self.returncode == 0
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import fnmatch
+import subprocess
+from typing import List, Optional, Tuple
+
+from legl_dev.command import capture_output
+
+PROTECTED = ["main", "master", "dev", "develop"]
+# Extra patterns can be kept per repo with `git config --add legl-dev.protect <pattern>`
+PROTECT_CONFIG = "legl-dev.protect"
+HEADS = "refs/heads/"
+
+
+def protected_patterns(patterns: List[str]) -> List[str]:
+    configured = capture_output(["git", "config", "--get-all", PROTECT_CONFIG])
+    return patterns + (configured or "").split()
+
+
+def _checked_out() -> set:
+    # branches checked out in any worktree can't be deleted
+    output = capture_output(["git", "worktree", "list", "--porcelain"]) or ""
+    return {
+        line[len("branch ") :]
+        for line in output.splitlines()
+        if line.startswith("branch ")
+    }
+
+
+def merged(into: str, protect: List[str]) -> Optional[List[Tuple[str, str]]]:
+    # one pass over the refs, returns (branch, sha) pairs or None outside a repo
+    output = capture_output(
+        [
+            "git",
+            "for-each-ref",
+            f"--merged={into}",
+            "--format=%(refname)%00%(objectname)",
+            HEADS,
+        ]
+    )
+    if output is None:
+        return None
+    checked_out = _checked_out()
+    branches = []
+    for line in output.splitlines():
+        ref, _, sha = line.partition("\0")
+        name = ref[len(HEADS) :]
+        if ref in checked_out or any(
+            fnmatch.fnmatchcase(name, pattern) for pattern in protect
+        ):
+            continue
+        branches.append((name, sha))
+    return branches
+
+
+def delete(branches: List[Tuple[str, str]]) -> Optional[str]:
+    # update-ref applies all of stdin as one transaction, and only deletes a
+    # branch if it hasn't moved since it was listed. Returns git's error if any
+    if not branches:
+        return None
+    result = subprocess.run(
+        ["git", "update-ref", "--stdin"],
+        input="".join(f"delete {HEADS}{name} {sha}\n" for name, sha in branches),
+        universal_newlines=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode:
+        return result.stderr.strip() or "git update-ref failed"
+    return None
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import pathlib
+
+
+def cache_dir() -> pathlib.Path:
+    if os.environ.get("LEGL_DEV_CACHE_DIR"):
+        return pathlib.Path(os.environ["LEGL_DEV_CACHE_DIR"])
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return pathlib.Path(root) / "legl-dev"
+
+
+def project_dir() -> pathlib.Path:
+    project = hashlib.sha1(os.getcwd().encode()).hexdigest()[:12]
+    return cache_dir() / "projects" / project
+
+
+def read_json(path: pathlib.Path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path: pathlib.Path, data) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def remove(path: pathlib.Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import collections
+import errno
+import hashlib
+import os
+import pathlib
+import re
+from typing import List
+
+from legl_dev.cache import project_dir
+
+CHUNK_SIZE = 1 << 16
+# Lines longer than this are split, so a child that never prints a newline
+# can't make the reader buffer its whole output
+MAX_LINE = 1 << 14
+TAIL_LINES = 200
+MAX_LOG_BYTES = 64 << 20
+LOG_BACKUPS = 3
+
+
+def log_dir() -> pathlib.Path:
+    return project_dir() / "logs"
+
+
+def log_path(name: str) -> pathlib.Path:
+    slug = re.sub(r"[^\w.-]+", "-", name).strip("-")[:60]
+    digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+    return log_dir() / f"{slug}-{digest}.log"
+
+
+class RotatingLog:
+    def __init__(
+        self, path: pathlib.Path, max_bytes: int = None, backups: int = None
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes or MAX_LOG_BYTES
+        self.backups = LOG_BACKUPS if backups is None else backups
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # every run starts a new file, the previous runs become backups
+        if self.path.exists() and self.path.stat().st_size:
+            self._rotate()
+        self.file = open(self.path, "wb")
+        self.size = 0
+
+    def _rotate(self) -> None:
+        for index in range(self.backups, 0, -1):
+            source = self.path.with_name(
+                self.path.name + (f".{index - 1}" if index > 1 else "")
+            )
+            if source.exists():
+                os.replace(source, self.path.with_name(f"{self.path.name}.{index}"))
+        if not self.backups:
+            self.path.unlink()
+
+    def write(self, data: bytes) -> None:
+        if self.size and self.size + len(data) > self.max_bytes:
+            self.file.close()
+            self._rotate()
+            self.file = open(self.path, "wb")
+            self.size = 0
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Capture:
+    def __init__(self, name: str) -> None:
+        self.log = RotatingLog(log_path(name))
+        self.tail = collections.deque(maxlen=TAIL_LINES)
+        self.partial = b""
+
+    def feed(self, data: bytes) -> List[str]:
+        # returns the lines completed by this chunk
+        self.log.write(data)
+        *lines, self.partial = (self.partial + data).split(b"\n")
+        while len(self.partial) > MAX_LINE:
+            lines.append(self.partial[:MAX_LINE])
+            self.partial = self.partial[MAX_LINE:]
+        decoded = [line.decode(errors="replace").rstrip("\r") for line in lines]
+        self.tail.extend(decoded)
+        return decoded
+
+    def close(self) -> List[str]:
+        self.log.close()
+        rest = [self.partial.decode(errors="replace")] if self.partial else []
+        self.partial = b""
+        self.tail.extend(rest)
+        return rest
+
+
+def stream(fd: int, capture: Capture, on_lines=None, on_chunk=None) -> None:
+    while True:
+        try:
+            data = os.read(fd, CHUNK_SIZE)
+        except OSError as e:
+            # a pseudo-terminal reports EIO rather than EOF once the child exits
+            if e.errno != errno.EIO:
+                raise
+            data = b""
+        if not data:
+            break
+        if on_chunk:
+            on_chunk(data)
+        lines = capture.feed(data)
+        if on_lines and lines:
+            on_lines(lines)
+    rest = capture.close()
+    if on_lines and rest:
+        on_lines(rest)
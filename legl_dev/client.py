@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# Entry point for `legl-dev`. It only imports what it needs to hand the
+# invocation to a running daemon, and falls back to running in-process.
+import array
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+
+# Every message from the daemon is a kind byte and an int
+MESSAGE = struct.Struct("!ci")
+FORWARDED_SIGNALS = [signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGWINCH]
+
+
+def socket_path() -> str:
+    if os.environ.get("LEGL_DEV_DAEMON_SOCKET"):
+        return os.environ["LEGL_DEV_DAEMON_SOCKET"]
+    if os.environ.get("LEGL_DEV_CACHE_DIR"):
+        root = os.environ["LEGL_DEV_CACHE_DIR"]
+    else:
+        root = os.path.join(
+            os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+            "legl-dev",
+        )
+    return os.path.join(root, "daemon.sock")
+
+
+def _receive(connection: socket.socket):
+    data = b""
+    while len(data) < MESSAGE.size:
+        chunk = connection.recv(MESSAGE.size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return MESSAGE.unpack(data)
+
+
+def _forward(pid: int):
+    def handler(signum, frame):
+        try:
+            os.killpg(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    for signum in FORWARDED_SIGNALS:
+        signal.signal(signum, handler)
+
+
+def run_in_daemon(argv: list):
+    # returns None when the daemon can't take the invocation
+    if os.environ.get("LEGL_DEV_NO_DAEMON"):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path())
+        request = json.dumps(
+            {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}
+        ).encode()
+        # the daemon takes over our stdin, stdout and stderr
+        connection.sendmsg(
+            [struct.pack("!I", len(request))],
+            [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [0, 1, 2]))],
+        )
+        connection.sendall(request)
+        message = _receive(connection)
+    except OSError:
+        connection.close()
+        return None
+    if message is None or message[0] != b"p":
+        connection.close()
+        return None
+
+    # from here on the command has started, so it must not run again locally
+    _forward(message[1])
+    try:
+        message = _receive(connection)
+    except OSError:
+        message = None
+    finally:
+        connection.close()
+    return message[1] if message and message[0] == b"x" else 1
+
+
+def main() -> None:
+    code = run_in_daemon(sys.argv[1:])
+    if code is None:
+        from legl_dev.main import app
+
+        app(prog_name="legl-dev")
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,57 @@
 #!/usr/bin/env python3
-import pathlib
+import hashlib
+import os
 import shutil
+import signal
 import subprocess
-from typing import Union
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional, Union
 
+import click
 import typer
+from legl_dev import history, timing
+from legl_dev.capture import Capture, stream
+from legl_dev.cache import project_dir, read_json, remove, write_json
+
+_output_lock = threading.Lock()
+
+
+def _terminal_output() -> bool:
+    return os.name == "posix" and sys.stdout.isatty()
+
+
+def _open_pty():
+    # the child writes to a pseudo-terminal so it keeps its colours and
+    # progress output, sized like ours
+    import fcntl
+    import pty
+    import struct
+    import termios
+
+    read_fd, write_fd = pty.openpty()
+    attrs = termios.tcgetattr(write_fd)
+    # leave newlines alone, our own terminal translates them when teed
+    attrs[1] &= ~termios.ONLCR
+    termios.tcsetattr(write_fd, termios.TCSANOW, attrs)
+    columns, rows = shutil.get_terminal_size()
+    fcntl.ioctl(write_fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, columns, 0, 0))
+    return read_fd, write_fd
+
+
+def capture_output(args: List[str]) -> Optional[str]:
+    try:
+        process = subprocess.Popen(
+            args,
+            universal_newlines=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+    output, _ = process.communicate()
+    return None if process.returncode else output
 
 
 class Command:
@@ -12,50 +59,189 @@ class Command:
         self,
         command: str,
         shell: bool = False,
+        name: Optional[str] = None,
+        depends_on: Optional[List[str]] = None,
+        capture: bool = True,
     ) -> None:
         self.command = command
         self.shell = shell
+        self.name = name or command
+        # None means "after the previous step", an empty list means "at the start"
+        self.depends_on = depends_on
+        # Captured output is passed through and teed to a log file, interactive
+        # commands turn it off so they keep the terminal
+        self.capture = capture
+        self.returncode = None
+        self.duration = None
+        self.peak_rss = None
+        self.log_file = None
+        self.tail = None
+        self.process = None
+        self.cancelled = False
 
     def _line_message(self, message):
         width, _ = shutil.get_terminal_size()
         line = "".join(["-" for _ in range((width - len(message) - 4) // 2)])
         return f"{line} {message} {line}"
 
-    def _success_output(self):
-        typer.secho(
-            self._line_message(" ✅  Command successful! ✅ "),
+    def _echo(self, message, prefix=False, **kwargs):
+        with _output_lock:
+            if prefix:
+                typer.secho(f"[{self.name}] ", nl=False, bold=True)
+            typer.secho(message, **kwargs)
+
+    def _success_output(self, prefix=False):
+        message = " ✅  Command successful! ✅ "
+        self._echo(
+            message if prefix else self._line_message(message),
+            prefix=prefix,
             fg=typer.colors.GREEN,
         )
 
-    def _error_output(self, e):
-        typer.secho(
+    def _error_output(self, e, prefix=False):
+        self._echo(
             f"💥 Command exited with code {e.returncode}! Check the logs above for more informations. 💥",
+            prefix=prefix,
             fg=typer.colors.BRIGHT_RED,
         )
 
-    def _command_output(self):
-        typer.secho(
-            self._line_message(f"🚧 Running: {self.command} 🚧"),
+    def _not_found_output(self, e, prefix=False):
+        # the same code a shell uses for a command it can't run
+        self.returncode = 127
+        self._echo(
+            f"💥 Couldn't run {self.command}: {e.strerror or e} 💥",
+            prefix=prefix,
+            fg=typer.colors.BRIGHT_RED,
+        )
+
+    def _command_output(self, prefix=False):
+        message = f"🚧 Running: {self.command} 🚧"
+        self._echo(
+            message if prefix else self._line_message(message),
+            prefix=prefix,
             fg=typer.colors.YELLOW,
         )
 
-    def run(self):
-        self._command_output()
+    def _echo_lines(self, lines):
+        for line in lines:
+            self._echo(line, prefix=True)
+
+    def _passthrough(self, data):
+        with _output_lock:
+            sys.stdout.flush()
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+
+    def _start_capture(self) -> Capture:
+        capture = Capture(self.name)
+        self.log_file, self.tail = capture.log.path, capture.tail
+        return capture
+
+    def _run_captured(self, args, prefix):
+        capture = self._start_capture()
+        # prefixed output is interleaved line by line, so only a step that
+        # has the terminal to itself is given one
+        if not prefix and _terminal_output():
+            read_fd, write_fd = _open_pty()
+            stdout = stderr = write_fd
+        else:
+            read_fd = write_fd = None
+            stdout, stderr = subprocess.PIPE, subprocess.STDOUT
         try:
-            subprocess.run(
-                self.command if self.shell else self.command.split(),
-                universal_newlines=True,
+            process = subprocess.Popen(
+                args,
                 shell=self.shell,
-                check=True,
+                # parallel steps can't share the terminal's input
+                stdin=subprocess.DEVNULL if prefix else None,
+                stdout=stdout,
+                stderr=stderr,
             )
-            self._success_output()
+        except OSError:
+            if read_fd is not None:
+                os.close(read_fd)
+            raise
+        finally:
+            # only the child keeps the terminal open, so reads end when it exits
+            if write_fd is not None:
+                os.close(write_fd)
+        if read_fd is None:
+            read_fd = process.stdout.fileno()
+        self.process = process
+        if self.cancelled:
+            os.kill(process.pid, signal.SIGTERM)
+        with process:
+            try:
+                if prefix:
+                    stream(read_fd, capture, on_lines=self._echo_lines)
+                else:
+                    stream(read_fd, capture, on_chunk=self._passthrough)
+            finally:
+                if process.stdout is None:
+                    os.close(read_fd)
+            self.peak_rss = timing.reap(process)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args)
+
+    def _run_inherited(self, args):
+        # the child shares our terminal, subprocess.run isn't used because it
+        # reaps the child itself and its peak RSS would be lost
+        process = subprocess.Popen(args, shell=self.shell)
+        self.process = process
+        if self.cancelled:
+            os.kill(process.pid, signal.SIGTERM)
+        with process:
+            try:
+                self.peak_rss = timing.reap(process)
+            except BaseException:
+                # e.g. Ctrl+C, don't leave the child running behind us
+                process.kill()
+                process.wait()
+                raise
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args)
+
+    def _execute(self, args, prefix):
+        if prefix or self.capture:
+            self._run_captured(args, prefix)
+        else:
+            self._run_inherited(args)
+
+    def run(self, prefix: bool = False) -> bool:
+        self._command_output(prefix)
+        args = self.command if self.shell else self.command.split()
+        try:
+            self._execute(args, prefix)
+            self.returncode = 0
+            self._success_output(prefix)
         except subprocess.CalledProcessError as e:
-            self._error_output(e)
+            self.returncode = e.returncode
+            if self.cancelled:
+                self._echo("⏹  Cancelled", prefix=prefix, fg=typer.colors.YELLOW)
+            else:
+                self._error_output(e, prefix)
+        except OSError as e:
+            self._not_found_output(e, prefix)
+        return self.returncode == 0
+
+    def cancel(self) -> None:
+        # Called from another thread. Popen.terminate would poll and could
+        # reap the child under timing.reap
+        self.cancelled = True
+        if self.process and self.process.returncode is None:
+            os.kill(self.process.pid, signal.SIGTERM)
 
 
 class Steps:
-    def __init__(self, steps: list = None) -> None:
+    max_workers = os.cpu_count() or 1
+    trace_file = None
+
+    def __init__(
+        self, steps: list = None, workers: int = None, name: str = None
+    ) -> None:
         self.steps = steps or []
+        self.workers = workers
+        # Named pipelines keep a checkpoint of completed steps so they can resume
+        self.name = name
 
     def add(self, steps: Union[list, Command]) -> None:
         try:
@@ -63,6 +249,177 @@ class Steps:
         except TypeError:
             self.steps += [steps]
 
-    def run(self, verbose=False) -> None:
+    def _graph(self) -> dict:
+        names = {}
         for step in self.steps:
-            step.run()
+            # a name shared by several steps can't be depended on
+            names[step.name] = None if step.name in names else step
+
+        graph = {}
+        for index, step in enumerate(self.steps):
+            if step.depends_on is None:
+                graph[step] = {self.steps[index - 1]} if index else set()
+                continue
+            graph[step] = set()
+            for name in step.depends_on:
+                if names.get(name) is None:
+                    raise ValueError(f"Unknown or ambiguous step {name!r}")
+                graph[step].add(names[name])
+        return graph
+
+    def _is_sequential(self, graph: dict) -> bool:
+        return all(
+            graph[step] == ({self.steps[index - 1]} if index else set())
+            for index, step in enumerate(self.steps)
+        )
+
+    def _ordered(self, graph: dict) -> list:
+        ordered = []
+        pending = list(self.steps)
+        while pending:
+            ready = [s for s in pending if graph[s] <= set(ordered)]
+            if not ready:
+                raise ValueError("Steps have circular dependencies")
+            ordered.append(ready[0])
+            pending.remove(ready[0])
+        return ordered
+
+    def _checkpoint_file(self):
+        return project_dir() / "checkpoints" / f"{self.name}.json"
+
+    def _signature(self) -> str:
+        commands = "\n".join(step.command for step in self.steps)
+        return hashlib.sha1(commands.encode()).hexdigest()
+
+    def _load_checkpoint(self) -> set:
+        checkpoint = read_json(self._checkpoint_file(), {})
+        if checkpoint.get("signature") != self._signature():
+            typer.secho(
+                f"No checkpoint to resume {self.name} from, running every step",
+                fg=typer.colors.YELLOW,
+            )
+            return set()
+        return {self.steps[index] for index in checkpoint["completed"]}
+
+    def _save_checkpoint(self, done: set) -> None:
+        write_json(
+            self._checkpoint_file(),
+            {
+                "signature": self._signature(),
+                "completed": [i for i, step in enumerate(self.steps) if step in done],
+            },
+        )
+
+    def _skip_output(self, step) -> None:
+        typer.secho(
+            f"⏭  Skipping {step.name}, it completed in the previous run",
+            fg=typer.colors.CYAN,
+        )
+
+    def _run_step(self, step: Command, prefix: bool = False) -> bool:
+        started = timing.now()
+        try:
+            return step.run(prefix=prefix)
+        finally:
+            finished = timing.now()
+            step.duration = finished - started
+            timing.trace(
+                step.name,
+                started,
+                finished,
+                command=step.command,
+                returncode=step.returncode,
+                peak_rss=step.peak_rss,
+            )
+
+    def _run_sequential(self, graph: dict, done: set) -> Optional[Command]:
+        for step in self._ordered(graph):
+            if step in done:
+                self._skip_output(step)
+            elif self._run_step(step):
+                done.add(step)
+            else:
+                return step
+        return None
+
+    def _run_parallel(self, graph: dict, done: set, workers: int) -> Optional[Command]:
+        pending = [step for step in self.steps if step not in done]
+        for step in self.steps:
+            if step in done:
+                self._skip_output(step)
+        failed = None
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while (pending and not failed) or running:
+                if not failed:
+                    for step in [s for s in pending if graph[s] <= done]:
+                        pending.remove(step)
+                        running[executor.submit(self._run_step, step, True)] = step
+                if not running:
+                    raise ValueError("Steps have circular dependencies")
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    if future.result():
+                        done.add(step)
+                    else:
+                        failed = failed or step
+        return failed
+
+    def _replay(self, step: Command, parallel: bool) -> None:
+        if parallel:
+            # the failure is buried in the other steps' output
+            typer.secho(
+                f"📜 Last {len(step.tail)} lines from {step.name}:",
+                fg=typer.colors.CYAN,
+            )
+            for line in step.tail:
+                typer.echo(line)
+        typer.secho(f"📜 Full output of {step.name} is in {step.log_file}")
+
+    def _command_name(self) -> str:
+        # the CLI command being run, e.g. "db snapshot"
+        ctx = click.get_current_context(silent=True)
+        if ctx is None:
+            return self.name or "steps"
+        return ctx.command_path.partition(" ")[2] or ctx.command_path
+
+    def run(self, verbose=False, resume=False) -> None:
+        graph = self._graph()
+        done = self._load_checkpoint() if self.name and resume else set()
+        workers = self.workers or self.max_workers
+        skipped = set(done)
+        started = timing.now()
+        try:
+            sequential = workers <= 1 or self._is_sequential(graph)
+            if sequential:
+                failed = self._run_sequential(graph, done)
+            else:
+                failed = self._run_parallel(graph, done, workers)
+        finally:
+            finished = timing.now()
+            timing.trace(self.name or "steps", started, finished)
+            if self.trace_file:
+                timing.write_trace(self.trace_file)
+        if len(self.steps) > 1:
+            timing.summary(self.steps, skipped, finished - started)
+        history.record(
+            self._command_name(),
+            [step for step in self.steps if step not in skipped],
+            finished - started,
+            failed.returncode if failed else 0,
+        )
+
+        if failed is None:
+            if self.name:
+                remove(self._checkpoint_file())
+            return
+        if failed.log_file:
+            self._replay(failed, parallel=not sequential)
+        if self.name:
+            self._save_checkpoint(done)
+            typer.secho(
+                f"💥 {failed.name} failed, rerun with --resume to continue from there 💥",
+                fg=typer.colors.BRIGHT_RED,
+            )
+        raise typer.Exit(code=failed.returncode)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import array
+import importlib
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+import traceback
+from typing import Optional
+
+from legl_dev.client import MESSAGE, socket_path
+
+IDLE_TIMEOUT = 60 * 60 * 4
+START_TIMEOUT = 10
+# Imported up front so the commands that import them lazily start fast too
+WARM_IMPORTS = ["black", "isort", "isort.settings"]
+
+
+def _pid_file() -> str:
+    return socket_path() + ".pid"
+
+
+def _source_mtime() -> float:
+    package = os.path.dirname(os.path.abspath(__file__))
+    return max(
+        os.stat(os.path.join(package, name)).st_mtime
+        for name in os.listdir(package)
+        if name.endswith(".py")
+    )
+
+
+def pid() -> Optional[int]:
+    try:
+        with open(_pid_file()) as f:
+            daemon_pid = int(f.read())
+        os.kill(daemon_pid, 0)
+    except (OSError, ValueError):
+        return None
+    return daemon_pid
+
+
+def start() -> Optional[int]:
+    subprocess.Popen(
+        [sys.executable, "-m", "legl_dev.daemon"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        # the pid file is written once the socket is listening
+        if pid():
+            return pid()
+        time.sleep(0.05)
+    return None
+
+
+def stop() -> bool:
+    daemon_pid = pid()
+    if daemon_pid is None:
+        return False
+    os.kill(daemon_pid, signal.SIGTERM)
+    deadline = time.monotonic() + START_TIMEOUT
+    while pid() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return True
+
+
+def _read_request(connection: socket.socket):
+    fd_size = array.array("i").itemsize
+    header, ancdata, _, _ = connection.recvmsg(4, socket.CMSG_LEN(3 * fd_size))
+    fds = array.array("i")
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fd_size)])
+    (length,) = struct.unpack("!I", header)
+    body = b""
+    while len(body) < length:
+        chunk = connection.recv(length - len(body))
+        if not chunk:
+            raise ConnectionError("The client went away")
+        body += chunk
+    return json.loads(body), list(fds)
+
+
+def _run(connection: socket.socket) -> int:
+    from legl_dev import main
+
+    request, fds = _read_request(connection)
+    for fd, target in zip(fds, (0, 1, 2)):
+        os.dup2(fd, target)
+        os.close(fd)
+    sys.stdin = os.fdopen(0, "r", closefd=False)
+    sys.stdout = os.fdopen(1, "w", buffering=1, closefd=False)
+    sys.stderr = os.fdopen(2, "w", buffering=1, closefd=False)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    os.environ.update(main.docker_env)
+
+    # the client forwards its signals to this process group
+    connection.sendall(MESSAGE.pack(b"p", os.getpid()))
+    try:
+        main.app(args=request["argv"], prog_name="legl-dev")
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+    except BaseException:
+        traceback.print_exc()
+    return 1
+
+
+def _fork(server: socket.socket, connection: socket.socket) -> None:
+    if os.fork():
+        connection.close()
+        return
+    code = 1
+    try:
+        server.close()
+        os.setpgid(0, 0)
+        for signum in (signal.SIGCHLD, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        code = _run(connection)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            connection.sendall(MESSAGE.pack(b"x", code))
+        except (OSError, ValueError):
+            pass
+        os._exit(0)
+
+
+def serve() -> None:
+    from legl_dev import main, release  # noqa: F401
+
+    for module in WARM_IMPORTS:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    release.current_version()
+    mtime = _source_mtime()
+
+    path = socket_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the socket runs commands as us, so it's never accessible to anyone else,
+    # not even between bind and a chmod
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    server.settimeout(IDLE_TIMEOUT)
+    with open(_pid_file(), "w") as f:
+        f.write(str(os.getpid()))
+
+    # children are never waited on, so let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    restart = False
+    try:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                break
+            if _source_mtime() != mtime:
+                # legl-dev changed under us, the client falls back while we restart
+                connection.close()
+                restart = True
+                break
+            _fork(server, connection)
+    finally:
+        server.close()
+        if pid() == os.getpid():
+            os.unlink(path)
+            os.unlink(_pid_file())
+    if restart:
+        os.execv(sys.executable, [sys.executable, "-m", "legl_dev.daemon"])
+
+
+if __name__ == "__main__":
+    serve()
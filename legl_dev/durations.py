@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import heapq
+import os
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, List, Tuple
+
+from legl_dev import fingerprint
+from legl_dev.cache import project_dir, read_json, write_json
+
+# Written by pytest inside the backend container, which mounts the repo at /code
+JUNIT_FILE = ".legl-dev-junit.xml"
+# A pytest plugin tagging each test with the xdist worker that ran it, so a
+# parallel run can report what each worker actually did
+PLUGIN_DIR = ".legl-dev-plugins"
+WORKER_PLUGIN = "legl_dev_workers"
+WORKER_PROPERTY = "xdist_worker"
+WORKER_PLUGIN_SOURCE = f"""import os
+
+
+def pytest_runtest_setup(item):
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "master")
+    if ({WORKER_PROPERTY!r}, worker) not in item.user_properties:
+        item.user_properties.append(({WORKER_PROPERTY!r}, worker))
+"""
+TEST_FILES = ["**/test_*.py", "**/*_test.py"]
+DEFAULT_DURATION = 1.0
+
+
+def _durations_file():
+    return project_dir() / "durations.json"
+
+
+def _module_file(classname: str) -> str:
+    # junit classnames are dotted module paths, optionally followed by classes
+    parts = classname.split(".")
+    for end in range(len(parts), 0, -1):
+        candidate = "/".join(parts[:end]) + ".py"
+        if os.path.exists(candidate):
+            return candidate
+    return "/".join(parts) + ".py"
+
+
+def load() -> Dict[str, Dict[str, float]]:
+    return read_json(_durations_file(), {"tests": {}, "modules": {}})
+
+
+def with_worker_plugin(pytest_args: str) -> str:
+    # a shell script for the container, which has to find the plugin without
+    # losing its own PYTHONPATH
+    os.makedirs(PLUGIN_DIR, exist_ok=True)
+    with open(os.path.join(PLUGIN_DIR, f"{WORKER_PLUGIN}.py"), "w") as f:
+        f.write(WORKER_PLUGIN_SOURCE)
+    return (
+        f"PYTHONPATH=/code/{PLUGIN_DIR}${{PYTHONPATH:+:$PYTHONPATH}} "
+        f"exec {pytest_args} -p {WORKER_PLUGIN}"
+    )
+
+
+def record(
+    path: str = JUNIT_FILE,
+) -> Tuple[Dict[str, float], Dict[str, Dict[str, float]]]:
+    # returns the seconds per module, and per module for each xdist worker
+    # when the worker plugin was loaded
+    if not os.path.exists(path):
+        return {}, {}
+    durations = load()
+    modules, workers = {}, {}
+    for case in ElementTree.parse(path).iter("testcase"):
+        module = _module_file(case.get("classname", ""))
+        seconds = float(case.get("time") or 0)
+        durations["tests"][f"{module}::{case.get('name')}"] = seconds
+        modules[module] = modules.get(module, 0) + seconds
+        worker = next(
+            (
+                prop.get("value")
+                for prop in case.iter("property")
+                if prop.get("name") == WORKER_PROPERTY
+            ),
+            None,
+        )
+        if worker:
+            worker_modules = workers.setdefault(worker, {})
+            worker_modules[module] = worker_modules.get(module, 0) + seconds
+    os.remove(path)
+    durations["modules"].update(modules)
+    write_json(_durations_file(), durations)
+    return modules, workers
+
+
+def find_test_files(path: str = "") -> List[str]:
+    return [file for file in fingerprint.files(TEST_FILES) if file.startswith(path)]
+
+
+def estimate(files: List[str], modules: Dict[str, float]) -> Dict[str, float]:
+    known = [modules[file] for file in files if file in modules]
+    # files without history are assumed to take as long as an average one
+    default = sum(known) / len(known) if known else DEFAULT_DURATION
+    return {file: modules.get(file, default) for file in files}
+
+
+def balance(estimates: Dict[str, float], count: int) -> List[Tuple[float, List[str]]]:
+    # longest processing time first onto the least loaded shard
+    shards = [(0.0, index, []) for index in range(count)]
+    for file in sorted(estimates, key=lambda file: (-estimates[file], file)):
+        total, index, files = heapq.heappop(shards)
+        files.append(file)
+        heapq.heappush(shards, (total + estimates[file], index, files))
+    return [(total, files) for total, _, files in sorted(shards, key=lambda s: s[1])]
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    index, _, count = shard.partition("/")
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard {shard} is out of range")
+    return index, count
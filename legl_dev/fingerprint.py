@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import hashlib
+import pathlib
+import threading
+import time
+from typing import Dict, List, Optional
+
+from legl_dev.cache import project_dir, read_json, write_json
+from legl_dev.command import capture_output
+
+IMAGE_INPUTS = [
+    "**/Dockerfile*",
+    "**/.dockerignore",
+    "**/docker-compose*.yml",
+    "**/docker-compose*.yaml",
+    "**/requirements*.txt",
+    "**/Pipfile.lock",
+    "**/poetry.lock",
+    "**/package.json",
+    "**/yarn.lock",
+]
+MIGRATION_INPUTS = ["**/migrations/*.py"]
+FACTORY_INPUTS = [
+    "**/factories.py",
+    "**/factories/**/*.py",
+    "**/management/commands/run_factories.py",
+    "**/management/commands/seed_emails.py",
+]
+
+_stage_lock = threading.Lock()
+
+
+def _git_files(patterns: List[str]) -> Optional[List[str]]:
+    output = capture_output(
+        ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard", "--"]
+        + [f":(glob){pattern}" for pattern in patterns]
+    )
+    if output is None:
+        return None
+    return [path for path in output.split("\0") if path]
+
+
+def files(patterns: List[str]) -> List[str]:
+    paths = _git_files(patterns)
+    if paths is None:
+        paths = [
+            str(path)
+            for pattern in patterns
+            for path in pathlib.Path(".").glob(pattern)
+            if path.is_file()
+        ]
+    return sorted(set(paths))
+
+
+def fingerprint(patterns: List[str]) -> str:
+    digest = hashlib.sha256()
+    for path in files(patterns):
+        try:
+            with open(path, "rb") as f:
+                content = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            # deleted from the working tree but still in the index
+            continue
+        digest.update(f"{path}\0{content}\0".encode())
+    return digest.hexdigest()
+
+
+def migrations_by_app() -> Dict[str, List[str]]:
+    # the app is the directory holding the migrations package
+    apps = {}
+    for path in files(MIGRATION_INPUTS):
+        parts = pathlib.PurePath(path).parts
+        if parts[-1] == "__init__.py":
+            continue
+        app = parts[-3] if len(parts) > 2 else "."
+        apps.setdefault(app, []).append(parts[-1][: -len(".py")])
+    return apps
+
+
+class StageCache:
+    def __init__(self, name: str) -> None:
+        self.file = project_dir() / f"{name}.json"
+
+    def get(self, stage: str) -> Optional[dict]:
+        return read_json(self.file, {}).get(stage)
+
+    def record(self, stage: str, fingerprint: str, **details) -> None:
+        with _stage_lock:
+            stages = read_json(self.file, {})
+            stages[stage] = {
+                "fingerprint": fingerprint,
+                "recorded_at": time.time(),
+                **details,
+            }
+            write_json(self.file, stages)
+
+    def forget(self, stage: str) -> None:
+        with _stage_lock:
+            stages = read_json(self.file, {})
+            if stages.pop(stage, None) is not None:
+                write_json(self.file, stages)
+
+
+def format_time(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+import dataclasses
+import hashlib
+import io
+import os
+import pathlib
+import re
+import shlex
+import subprocess
+import tokenize
+from typing import List, Optional, Tuple
+
+import typer
+from legl_dev import fingerprint
+from legl_dev.cache import project_dir, read_json, write_json
+from legl_dev.command import Command, capture_output
+
+PYTHON_EXTENSIONS = {".py", ".pyi"}
+PRETTIER_EXTENSIONS = {
+    ".css",
+    ".html",
+    ".js",
+    ".json",
+    ".jsx",
+    ".md",
+    ".scss",
+    ".ts",
+    ".tsx",
+    ".vue",
+    ".yaml",
+    ".yml",
+}
+# A change to any of these can change the formatted output of every file
+CONFIG_INPUTS = [
+    "pyproject.toml",
+    "setup.cfg",
+    ".isort.cfg",
+    ".editorconfig",
+    ".prettierrc*",
+    ".prettierignore",
+    "prettier.config.*",
+    "package.json",
+    "yarn.lock",
+]
+
+
+def changed_files() -> List[str]:
+    output = capture_output(
+        ["git", "status", "--porcelain", "-z", "--untracked-files=all"]
+    )
+    entries = iter((output or "").split("\0"))
+    files = []
+    for entry in entries:
+        if not entry:
+            continue
+        status, path = entry[:2], entry[3:]
+        if "R" in status or "C" in status:
+            # renames and copies are followed by the original path
+            next(entries, None)
+        if "D" not in status and os.path.isfile(path):
+            files.append(path)
+    return sorted(files)
+
+
+def route(files: List[str]) -> Tuple[List[str], List[str]]:
+    python, prettier = [], []
+    for file in files:
+        extension = os.path.splitext(file)[1]
+        if extension in PYTHON_EXTENSIONS:
+            python.append(file)
+        elif extension in PRETTIER_EXTENSIONS:
+            prettier.append(file)
+    return python, prettier
+
+
+def _hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class FormatCache:
+    def __init__(self) -> None:
+        self.file = project_dir() / "format.json"
+        self.config = fingerprint.fingerprint(CONFIG_INPUTS)
+        cache = read_json(self.file, {})
+        self.hashes = (
+            cache.get("files", {}) if cache.get("config") == self.config else {}
+        )
+
+    def pending(self, files: List[str]) -> List[str]:
+        return [file for file in files if self.hashes.get(file) != _hash(file)]
+
+    def record(self, files: List[str]) -> None:
+        for file in files:
+            if os.path.isfile(file):
+                self.hashes[file] = _hash(file)
+        write_json(self.file, {"config": self.config, "files": self.hashes})
+
+
+# Each pool worker pays for importing isort and black, so it needs at least
+# this many files to be worth starting
+POOL_THRESHOLD = 16
+
+# [tool.black] settings that are Mode fields, the skip_ ones are inverted
+BLACK_MODE_SETTINGS = {
+    "target_version": "target_versions",
+    "line_length": "line_length",
+    "pyi": "is_pyi",
+    "skip_source_first_line": "skip_source_first_line",
+    "skip_string_normalization": "string_normalization",
+    "skip_magic_trailing_comma": "magic_trailing_comma",
+    "python_cell_magics": "python_cell_magics",
+    "preview": "preview",
+    "unstable": "unstable",
+    "enable_unstable_feature": "enabled_features",
+}
+# Settings that pick the files rather than change the output
+BLACK_FILE_SETTINGS = {"include", "exclude", "extend_exclude", "force_exclude"}
+# Settings that only change how the CLI runs
+BLACK_CLI_SETTINGS = {
+    "check",
+    "diff",
+    "color",
+    "fast",
+    "quiet",
+    "verbose",
+    "workers",
+    "cache_dir",
+    "no_cache",
+    "src",
+    "required_version",
+}
+
+_isort_config = None
+_black_config = None
+_black_mode = None
+
+
+def _black_settings(root: str) -> dict:
+    import black
+
+    pyproject = black.find_pyproject_toml((root,))
+    return black.parse_pyproject_toml(pyproject) if pyproject else {}
+
+
+def _mode_value(black, setting: str, value):
+    if setting == "target_version":
+        return {black.TargetVersion[version.upper()] for version in value}
+    if setting in ("skip_string_normalization", "skip_magic_trailing_comma"):
+        return not value
+    if setting == "python_cell_magics":
+        return set(value)
+    if setting == "enable_unstable_feature":
+        return {black.Preview[feature] for feature in value}
+    return value
+
+
+def _setup_formatters(root: str) -> None:
+    # Mirror `isort . --profile black` and `black .` run from the repo root.
+    # Raises ValueError for black settings that can't be mirrored in-process
+    global _isort_config, _black_config, _black_mode
+    import black
+    from isort.settings import Config
+
+    config = _black_settings(root)
+    fields = {field.name for field in dataclasses.fields(black.Mode)}
+    for setting in config:
+        if setting in BLACK_FILE_SETTINGS | BLACK_CLI_SETTINGS:
+            continue
+        if BLACK_MODE_SETTINGS.get(setting) not in fields:
+            raise ValueError(f"black's {setting} setting isn't supported in-process")
+    required = config.get("required_version")
+    if required and required not in (
+        black.__version__,
+        black.__version__.split(".")[0],
+    ):
+        raise ValueError(
+            f"black {required} is required, {black.__version__} is installed"
+        )
+    try:
+        _black_mode = black.Mode(
+            **{
+                BLACK_MODE_SETTINGS[setting]: _mode_value(black, setting, value)
+                for setting, value in config.items()
+                if setting in BLACK_MODE_SETTINGS
+            }
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"black's settings can't be used in-process: {e}")
+    _black_config = config
+    _isort_config = Config(settings_path=root, profile="black")
+
+
+def _black_excludes(explicit: bool) -> List[re.Pattern]:
+    # only force-exclude applies to files given by name, like on the CLI
+    import black
+
+    if explicit:
+        keys = ["force_exclude"]
+    else:
+        keys = ["exclude", "extend_exclude", "force_exclude"]
+    patterns = [_black_config[key] for key in keys if _black_config.get(key)]
+    if not explicit and not _black_config.get("exclude"):
+        patterns.append(black.DEFAULT_EXCLUDES)
+    return [black.re_compile_maybe_verbose(pattern) for pattern in patterns]
+
+
+def _decode(source: bytes) -> Tuple[str, str, str]:
+    # Same as black's decode_bytes, whose signature changes between releases
+    buffer = io.BytesIO(source)
+    encoding, lines = tokenize.detect_encoding(buffer.readline)
+    if not lines:
+        return "", encoding, "\n"
+    newline = "\r\n" if lines[0][-2:] == b"\r\n" else "\n"
+    buffer.seek(0)
+    with io.TextIOWrapper(buffer, encoding) as wrapper:
+        return wrapper.read(), encoding, newline
+
+
+def format_file(path: str, sort_imports: bool = True, blacken: bool = True):
+    # isort then black in a single read and write, returns (path, changed, error)
+    import black
+    import isort
+
+    try:
+        with open(path, "rb") as f:
+            source, encoding, newline = _decode(f.read())
+        formatted = source
+        if sort_imports:
+            formatted = isort.code(
+                formatted,
+                config=_isort_config,
+                file_path=pathlib.Path(path),
+                disregard_skip=True,
+            )
+        if blacken:
+            # black formats stubs differently, like it does from the CLI
+            mode = dataclasses.replace(
+                _black_mode, is_pyi=_black_mode.is_pyi or path.endswith(".pyi")
+            )
+            header = ""
+            if mode.skip_source_first_line:
+                header = (formatted.splitlines(keepends=True) or [""])[0]
+            try:
+                formatted = header + black.format_file_contents(
+                    formatted[len(header) :], fast=False, mode=mode
+                )
+            except black.NothingChanged:
+                pass
+    except Exception as e:
+        return path, False, f"{type(e).__name__}: {e}"
+    if formatted == source:
+        return path, False, None
+    with open(path, "w", encoding=encoding, newline=newline) as f:
+        f.write(formatted)
+    return path, True, None
+
+
+class PythonFormatter(Command):
+    def __init__(
+        self,
+        files: Optional[List[str]] = None,
+        name: str = "isort+black",
+        depends_on: Optional[List[str]] = None,
+    ) -> None:
+        # Without files every Python file is formatted, like `isort .` and `black .`
+        self.files = files
+        super().__init__(
+            command="isort --profile black + black (in-process) "
+            + ("." if files is None else " ".join(files)),
+            name=name,
+            depends_on=depends_on,
+        )
+
+    def _plan(self) -> List[Tuple[str, bool, bool]]:
+        import black
+
+        excludes = _black_excludes(explicit=self.files is not None)
+        if self.files is not None:
+            return [
+                (file, True, not any(e.search(f"/{file}") for e in excludes))
+                for file in self.files
+            ]
+        include = black.re_compile_maybe_verbose(
+            _black_config.get("include") or black.DEFAULT_INCLUDES
+        )
+        plan = []
+        for file in fingerprint.files(["**/*.py", "**/*.pyi"]):
+            sort_imports = not _isort_config.is_skipped(pathlib.Path(file))
+            blacken = include.search(f"/{file}") and not any(
+                exclude.search(f"/{file}") for exclude in excludes
+            )
+            if sort_imports or blacken:
+                plan.append((file, sort_imports, bool(blacken)))
+        return plan
+
+    def _format(self, plan: List[Tuple[str, bool, bool]]) -> list:
+        workers = min(os.cpu_count() or 1, len(plan) // POOL_THRESHOLD)
+        if workers <= 1:
+            return [format_file(*item) for item in plan]
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            # spawn rather than fork, Steps may be running other threads
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_setup_formatters,
+            initargs=(os.getcwd(),),
+        ) as pool:
+            return list(
+                pool.map(
+                    format_file,
+                    *zip(*plan),
+                    chunksize=max(1, len(plan) // (workers * 4)),
+                )
+            )
+
+    def _run_cli(self, reason: str, prefix: bool) -> bool:
+        self._echo(
+            f"⚠️  {reason}, running isort and black as commands",
+            prefix=prefix,
+            fg=typer.colors.YELLOW,
+        )
+        targets = "." if self.files is None else " ".join(map(shlex.quote, self.files))
+        for command in (f"isort {targets} --profile black", f"black {targets}"):
+            step = Command(command=command, shell=True, name=self.name)
+            passed = step.run(prefix)
+            self.returncode, self.log_file, self.tail = (
+                step.returncode,
+                step.log_file,
+                step.tail,
+            )
+            if not passed:
+                return False
+        return True
+
+    def run(self, prefix: bool = False) -> bool:
+        self._command_output(prefix)
+        try:
+            _setup_formatters(os.getcwd())
+        except ValueError as e:
+            return self._run_cli(str(e), prefix)
+        results = self._format(self._plan())
+        changed = [path for path, was_changed, _ in results if was_changed]
+        failed = [(path, error) for path, _, error in results if error]
+        for path in changed:
+            self._echo(f"reformatted {path}", prefix=prefix)
+        for path, error in failed:
+            self._echo(
+                f"error: cannot format {path}: {error}",
+                prefix=prefix,
+                fg=typer.colors.RED,
+            )
+        self._echo(
+            f"{len(changed)} files reformatted, "
+            f"{len(results) - len(changed) - len(failed)} files left unchanged"
+            + (f", {len(failed)} files failed to reformat" if failed else ""),
+            prefix=prefix,
+        )
+        self.returncode = 1 if failed else 0
+        if failed:
+            self._error_output(
+                subprocess.CalledProcessError(self.returncode, self.command), prefix
+            )
+        else:
+            self._success_output(prefix)
+        return not failed
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from legl_dev.cache import project_dir
+
+# Runs kept per command and step, older ones are pruned every PRUNE_EVERY writes
+RETENTION = 200
+PRUNE_EVERY = 50
+RECENT_RUNS = 5
+BASELINE_RUNS = 30
+# The recent median has to be this much slower than the baseline's to be flagged
+REGRESSION_RATIO = 1.25
+REGRESSION_SECONDS = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS steps (
+    id INTEGER PRIMARY KEY,
+    recorded_at REAL NOT NULL,
+    command TEXT NOT NULL,
+    step TEXT NOT NULL,
+    duration REAL NOT NULL,
+    returncode INTEGER,
+    peak_rss INTEGER
+);
+CREATE INDEX IF NOT EXISTS steps_by_key ON steps (command, step, id);
+"""
+
+
+def _history_file():
+    return project_dir() / "history.sqlite3"
+
+
+def _connect() -> sqlite3.Connection:
+    path = _history_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=1)
+    # a crash can lose the last run, which is fine for timing history
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _prune(connection: sqlite3.Connection, retention: int) -> None:
+    connection.execute(
+        "DELETE FROM steps WHERE id IN ("
+        "SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+        "(PARTITION BY command, step ORDER BY id DESC) AS age FROM steps) "
+        "WHERE age > ?)",
+        (retention,),
+    )
+
+
+def record(
+    command: str, steps: List, wall_time: float, returncode: Optional[int]
+) -> None:
+    rows = [
+        (step.name, step.duration, step.returncode, step.peak_rss)
+        for step in steps
+        if step.duration is not None
+    ]
+    rows.append(("total", wall_time, returncode, None))
+    now = time.time()
+    try:
+        connection = _connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO steps "
+                "(recorded_at, command, step, duration, returncode, peak_rss) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(now, command) + row for row in rows],
+            )
+            (last,) = connection.execute("SELECT MAX(id) FROM steps").fetchone()
+            if last // PRUNE_EVERY != (last - len(rows)) // PRUNE_EVERY:
+                _prune(connection, RETENTION)
+        connection.close()
+    except (OSError, sqlite3.Error):
+        # history is a nice to have, it must never fail a run
+        pass
+
+
+def load(command: Optional[str] = None) -> Dict[Tuple[str, str], List[float]]:
+    if not _history_file().exists():
+        return {}
+    connection = _connect()
+    rows = connection.execute(
+        "SELECT command, step, duration FROM steps "
+        "WHERE returncode = 0 AND (? IS NULL OR command = ?) ORDER BY id",
+        (command, command),
+    )
+    durations = {}
+    for command_name, step, duration in rows:
+        durations.setdefault((command_name, step), []).append(duration)
+    connection.close()
+    return durations
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def regression(durations: List[float]) -> Optional[float]:
+    # compares the latest runs to a rolling baseline of the runs before them
+    recent = durations[-RECENT_RUNS:]
+    baseline = durations[-RECENT_RUNS - BASELINE_RUNS : -RECENT_RUNS]
+    if len(recent) < RECENT_RUNS or len(baseline) < RECENT_RUNS:
+        return None
+    recent_median, baseline_median = percentile(recent, 0.5), percentile(baseline, 0.5)
+    if (
+        recent_median > baseline_median * REGRESSION_RATIO
+        and recent_median - baseline_median > REGRESSION_SECONDS
+    ):
+        return recent_median / baseline_median - 1 if baseline_median else float("inf")
+    return None
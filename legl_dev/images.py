@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import pathlib
+import re
+import shlex
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import typer
+from legl_dev import fingerprint
+from legl_dev.cache import project_dir
+from legl_dev.command import Command, capture_output
+
+# The default docker driver can't export a cache, so builds go through a
+# BuildKit container and the images are loaded back into docker
+BUILDER = "legl-dev"
+DEFAULT_LIMIT_MB = 10240
+# An image is reused from the registry when its Dockerfile and these are unchanged
+LOCKFILES = [
+    "**/requirements*.txt",
+    "**/Pipfile.lock",
+    "**/poetry.lock",
+    "**/yarn.lock",
+    "**/package-lock.json",
+]
+# `--progress=plain` numbers every build step and reports a hit on its own line
+_STEP = re.compile(r"^#(\d+) \[[^\]]*\d+/\d+\]")
+_CACHED = re.compile(r"^#(\d+) CACHED\s*$")
+
+
+def cache_dir() -> pathlib.Path:
+    # outside docker, so the layers survive `docker system prune`
+    return project_dir() / "buildkit"
+
+
+def limit() -> int:
+    return int(os.environ.get("LEGL_DEV_BUILD_CACHE_LIMIT_MB", DEFAULT_LIMIT_MB)) << 20
+
+
+def services(docker_cmd: str) -> Optional[Dict[str, dict]]:
+    # the services compose builds, None when the config can't be read
+    output = capture_output(docker_cmd.split() + ["config", "--format", "json"])
+    if output is None:
+        return None
+    try:
+        config = json.loads(output)
+    except ValueError:
+        return None
+    built = {}
+    for name, service in config.get("services", {}).items():
+        if not service.get("build"):
+            continue
+        context = service["build"].get("context", ".")
+        built[name] = {
+            "image": service.get("image") or f"{config.get('name')}-{name}",
+            "context": context,
+            "dockerfile": os.path.join(
+                context, service["build"].get("dockerfile", "Dockerfile")
+            ),
+        }
+    return built
+
+
+def image_tag(dockerfile: str, context: str) -> str:
+    # paths are relative to the build context so every checkout agrees
+    context = os.path.abspath(context)
+    paths = [os.path.abspath(dockerfile)] + [
+        path
+        for path in map(os.path.abspath, fingerprint.files(LOCKFILES))
+        if path.startswith(os.path.join(context, ""))
+    ]
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                content = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            continue
+        digest.update(f"{os.path.relpath(path, context)}\0{content}\0".encode())
+    return digest.hexdigest()[:16]
+
+
+def _entries() -> List[pathlib.Path]:
+    # one directory per service and image fingerprint
+    return [
+        path
+        for path in cache_dir().glob("*/*")
+        if path.is_dir() and path.suffix not in (".new", ".old")
+    ]
+
+
+def _source(cache: pathlib.Path) -> Optional[pathlib.Path]:
+    # the cache for these inputs, or the service's most recent one after a
+    # branch switch or a lockfile change
+    if cache.exists():
+        return cache
+    previous = [path for path in _entries() if path.parent == cache.parent]
+    return max(previous, key=lambda path: path.stat().st_mtime, default=None)
+
+
+def _size(path: pathlib.Path) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def hit_rate(log_file: Optional[pathlib.Path]) -> Tuple[int, int]:
+    steps, cached = set(), set()
+    try:
+        with open(log_file, errors="replace") as f:
+            for line in f:
+                match = _STEP.match(line)
+                if match:
+                    steps.add(match.group(1))
+                match = _CACHED.match(line)
+                if match:
+                    cached.add(match.group(1))
+    except (OSError, TypeError):
+        pass
+    return len(cached & steps), len(steps)
+
+
+def _swap(new: pathlib.Path, cache: pathlib.Path) -> None:
+    # BuildKit only ever adds to a local cache, writing a fresh one and
+    # replacing the old keeps just the layers the last build used
+    if not new.exists():
+        return
+    old = cache.with_name(cache.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if cache.exists():
+        os.replace(cache, old)
+    os.replace(new, cache)
+    shutil.rmtree(old, ignore_errors=True)
+    os.utime(cache)
+
+
+class BakeService(Command):
+    def __init__(
+        self,
+        service: str,
+        image: str,
+        digest: str,
+        no_cache: bool = False,
+        depends_on: Optional[List[str]] = None,
+        remote: Optional[str] = None,
+        push: bool = False,
+    ) -> None:
+        self.service = service
+        self.image = image
+        # the registry image to reuse, and whether to push it on a miss
+        self.remote = remote
+        self.push = push
+        self.pulled = False
+        self.cache = cache_dir() / service / digest[:16]
+        self.new_cache = self.cache.with_name(self.cache.name + ".new")
+        source = _source(self.cache)
+        args = [
+            "docker",
+            "buildx",
+            "bake",
+            f"--builder={BUILDER}",
+            "--progress=plain",
+            "--load",
+            "--set",
+            f"{service}.tags={image}",
+            "--set",
+            f"{service}.cache-to=type=local,dest={self.new_cache},mode=max",
+        ]
+        if source:
+            args += ["--set", f"{service}.cache-from=type=local,src={source}"]
+        if no_cache:
+            args.append("--no-cache")
+        super().__init__(
+            command=" ".join(shlex.quote(arg) for arg in args + [service]),
+            shell=True,
+            name=f"build {service}",
+            depends_on=depends_on,
+        )
+        self.cached = self.total = None
+
+    def _pull(self, prefix: bool) -> bool:
+        self._echo(f"⬇️  Pulling {self.remote}", prefix=prefix, fg=typer.colors.CYAN)
+        if capture_output(["docker", "pull", self.remote]) is None:
+            self._echo(
+                f"🔨 {self.remote} isn't in the registry, building it",
+                prefix=prefix,
+                fg=typer.colors.CYAN,
+            )
+            return False
+        return capture_output(["docker", "tag", self.remote, self.image]) is not None
+
+    def _push(self, prefix: bool) -> None:
+        for args in (
+            ["docker", "tag", self.image, self.remote],
+            ["docker", "push", self.remote],
+        ):
+            if capture_output(args) is None:
+                # the image was built, only sharing it failed
+                self._echo(
+                    f"⚠️  Couldn't push {self.remote}",
+                    prefix=prefix,
+                    fg=typer.colors.YELLOW,
+                )
+                return
+        self._echo(f"⬆️  Pushed {self.remote}", prefix=prefix, fg=typer.colors.GREEN)
+
+    def run(self, prefix: bool = False) -> bool:
+        if self.remote and self._pull(prefix):
+            self.pulled = True
+            self.returncode = 0
+            self._echo(
+                f"✅ Reused {self.remote} as {self.image}",
+                prefix=prefix,
+                fg=typer.colors.GREEN,
+            )
+            return True
+        shutil.rmtree(self.new_cache, ignore_errors=True)
+        if not super().run(prefix):
+            shutil.rmtree(self.new_cache, ignore_errors=True)
+            return False
+        self.cached, self.total = hit_rate(self.log_file)
+        _swap(self.new_cache, self.cache)
+        if self.remote and self.push:
+            self._push(prefix)
+        return True
+
+
+def build_steps(
+    docker_cmd: str,
+    digest: str,
+    no_cache: bool = False,
+    registry: Optional[str] = None,
+    push: bool = False,
+) -> List[Command]:
+    # every service is baked on its own so they build in parallel and each
+    # gets its own cache, without a config it falls back to compose
+    targets = services(docker_cmd)
+    if not targets:
+        return [
+            Command(
+                command=f"{docker_cmd} build {'--no-cache' if no_cache else ''}",
+                name="build images",
+            )
+        ]
+    builder = Command(
+        command=(
+            f"docker buildx inspect {BUILDER} >/dev/null 2>&1 || "
+            f"docker buildx create --name {BUILDER} --driver docker-container"
+        ),
+        shell=True,
+        name="create builder",
+    )
+    return [builder] + [
+        BakeService(
+            service,
+            info["image"],
+            digest,
+            no_cache=no_cache,
+            depends_on=[builder.name],
+            # --no-cache asks for a fresh build, not someone else's
+            remote=(
+                f"{registry.rstrip('/')}/{service}:"
+                f"{image_tag(info['dockerfile'], info['context'])}"
+                if registry and not no_cache
+                else None
+            ),
+            push=push,
+        )
+        for service, info in sorted(targets.items())
+    ]
+
+
+def prune(
+    max_size: Optional[int] = None, keep: Optional[List[pathlib.Path]] = None
+) -> List[str]:
+    max_size = limit() if max_size is None else max_size
+    keep = keep or []
+    entries = sorted(_entries(), key=lambda path: path.stat().st_mtime)
+    sizes = {path: _size(path) for path in entries}
+    total = sum(sizes.values())
+    removed = []
+    # least recently built first, the caches just written are kept
+    for path in entries:
+        if total <= max_size:
+            break
+        if path in keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= sizes[path]
+        removed.append(f"{path.parent.name}/{path.name}")
+    return removed
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import fnmatch
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from legl_dev.cache import project_dir, read_json, write_json
+from legl_dev.command import capture_output
+
+# Written by pytest-cov inside the backend container, which mounts the repo at /code
+COVERAGE_FILE = ".legl-dev-coverage"
+CONTAINER_ROOT = "/code/"
+COVERAGE_ARGS = "--cov=/code --cov-context=test --cov-report="
+MAX_AGE = 60 * 60 * 24 * 14
+
+# Changes to any of these can affect tests the coverage map knows nothing about
+FULL_RUN_TRIGGERS = [
+    "*settings*.py",
+    "*conftest.py",
+    "*/migrations/*.py",
+    "requirements*.txt",
+    "pytest.ini",
+    "setup.cfg",
+    "pyproject.toml",
+    "tox.ini",
+    "*Dockerfile*",
+    "docker-compose*.yml",
+]
+# Changes to these can't affect the tests. Anything else that isn't Python and
+# isn't in the coverage map, like templates or fixtures, runs the full suite
+NO_TEST_IMPACT = ["*.md", "*.rst", "*.txt", "LICENSE*", "*.gitignore", "docs/*"]
+
+
+def _map_file():
+    return project_dir() / "impact.json"
+
+
+def _head() -> Optional[str]:
+    output = capture_output(["git", "rev-parse", "HEAD"])
+    return output.strip() if output else None
+
+
+def is_test_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.endswith(".py") and (
+        name.startswith("test_") or name.endswith("_test.py") or "/tests/" in path
+    )
+
+
+def changed_files(since: str = "HEAD") -> Set[str]:
+    changed = set()
+    for args in (
+        ["git", "diff", "--name-only", since],
+        ["git", "ls-files", "--others", "--exclude-standard"],
+    ):
+        changed.update((capture_output(args) or "").splitlines())
+    return changed
+
+
+def read_coverage(path: str = COVERAGE_FILE) -> Dict[str, Set[str]]:
+    connection = sqlite3.connect(path)
+    tables = {
+        row[0]
+        for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
+        )
+    }
+    covered = {}
+    for table in {"line_bits", "arc"} & tables:
+        rows = connection.execute(
+            "SELECT DISTINCT context.context, file.path "
+            f"FROM {table} "
+            f"JOIN context ON context.id = {table}.context_id "
+            f"JOIN file ON file.id = {table}.file_id"
+        )
+        for context, file in rows:
+            # contexts look like "app/tests/test_x.py::test_y|run"
+            test = context.partition("|")[0]
+            if not test:
+                continue
+            if file.startswith(CONTAINER_ROOT):
+                file = file[len(CONTAINER_ROOT) :]
+            covered.setdefault(test, set()).add(file)
+    connection.close()
+    return covered
+
+
+def record(full: bool, path: str = COVERAGE_FILE) -> bool:
+    if not os.path.exists(path):
+        return False
+    covered = read_coverage(path)
+    os.remove(path)
+    impact_map = {} if full else read_json(_map_file(), {})
+    tests = impact_map.get("tests", {})
+    tests.update({test: sorted(files) for test, files in covered.items()})
+    write_json(
+        _map_file(),
+        {
+            # only a full run vouches for the whole map
+            "commit": _head() if full else impact_map.get("commit"),
+            "updated_at": time.time() if full else impact_map.get("updated_at"),
+            "tests": tests,
+        },
+    )
+    return True
+
+
+def _is_stale(impact_map: dict) -> bool:
+    if time.time() - (impact_map.get("updated_at") or 0) > MAX_AGE:
+        return True
+    commit = impact_map.get("commit")
+    return not commit or (
+        capture_output(["git", "merge-base", "--is-ancestor", commit, "HEAD"]) is None
+    )
+
+
+def matches(path: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def _triggers(changed: Iterable[str]) -> List[str]:
+    return [path for path in changed if matches(path, FULL_RUN_TRIGGERS)]
+
+
+def select(changed: Set[str]) -> Tuple[Optional[List[str]], str]:
+    impact_map = read_json(_map_file(), {})
+    if not impact_map.get("tests"):
+        return None, "no coverage map yet, running the full suite to build one"
+    if _is_stale(impact_map):
+        return None, "the coverage map is stale, running the full suite to rebuild it"
+    triggers = _triggers(changed)
+    if triggers:
+        return None, f"{triggers[0]} changed, running the full suite"
+
+    covered = {file for files in impact_map["tests"].values() for file in files}
+    unknown = sorted(
+        path
+        for path in changed
+        if not path.endswith(".py")
+        and path not in covered
+        and not matches(path, NO_TEST_IMPACT)
+    )
+    if unknown:
+        return None, f"{unknown[0]} isn't in the coverage map, running the full suite"
+
+    selected = {
+        test.split("[")[0]
+        for test, files in impact_map["tests"].items()
+        if changed.intersection(files)
+    }
+    changed_tests = {
+        path for path in changed if is_test_file(path) and os.path.exists(path)
+    }
+    # whole files already cover the individual tests inside them
+    selected = {
+        test for test in selected if test.partition("::")[0] not in changed_tests
+    } | changed_tests
+    return (
+        sorted(selected),
+        f"{len(selected)} tests affected by {len(changed)} changed files",
+    )
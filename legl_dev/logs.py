@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import queue
+import re
+import subprocess
+import threading
+from typing import Dict, List, Optional
+
+import typer
+from legl_dev.capture import MAX_LINE
+
+COLOURS = [
+    typer.colors.CYAN,
+    typer.colors.GREEN,
+    typer.colors.YELLOW,
+    typer.colors.MAGENTA,
+    typer.colors.BLUE,
+    typer.colors.BRIGHT_CYAN,
+    typer.colors.BRIGHT_GREEN,
+    typer.colors.BRIGHT_YELLOW,
+    typer.colors.BRIGHT_MAGENTA,
+    typer.colors.BRIGHT_BLUE,
+]
+# Lines waiting to be printed. A reader blocks when it's full, so a service
+# that logs faster than the terminal is slowed down rather than buffered
+QUEUE_SIZE = 1000
+
+
+def log_args(
+    docker_cmd: str,
+    service: str,
+    tail: int,
+    since: Optional[str] = None,
+    follow: bool = True,
+) -> List[str]:
+    # --tail keeps compose from replaying the container's whole history
+    args = docker_cmd.split() + [
+        "logs",
+        "--no-log-prefix",
+        "--tail",
+        "all" if tail < 0 else str(tail),
+    ]
+    if since:
+        args += ["--since", since]
+    if follow:
+        args.append("--follow")
+    return args + [service]
+
+
+class Multiplexer:
+    def __init__(
+        self, streams: Dict[str, List[str]], grep: Optional[str] = None
+    ) -> None:
+        # streams maps each service to the command printing its logs
+        self.streams = streams
+        self.pattern = re.compile(grep) if grep else None
+        self.lines = queue.Queue(maxsize=QUEUE_SIZE)
+        self.width = max(len(service) for service in streams)
+        self.colours = {
+            service: COLOURS[index % len(COLOURS)]
+            for index, service in enumerate(streams)
+        }
+
+    def _read(self, service: str, process: subprocess.Popen) -> None:
+        try:
+            # lines are read with a cap, a service that never prints a newline
+            # can't make the reader hold its whole output
+            for line in iter(lambda: process.stdout.readline(MAX_LINE), b""):
+                text = line.decode(errors="replace").rstrip("\r\n")
+                # filtered here so skipped lines never take up the queue
+                if self.pattern is None or self.pattern.search(text):
+                    self.lines.put((service, text))
+        finally:
+            self.lines.put((service, None))
+
+    def _print(self, service: str, line: str) -> None:
+        typer.secho(f"{service:<{self.width}} | ", fg=self.colours[service], nl=False)
+        typer.echo(line)
+
+    def run(self) -> int:
+        processes = {}
+        for service, args in self.streams.items():
+            processes[service] = subprocess.Popen(
+                args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            threading.Thread(
+                target=self._read, args=(service, processes[service]), daemon=True
+            ).start()
+
+        streaming = len(processes)
+        interrupted = False
+        try:
+            while streaming:
+                service, line = self.lines.get()
+                if line is None:
+                    streaming -= 1
+                else:
+                    self._print(service, line)
+        except KeyboardInterrupt:
+            interrupted = True
+        finally:
+            for process in processes.values():
+                if process.poll() is None:
+                    process.terminate()
+            # readers blocked on a full queue finish once it's drained
+            while streaming:
+                if self.lines.get()[1] is None:
+                    streaming -= 1
+            for process in processes.values():
+                process.wait()
+                process.stdout.close()
+        if interrupted:
+            return 0
+        return max(process.returncode for process in processes.values())
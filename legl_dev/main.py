@@ -1,19 +1,44 @@
 #!/usr/bin/env python3
-import json
 import os
-from typing import Optional
+import re
+import shlex
+import time
+from typing import List, Optional
 
-import pkg_resources
-import requests
 import typer
-from legl_dev.command import Command, Steps
+from legl_dev import (
+    branches,
+    durations,
+    fingerprint,
+    formatter,
+    history,
+    images,
+    impact,
+    logs,
+    ready,
+    release,
+    requirements,
+    snapshot,
+    testdb,
+    warm,
+)
+from legl_dev.batch import ManagementCommands
+from legl_dev.command import Command, Steps, capture_output
 
 app = typer.Typer(invoke_without_command=True)
+db_app = typer.Typer(help="Snapshot and restore the dev database")
+app.add_typer(db_app, name="db")
+warm_app = typer.Typer(help="Manage the warm pytest runner")
+app.add_typer(warm_app, name="warm")
+daemon_app = typer.Typer(help="Keep legl-dev loaded in the background to start faster")
+app.add_typer(daemon_app, name="daemon")
 docker_cmd = "docker compose"
 exec_cmd = f"{docker_cmd} exec server"
 django_cmd = f"{exec_cmd} python manage.py"
-os.environ["COMPOSE_DOCKER_CLI_BUILD"] = "1"
-os.environ["DOCKER_BUILDKIT"] = "1"
+docker_env = {"COMPOSE_DOCKER_CLI_BUILD": "1", "DOCKER_BUILDKIT": "1"}
+# Management commands need both of these to be up
+READY_SERVICES = ["database", "server"]
+os.environ.update(docker_env)
 
 
 @app.command(help="Start the dev environment")
@@ -22,49 +47,294 @@ def start(verbose: bool = typer.Option(True, help="Run in verbose mode")):
     steps.add(
         Command(
             command=f"{docker_cmd} up {'' if verbose else '-d'}",
+            name="start services",
+            capture=not verbose,
         )
     )
+    if not verbose:
+        steps.add(ready.wait_for(docker_cmd, READY_SERVICES, after="start services"))
     steps.run()
 
 
-@app.command(help="Start the dev environment")
-def logs():
-    steps = Steps()
-    steps.add(
-        Command(
-            command=f"{docker_cmd} logs -f",
+@app.command(name="logs", help="Show the logs of the dev environment's services")
+def show_logs(
+    services: Optional[List[str]] = typer.Argument(
+        None, help="Services to show, defaults to all of them"
+    ),
+    tail: int = typer.Option(
+        100, help="Lines of history to show per service, -1 for all of them"
+    ),
+    since: Optional[str] = typer.Option(
+        None, help='Only show lines since a time or duration, e.g. "10m"'
+    ),
+    grep: Optional[str] = typer.Option(
+        None, help="Only show lines matching this regular expression"
+    ),
+    follow: bool = typer.Option(True, help="Keep streaming new lines"),
+):
+    if not services:
+        output = capture_output(docker_cmd.split() + ["config", "--services"])
+        if output is None:
+            typer.secho("💥 Couldn't list the services 💥", fg=typer.colors.BRIGHT_RED)
+            raise typer.Exit(code=1)
+        services = output.split()
+    try:
+        multiplexer = logs.Multiplexer(
+            {
+                service: logs.log_args(
+                    docker_cmd,
+                    service,
+                    tail,
+                    since=since,
+                    follow=follow,
+                )
+                for service in services
+            },
+            grep=grep,
         )
-    )
-    steps.run()
+    except re.error as e:
+        raise typer.BadParameter(f"--grep isn't a valid regular expression: {e}")
+    returncode = multiplexer.run()
+    if returncode:
+        raise typer.Exit(code=returncode)
+
+
+def _stage_needed(
+    cache: fingerprint.StageCache,
+    stage: str,
+    digest: str,
+    inputs: str,
+    force: bool = False,
+    reason: str = "",
+) -> bool:
+    record = cache.get(stage)
+    if force:
+        reason = reason or "forced with --force"
+    elif not record:
+        reason = "no previous successful run"
+    elif record["fingerprint"] != digest:
+        reason = f"{inputs} changed"
+    else:
+        typer.secho(
+            f"⏭  Skipping {stage}: {inputs} unchanged since "
+            f"{fingerprint.format_time(record['recorded_at'])}",
+            fg=typer.colors.CYAN,
+        )
+        return False
+    typer.secho(f"🔁 Running {stage}: {reason}", fg=typer.colors.CYAN)
+    return True
 
 
 @app.command(help="Rebuild the local environment")
 def build(
     cache: bool = typer.Option(True, help="Drop the database and create a fresh one"),
+    resume: bool = typer.Option(
+        False, help="Continue from the step that failed in the previous build"
+    ),
+    force: bool = typer.Option(
+        False, help="Run every stage even if its inputs haven't changed"
+    ),
+    use_snapshot: bool = typer.Option(
+        True,
+        "--snapshot/--no-snapshot",
+        help="Restore a matching database snapshot instead of migrating from scratch",
+    ),
+    batch: bool = typer.Option(
+        True, help="Run the management commands in a single Django process"
+    ),
+    registry: Optional[str] = typer.Option(
+        None,
+        envvar="LEGL_DEV_REGISTRY",
+        help="Pull images keyed on their Dockerfile and lockfiles from this "
+        "registry, e.g. localhost:5000/legl, and only build the ones missing",
+    ),
+    push: bool = typer.Option(
+        False, help="Push the images built because they weren't in --registry"
+    ),
 ) -> None:
 
-    extra_args = f"{'' if cache else '--no-cache'}"
-    steps = Steps(
-        steps=[
-            Command(
-                command=f"{docker_cmd} build {extra_args}",
-            ),
-        ],
+    stage_cache = fingerprint.StageCache("build")
+    digests = {
+        "image": fingerprint.fingerprint(fingerprint.IMAGE_INPUTS),
+        "database": fingerprint.fingerprint(fingerprint.MIGRATION_INPUTS),
+        "factories": fingerprint.fingerprint(
+            fingerprint.MIGRATION_INPUTS + fingerprint.FACTORY_INPUTS
+        ),
+    }
+    build_image = _stage_needed(
+        stage_cache,
+        "image",
+        digests["image"],
+        "Dockerfiles and lockfiles",
+        force=force or not cache,
+        reason="" if cache else "building with --no-cache",
     )
-    steps.add(
-        [
-            Command(command=f"{docker_cmd} up -d"),
-            Command(command=f"{django_cmd} migrate"),
-            Command(command=f"{docker_cmd} stop database"),
-            Command(command=f"{docker_cmd} rm -f database"),
-            Command(command=f"{docker_cmd} up database -d"),
-            Command(command=f"{django_cmd} migrate"),
-            Command(command=f"{django_cmd} run_factories"),
-            Command(command=f"{django_cmd} seed_emails"),
-            Command(command=f"{docker_cmd} stop"),
-        ]
+    build_database = _stage_needed(
+        stage_cache, "database", digests["database"], "migrations", force=force
     )
-    steps.run()
+    build_factories = _stage_needed(
+        stage_cache,
+        "factories",
+        digests["factories"],
+        "migrations and factories",
+        force=force or build_database,
+        reason="" if force else "the database is being rebuilt",
+    )
+
+    snapshot_key = snapshot.current_key()
+    restore = (
+        use_snapshot and not force and build_factories and snapshot.exists(snapshot_key)
+    )
+    if restore:
+        typer.secho(
+            f"♻️  Restoring database snapshot {snapshot_key} "
+            "instead of migrating and running factories",
+            fg=typer.colors.CYAN,
+        )
+
+    steps = Steps(name="build")
+    image_steps = (
+        images.build_steps(
+            docker_cmd,
+            digests["image"],
+            no_cache=not cache,
+            registry=registry,
+            push=push,
+        )
+        if build_image
+        else []
+    )
+    steps.add(image_steps)
+    if build_database or build_factories:
+        steps.add(
+            Command(
+                command=f"{docker_cmd} up -d",
+                name="start services",
+                depends_on=[step.name for step in image_steps],
+            )
+        )
+    if restore:
+        steps.add(
+            ready.wait_for(docker_cmd, ["database"], after="start services")
+            + [
+                snapshot.restore_command(docker_cmd, snapshot_key),
+                Command(command=f"{docker_cmd} stop", name="stop services"),
+            ]
+        )
+    elif build_database or build_factories:
+        waits = ready.wait_for(docker_cmd, READY_SERVICES, after="start services")
+        steps.add(waits)
+        services_ready = [wait.name for wait in waits]
+        if build_database:
+            steps.add(
+                [
+                    Command(
+                        command=f"{django_cmd} migrate",
+                        name="migrate",
+                        depends_on=services_ready,
+                    ),
+                    Command(
+                        command=f"{docker_cmd} stop database", name="stop database"
+                    ),
+                    Command(
+                        command=f"{docker_cmd} rm -f database", name="remove database"
+                    ),
+                    Command(
+                        command=f"{docker_cmd} up database -d", name="start database"
+                    ),
+                ]
+                + ready.wait_for(
+                    docker_cmd, ["database"], after="start database", suffix=" again"
+                )
+            )
+            services_ready = [steps.steps[-1].name]
+        if batch:
+            steps.add(
+                ManagementCommands(
+                    docker_cmd,
+                    (["migrate"] if build_database else [])
+                    + ["run_factories", "seed_emails"],
+                    depends_on=services_ready,
+                )
+            )
+            database_ready = [steps.steps[-1].name]
+        else:
+            if build_database:
+                steps.add(
+                    Command(
+                        command=f"{django_cmd} migrate",
+                        name="migrate fresh database",
+                        depends_on=services_ready,
+                    )
+                )
+                services_ready = [steps.steps[-1].name]
+            steps.add(
+                [
+                    Command(
+                        command=f"{django_cmd} run_factories",
+                        name="run_factories",
+                        depends_on=services_ready,
+                    ),
+                    Command(
+                        command=f"{django_cmd} seed_emails",
+                        name="seed_emails",
+                        depends_on=services_ready,
+                    ),
+                ]
+            )
+            database_ready = ["run_factories", "seed_emails"]
+        if use_snapshot:
+            dump = snapshot.dump_command(docker_cmd, snapshot_key)
+            dump.depends_on = database_ready
+            steps.add(dump)
+            database_ready = [dump.name]
+        steps.add(
+            Command(
+                command=f"{docker_cmd} stop",
+                name="stop services",
+                depends_on=database_ready,
+            )
+        )
+    steps.run(resume=resume)
+    _report_image_cache(image_steps)
+
+    for stage, run in (
+        ("image", build_image),
+        ("database", build_database),
+        ("factories", build_factories),
+    ):
+        if run:
+            stage_cache.record(stage, digests[stage])
+    if build_database or restore:
+        # the database was recreated from the current migrations
+        _record_migrated()
+    if restore:
+        snapshot.touch(snapshot_key)
+    elif use_snapshot and build_factories:
+        _register_snapshot(snapshot_key)
+
+
+def _report_image_cache(image_steps: List[Command]) -> None:
+    baked = [step for step in image_steps if isinstance(step, images.BakeService)]
+    if not baked:
+        return
+    typer.secho("📦 Build cache hits per service", fg=typer.colors.CYAN)
+    for step in baked:
+        if step.pulled:
+            typer.echo(f"  {step.service}: pulled {step.remote}")
+            continue
+        if step.total is None:
+            # skipped when resuming
+            continue
+        rate = f"{step.cached / step.total:4.0%}" if step.total else "   -"
+        typer.echo(f"  {step.service}: {rate}  {step.cached}/{step.total} steps cached")
+    for removed in images.prune(keep=[step.cache for step in baked]):
+        typer.secho(f"🗑  Evicted build cache {removed}", fg=typer.colors.CYAN)
+
+
+def _register_snapshot(key: str) -> None:
+    for removed in snapshot.register(key):
+        typer.secho(f"🗑  Evicted database snapshot {removed}", fg=typer.colors.CYAN)
 
 
 @app.command(help="Run the local pytest unit tests")
@@ -101,54 +371,389 @@ def pytest(
         False,
         help="show print outputs instead of just logs",
     ),
+    warm_runner: bool = typer.Option(
+        False,
+        "--warm/--no-warm",
+        help="run in a backend container that is kept up between runs",
+    ),
+    changed: bool = typer.Option(
+        False,
+        help="only run the tests affected by uncommitted changes",
+    ),
+    since: str = typer.Option(
+        None,
+        help="only run the tests affected by changes since this git ref",
+    ),
+    shard: str = typer.Option(
+        None,
+        help='only run one of N shards balanced on past durations, e.g. "1/4"',
+    ),
+    watch: bool = typer.Option(
+        False,
+        help="rerun the tests affected by each change in the warm runner",
+    ),
+    template_db: bool = typer.Option(
+        False,
+        help="with --parallel, clone the workers' test databases from a template "
+        "that is only migrated when migrations change, --create-db rebuilds it",
+    ),
     path: str = typer.Argument(
         "",
         help='path for specific test in the format "<file path>::<class name>::<function name>"',
     ),
 ):
 
+    select_tests = changed or since is not None
+    if shard and select_tests:
+        raise typer.BadParameter("--shard can't be combined with --changed or --since")
+    if watch and (shard or select_tests):
+        raise typer.BadParameter(
+            "--watch can't be combined with --shard, --changed or --since"
+        )
+    if template_db and (watch or not parallel):
+        raise typer.BadParameter("--template-db needs --parallel and not --watch")
+
+    plan = None
+    first_shard = 1
+    targets = f"/code/{path}"
+    workers = os.cpu_count() or 1
+    # the worker databases are cloned up front, so their number must be known
+    parallel_args = f"-n {workers if template_db else 'auto'} --dist loadscope"
+    module_times = durations.load()["modules"]
+    if shard:
+        try:
+            first_shard, count = durations.parse_shard(shard)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+        estimates = durations.estimate(durations.find_test_files(path), module_times)
+        plan = durations.balance(estimates, count)[first_shard - 1 : first_shard]
+        if not plan[0][1]:
+            typer.echo(f"No tests in shard {shard}")
+            return
+        targets = " ".join(f"/code/{file}" for file in plan[0][1])
+    elif parallel and not select_tests and module_times:
+        estimates = durations.estimate(durations.find_test_files(path), module_times)
+        plan = durations.balance(estimates, workers)
+        # xdist hands whole files to idle workers in the order they're collected,
+        # so passing the slowest files first approximates the planned shards
+        targets = " ".join(
+            f"/code/{file}" for file in sorted(estimates, key=lambda f: -estimates[f])
+        )
+        parallel_args = f"-n {workers} --dist loadfile"
+
     extra_args = (
-        f"{'--create-db' if create_db else ''} "
+        f"{'--reuse-db' if template_db else '--create-db' if create_db else ''} "
         f"{'-vv' if full_diff else ''} "
         f"{'--lf' if last_failed else ''} "
         f"{'' if warnings else '--disable-warnings'} "
         f"{'' if all_logs else '--show-capture=log'} "
         f"{'--snapshot-update' if snapshot_update else ''} "
         f"{'--show-capture=stdout' if show_capture else ''} "
-        f"{'-n auto --dist loadscope' if parallel else ''} "
+        f"{parallel_args if parallel else ''} "
+        f"--junitxml={impact.CONTAINER_ROOT}{durations.JUNIT_FILE} "
     )
-    steps = Steps(
-        steps=[
-            Command(
-                command=(
-                    f"{docker_cmd} "
-                    "run --rm backend pytest "
-                    "--html=unit_test_results.html "
-                    f"{extra_args} /code/{path}"
+    if watch:
+        _watch_tests(extra_args, path, last_failed)
+        return
+    if select_tests:
+        tests, reason = impact.select(impact.changed_files(since or "HEAD"))
+        typer.secho(f"🎯 {reason[0].upper()}{reason[1:]}", fg=typer.colors.CYAN)
+        if tests == []:
+            return
+        if tests:
+            targets = " ".join(f"/code/{test}" for test in tests)
+        # collect per-test coverage to keep the impact map up to date
+        extra_args += f"{impact.COVERAGE_ARGS} "
+    pytest_args = f"pytest --html=unit_test_results.html {extra_args} {targets}"
+    if select_tests:
+        pytest_args = (
+            f"env COVERAGE_FILE={impact.CONTAINER_ROOT}{impact.COVERAGE_FILE} "
+            f"{pytest_args}"
+        )
+    if parallel:
+        # xdist doesn't record which worker ran each test, the plugin does
+        pytest_args = f"sh -c {shlex.quote(durations.with_worker_plugin(pytest_args))}"
+    if warm_runner:
+        runner_steps, reason = warm.ensure(
+            docker_cmd, fingerprint.fingerprint(fingerprint.IMAGE_INPUTS)
+        )
+        typer.secho(f"🔥 {reason[0].upper()}{reason[1:]}", fg=typer.colors.CYAN)
+        runner = f"docker exec -i {warm.container_name()}"
+        pytest_step = warm.exec_command(pytest_args, name="pytest")
+    else:
+        runner_steps = []
+        runner = f"{docker_cmd} run --rm backend"
+        pytest_step = Command(command=f"{runner} {pytest_args}", name="pytest")
+    # the script passed to sh -c has to stay one argument
+    pytest_step.shell = parallel
+    if template_db:
+        runner_steps.append(testdb.clone_command(runner, workers, rebuild=create_db))
+    steps = Steps(steps=runner_steps + [pytest_step])
+    start = time.monotonic()
+    try:
+        steps.run()
+    finally:
+        if select_tests:
+            impact.record(full=tests is None and not path and not last_failed)
+        actual, worker_times = durations.record()
+        if shard:
+            _balance_report(plan, first_shard, actual, time.monotonic() - start)
+        elif worker_times:
+            _worker_report(plan, worker_times, time.monotonic() - start)
+
+
+def _watch_tests(extra_args: str, path: str, last_failed: bool) -> None:
+    # ctypes is only needed for inotify, keep it off startup
+    from legl_dev import watch
+
+    try:
+        watcher = watch.Watcher()
+    except OSError as e:
+        raise typer.BadParameter(f"--watch can't watch the source tree: {e.strerror}")
+    runner_steps, reason = warm.ensure(
+        docker_cmd, fingerprint.fingerprint(fingerprint.IMAGE_INPUTS)
+    )
+    typer.secho(f"🔥 {reason[0].upper()}{reason[1:]}", fg=typer.colors.CYAN)
+    if runner_steps:
+        Steps(steps=runner_steps).run()
+
+    pending = set()
+    with watcher:
+        while True:
+            typer.secho(
+                "👀 Watching for changes, press Ctrl+C to stop", fg=typer.colors.CYAN
+            )
+            try:
+                pending = watcher.changes(pending)
+            except KeyboardInterrupt:
+                return
+            if watcher.overflowed:
+                watcher.overflowed = False
+                tests, reason = (
+                    None,
+                    "too many files changed at once, running everything",
                 )
-            ),
-        ]
+            else:
+                tests, reason = impact.select(pending)
+            if tests and path:
+                tests = [test for test in tests if test.startswith(path)]
+            typer.secho(f"🎯 {reason[0].upper()}{reason[1:]}", fg=typer.colors.CYAN)
+            if tests == []:
+                pending = set()
+                continue
+
+            targets = (
+                f"/code/{path}"
+                if tests is None
+                else " ".join(f"/code/{test}" for test in tests)
+            )
+            run = watch.TestRun(
+                f"env COVERAGE_FILE={impact.CONTAINER_ROOT}{impact.COVERAGE_FILE} "
+                f"pytest --html=unit_test_results.html {extra_args} "
+                f"{impact.COVERAGE_ARGS} {targets}"
+            )
+            try:
+                completed, changed = watch.run_until_changed(run, watcher)
+            except KeyboardInterrupt:
+                return
+            if completed:
+                impact.record(full=tests is None and not path and not last_failed)
+                durations.record()
+                pending = set()
+            else:
+                typer.secho(
+                    f"🔁 {', '.join(sorted(changed)) or 'Files'} changed, restarting",
+                    fg=typer.colors.CYAN,
+                )
+                pending |= changed
+
+
+def _balance_report(plan: list, first: int, actual: dict, wall_time: float) -> None:
+    typer.secho("⚖️  Predicted vs actual time per shard", fg=typer.colors.CYAN)
+    for index, (predicted, files) in enumerate(plan, start=first):
+        measured = sum(actual.get(file, 0) for file in files)
+        typer.echo(
+            f"  {index:>3}: {len(files):>4} files  "
+            f"predicted {predicted:8.1f}s  actual {measured:8.1f}s"
+        )
+    typer.echo(
+        f"  predicted slowest shard {max(p for p, _ in plan):.1f}s, "
+        f"wall time {wall_time:.1f}s"
+    )
+
+
+def _worker_report(plan: Optional[list], worker_times: dict, wall_time: float) -> None:
+    # what each xdist worker actually ran, xdist assigns the files as it goes
+    typer.secho("⚖️  Actual time per xdist worker", fg=typer.colors.CYAN)
+    totals = {worker: sum(times.values()) for worker, times in worker_times.items()}
+    for worker in sorted(totals, key=lambda w: (len(w), w)):
+        typer.echo(
+            f"  {worker:>6}: {len(worker_times[worker]):>4} files  "
+            f"actual {totals[worker]:8.1f}s"
+        )
+    predicted = (
+        f"predicted slowest worker {max(p for p, _ in plan):.1f}s, " if plan else ""
+    )
+    typer.echo(
+        f"  {predicted}actual slowest {max(totals.values()):.1f}s, "
+        f"fastest {min(totals.values()):.1f}s, wall time {wall_time:.1f}s"
+    )
+
+
+@warm_app.command(name="stop", help="Stop the warm pytest runner")
+def stop_warm():
+    if warm.status() == (False, None):
+        typer.echo("The warm runner isn't running")
+        return
+    Steps(steps=[warm.stop_command()]).run()
+
+
+@warm_app.command(name="status", help="Show the state of the warm pytest runner")
+def warm_status():
+    running, digest = warm.status()
+    if not running:
+        typer.echo("The warm runner isn't running")
+    elif digest != fingerprint.fingerprint(fingerprint.IMAGE_INPUTS):
+        typer.echo("The warm runner is up but stale, it restarts on the next run")
+    else:
+        typer.echo(f"The warm runner is up in {warm.container_name()}")
+
+
+@app.command(help="Show how long commands and their steps take over time")
+def stats(
+    command: Optional[str] = typer.Argument(
+        None, help='Only show this command, e.g. build or "db snapshot"'
+    ),
+):
+    timings = history.load(command)
+    if not timings:
+        typer.echo("No timings recorded yet")
+        return
+    width = max(len(f"{name} {step}") for name, step in timings)
+    typer.secho(
+        f"📈 Successful runs, flagging medians of the last {history.RECENT_RUNS} "
+        f"runs that regressed against the {history.BASELINE_RUNS} before them",
+        fg=typer.colors.CYAN,
+    )
+    typer.echo(
+        f"  {'command / step':<{width}}  {'runs':>5}  {'p50':>8}  {'p95':>8}  {'last':>8}"
+    )
+    for (name, step), values in sorted(timings.items()):
+        typer.echo(
+            f"  {f'{name} {step}':<{width}}  {len(values):>5}  "
+            f"{history.percentile(values, 0.5):7.1f}s  "
+            f"{history.percentile(values, 0.95):7.1f}s  {values[-1]:7.1f}s",
+            nl=False,
+        )
+        slower = history.regression(values)
+        if slower is None:
+            typer.echo()
+        else:
+            typer.secho(f"  ⚠️  {slower:.0%} slower", fg=typer.colors.BRIGHT_RED)
+
+
+@daemon_app.command(name="start", help="Start the legl-dev daemon")
+def start_daemon():
+    # sockets aren't needed by any other command, keep them off startup
+    from legl_dev import daemon
+
+    if daemon.pid():
+        typer.echo(f"The daemon is already running on {daemon.socket_path()}")
+        return
+    if not daemon.start():
+        typer.secho("💥 The daemon didn't start 💥", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+    typer.secho(
+        f"👻 The daemon is running on {daemon.socket_path()}", fg=typer.colors.CYAN
     )
-    steps.run()
+
+
+@daemon_app.command(name="stop", help="Stop the legl-dev daemon")
+def stop_daemon():
+    from legl_dev import daemon
+
+    if not daemon.stop():
+        typer.echo("The daemon isn't running")
+
+
+@daemon_app.command(name="status", help="Show whether the legl-dev daemon is running")
+def daemon_status():
+    from legl_dev import daemon
+
+    daemon_pid = daemon.pid()
+    if daemon_pid is None:
+        typer.echo("The daemon isn't running")
+    else:
+        typer.echo(
+            f"The daemon is running as pid {daemon_pid} on {daemon.socket_path()}"
+        )
 
 
 @app.command(help="Format the code with isort, black and prettier")
 def format(
     push: bool = typer.Option(False, help="Also push the changes to the repo"),
+    changed: bool = typer.Option(
+        False, help="Only format files that are changed, staged or untracked"
+    ),
+    in_process: bool = typer.Option(
+        True, help="Run isort and black in-process instead of as separate commands"
+    ),
 ):
 
-    steps = Steps(
-        steps=[
-            Command(command=f"isort . --profile black"),
-            Command(command=f"black ."),
-            Command(command="yarn format:prettier"),
-        ]
-    )
+    if changed:
+        format_cache = formatter.FormatCache()
+        files = formatter.changed_files()
+        pending = format_cache.pending(files)
+        python, prettier = formatter.route(pending)
+        typer.secho(
+            f"🧹 Formatting {len(python) + len(prettier)} of {len(files)} changed files, "
+            f"{len(files) - len(pending)} already formatted",
+            fg=typer.colors.CYAN,
+        )
+        steps = Steps()
+        if python and in_process:
+            steps.add(formatter.PythonFormatter(python))
+        elif python:
+            quoted = " ".join(shlex.quote(file) for file in python)
+            steps.add(
+                [
+                    Command(
+                        command=f"isort --profile black {quoted}",
+                        shell=True,
+                        name="isort",
+                    ),
+                    Command(command=f"black {quoted}", shell=True, name="black"),
+                ]
+            )
+        if prettier:
+            steps.add(
+                Command(
+                    command="yarn prettier --write "
+                    + " ".join(shlex.quote(file) for file in prettier),
+                    shell=True,
+                    name="prettier",
+                    depends_on=[],
+                )
+            )
+    else:
+        if in_process:
+            steps = Steps(steps=[formatter.PythonFormatter()])
+        else:
+            steps = Steps(
+                steps=[
+                    Command(command=f"isort . --profile black", name="isort"),
+                    Command(command=f"black .", name="black"),
+                ]
+            )
+        steps.add(
+            Command(command="yarn format:prettier", name="prettier", depends_on=[])
+        )
     if push:
         steps.add(
             [
                 Command(
                     command="git stage .",
+                    depends_on=[step.name for step in steps.steps],
                 ),
                 Command(
                     command="git commit -m formatting",
@@ -157,6 +762,8 @@ def format(
             ]
         )
     steps.run()
+    if changed:
+        format_cache.record(python + prettier)
 
 
 @app.command(help="Open Cypress e2e tests")
@@ -165,12 +772,39 @@ def cypress():
         steps=[
             Command(
                 command=f"yarn run cypress open",
+                capture=False,
             )
         ]
     )
     steps.run()
 
 
+def _record_migrated(database: str = "default") -> None:
+    fingerprint.StageCache("migrate").record(
+        database,
+        fingerprint.fingerprint(fingerprint.MIGRATION_INPUTS),
+        apps=fingerprint.migrations_by_app(),
+    )
+
+
+def _report_new_migrations(record: dict) -> None:
+    migrated = record.get("apps", {})
+    new = {}
+    for app, names in fingerprint.migrations_by_app().items():
+        added = sorted(set(names) - set(migrated.get(app, [])))
+        if added:
+            new[app] = added
+    for app, names in sorted(new.items()):
+        typer.secho(
+            f"🆕 New migrations in {app}: {', '.join(names)}", fg=typer.colors.CYAN
+        )
+    if not new:
+        typer.secho(
+            "🔁 Migrations were edited or removed since the last migrate",
+            fg=typer.colors.CYAN,
+        )
+
+
 @app.command(help="Create and run migrations")
 def migrate(
     merge: bool = typer.Option(False, help="Run a migration merge first"),
@@ -178,56 +812,203 @@ def migrate(
     run: bool = typer.Option(
         True, help="use --no-run to prevent migrations from running"
     ),
+    force: bool = typer.Option(
+        False, help="Migrate even if no migrations changed since the last migrate"
+    ),
+    database: str = typer.Option("default", help="The Django database to migrate"),
 ):
 
+    record = fingerprint.StageCache("migrate").get(database)
+    # makemigrations can add migrations, so only a plain migrate can be skipped
+    if run and record and not (merge or make or force):
+        if record["fingerprint"] == fingerprint.fingerprint(
+            fingerprint.MIGRATION_INPUTS
+        ):
+            typer.secho(
+                f"⏭  Skipping migrate: migrations unchanged since "
+                f"{fingerprint.format_time(record['recorded_at'])}, "
+                "use --force to run it anyway",
+                fg=typer.colors.CYAN,
+            )
+            return
+        _report_new_migrations(record)
+
     steps = Steps()
     if merge:
         steps.add(
-            Command(command=f"{django_cmd} makemigrations --merge"),
+            Command(command=f"{django_cmd} makemigrations --merge", capture=False),
         )
     if make:
         steps.add(
-            (Command(command=f"{django_cmd} makemigrations")),
+            (Command(command=f"{django_cmd} makemigrations", capture=False)),
         )
     if run:
         steps.add(
-            Command(command=f"{django_cmd} migrate"),
+            Command(
+                command=f"{django_cmd} migrate"
+                + ("" if database == "default" else f" --database {database}")
+            ),
         )
     steps.run()
+    if run:
+        _record_migrated(database)
 
 
 @app.command(help="Clean out and create new factories")
 def factories(
     emails: bool = typer.Option(True, help="Generate factory emails"),
+    use_snapshot: bool = typer.Option(
+        True,
+        "--snapshot/--no-snapshot",
+        help="Restore a matching database snapshot instead of running the factories",
+    ),
+    batch: bool = typer.Option(
+        True, help="Run the management commands in a single Django process"
+    ),
 ):
 
-    steps = Steps(
-        steps=[
-            Command(command=f"{django_cmd} run_factories"),
-        ],
-    )
-    if emails:
-        steps.add(
-            Command(command=f"{django_cmd} seed_emails"),
+    # snapshots always include the seeded emails
+    use_snapshot = use_snapshot and emails
+    snapshot_key = snapshot.current_key() if use_snapshot else None
+    if use_snapshot and snapshot.exists(snapshot_key):
+        typer.secho(
+            f"♻️  Restoring database snapshot {snapshot_key} instead of running factories",
+            fg=typer.colors.CYAN,
+        )
+        Steps(steps=[snapshot.restore_command(docker_cmd, snapshot_key)]).run()
+        snapshot.touch(snapshot_key)
+        _record_migrated()
+        return
+
+    if batch and emails:
+        steps = Steps(
+            steps=[ManagementCommands(docker_cmd, ["run_factories", "seed_emails"])]
+        )
+    else:
+        steps = Steps(
+            steps=[
+                Command(command=f"{django_cmd} run_factories"),
+            ],
         )
+        if emails:
+            steps.add(
+                Command(command=f"{django_cmd} seed_emails"),
+            )
+    if use_snapshot:
+        steps.add(snapshot.dump_command(docker_cmd, snapshot_key))
     steps.run()
+    if use_snapshot:
+        _register_snapshot(snapshot_key)
+
+
+@db_app.command(name="snapshot", help="Snapshot the current database")
+def snapshot_db(
+    key: str = typer.Option(
+        None, help="Key to store the snapshot under, defaults to the current code"
+    ),
+):
+    key = key or snapshot.current_key()
+    Steps(steps=[snapshot.dump_command(docker_cmd, key)]).run()
+    _register_snapshot(key)
+
+
+@db_app.command(name="restore", help="Restore a database snapshot")
+def restore_db(
+    key: str = typer.Argument(
+        None, help="Snapshot to restore, defaults to the one matching the current code"
+    ),
+):
+    key = key or snapshot.current_key()
+    if not snapshot.exists(key):
+        typer.secho(f"💥 No database snapshot {key} 💥", fg=typer.colors.BRIGHT_RED)
+        raise typer.Exit(code=1)
+    Steps(steps=[snapshot.restore_command(docker_cmd, key)]).run()
+    snapshot.touch(key)
+    if key == snapshot.current_key():
+        _record_migrated()
+    else:
+        # an older snapshot can be behind the migrations on disk
+        fingerprint.StageCache("migrate").forget("default")
+
+
+@db_app.command(name="list", help="List the database snapshots")
+def list_snapshots():
+    current = snapshot.current_key()
+    for info in snapshot.snapshots():
+        typer.echo(
+            f"{'*' if info['key'] == current else ' '} {info['key']}  "
+            f"{info['size'] / (1 << 20):8.1f} MB  "
+            f"created {fingerprint.format_time(info['created_at'])}  "
+            f"last used {fingerprint.format_time(info['last_used'])}"
+        )
+
+
+@db_app.command(
+    name="prune", help="Evict the least recently used snapshots over the size limit"
+)
+def prune_snapshots(
+    max_size: int = typer.Option(
+        None,
+        help="Size limit in MB, defaults to LEGL_DEV_SNAPSHOT_LIMIT_MB or 2048. "
+        "The most recent snapshot is always kept",
+    ),
+):
+    for removed in snapshot.prune(None if max_size is None else max_size << 20):
+        typer.secho(f"🗑  Evicted database snapshot {removed}", fg=typer.colors.CYAN)
 
 
 @app.command(help="Cleans out git branches")
-def gitclean():
-    steps = Steps(
-        steps=[
-            Command(
-                command=(
-                    "git branch --merged | "
-                    'egrep -v "(^\\*|master|dev)" | '
-                    "xargs git branch -d"
-                ),
-                shell=True,
-            ),
-        ]
+def gitclean(
+    into: str = typer.Option("HEAD", help="Delete branches merged into this ref"),
+    protect: List[str] = typer.Option(
+        branches.PROTECTED,
+        help="Branch name patterns to keep, can be given several times. "
+        f"More can be kept per repo with git config --add {branches.PROTECT_CONFIG}",
+    ),
+    dry_run: bool = typer.Option(
+        False, help="List the branches that would be deleted without deleting them"
+    ),
+    prune: bool = typer.Option(
+        False, help="Also prune remote-tracking branches gone from the remote"
+    ),
+    remote: str = typer.Option("origin", help="The remote to prune"),
+):
+    steps = Steps(steps=[Command(command="git worktree prune")])
+    if prune:
+        steps.add(Command(command=f"git fetch --prune {remote}"))
+    if not dry_run:
+        steps.run()
+
+    merged = branches.merged(into, branches.protected_patterns(protect))
+    if merged is None:
+        typer.secho(
+            f"💥 Couldn't list the branches merged into {into} 💥",
+            fg=typer.colors.BRIGHT_RED,
+        )
+        raise typer.Exit(code=1)
+    if not merged:
+        typer.echo("No merged branches to delete")
+        return
+    if dry_run:
+        typer.secho(
+            f"🔍 {len(merged)} branches merged into {into} would be deleted:",
+            fg=typer.colors.CYAN,
+        )
+        for name, _ in merged:
+            typer.echo(f"  {name}")
+        return
+    error = branches.delete(merged)
+    if error:
+        typer.secho(
+            f"💥 No branches were deleted: {error} 💥", fg=typer.colors.BRIGHT_RED
+        )
+        raise typer.Exit(code=1)
+    for name, sha in merged:
+        typer.echo(f"  {name} (was {sha[:7]})")
+    typer.secho(
+        f"🗑  Deleted {len(merged)} branches merged into {into}",
+        fg=typer.colors.GREEN,
     )
-    steps.run()
 
 
 @app.command(help="Run JS unit tests")
@@ -237,13 +1018,35 @@ def jstest():
     steps.run()
 
 
+def _pin_requirements(packages: List[str]) -> None:
+    names = [name for name in map(requirements.package_name, packages) if name]
+    for package in packages:
+        if requirements.package_name(package) is None:
+            typer.secho(f"⚠️  Not pinning {package}", fg=typer.colors.YELLOW)
+    if not names:
+        return
+    # only the requested packages, not the whole environment
+    output = capture_output(exec_cmd.split() + ["pip", "show"] + names)
+    if output is None:
+        typer.secho(
+            "💥 Couldn't look up the installed versions, "
+            "requirements.txt is unchanged 💥",
+            fg=typer.colors.BRIGHT_RED,
+        )
+        raise typer.Exit(code=1)
+    versions = requirements.parse_show(output)
+    requirements.pin("requirements.txt", versions, requested=packages)
+    for name, version in sorted(versions.items()):
+        typer.secho(f"📌 Pinned {name}=={version}", fg=typer.colors.CYAN)
+
+
 @app.command(help="Install packages to the dev environment")
 def install(
-    package: Optional[str] = typer.Argument(
-        default="", help="Name of the package you would like to install"
+    packages: Optional[List[str]] = typer.Argument(
+        None, help="Names of the packages you would like to install"
     ),
-    pip: bool = typer.Option(default=False, help="Install package using pip"),
-    yarn: bool = typer.Option(default=False, help="Install package using yarn"),
+    pip: bool = typer.Option(default=False, help="Install packages using pip"),
+    yarn: bool = typer.Option(default=False, help="Install packages using yarn"),
     self: bool = typer.Option(
         default=False,
         help="Reinstall legl-dev, can be used with --upgrade to on update current install",
@@ -252,30 +1055,32 @@ def install(
         default="main", help="specify version of legl-dev to install"
     ),
     upgrade: bool = typer.Option(
-        default=False, help="upgrade existing package instead of installing"
+        default=False, help="upgrade existing packages instead of installing"
     ),
 ):
+    packages = packages or []
+    if (pip or yarn) and not packages:
+        raise typer.BadParameter("--pip and --yarn need at least one package")
     steps = Steps()
+    # every package goes into one resolution
     if pip:
         steps.add(
-            [
-                Command(
-                    command=(
-                        f"{exec_cmd} pip install {'--upgrade' if upgrade else ''} {package}"
-                    )
-                ),
-                Command(
-                    command=(
-                        f"{exec_cmd} pip freeze | grep {package} >> requirements.txt"
-                    ),
-                    shell=True,
-                ),
-            ]
+            Command(
+                command=(
+                    f"{exec_cmd} pip install {'--upgrade' if upgrade else ''} "
+                    + " ".join(packages)
+                )
+            ),
         )
 
     if yarn:
         steps.add(
-            Command(command=(f"{exec_cmd} yarn {'up' if upgrade else 'add'} {package}"))
+            Command(
+                command=(
+                    f"{exec_cmd} yarn {'up' if upgrade else 'add'} "
+                    + " ".join(packages)
+                )
+            )
         )
 
     if self:
@@ -294,39 +1099,54 @@ def install(
             )
 
     steps.run()
+    if pip:
+        _pin_requirements(packages)
 
 
 @app.command(help="Remote into a container")
 def shell():
     steps = Steps()
-    steps.add(Command(command=f"{exec_cmd} bash"))
+    steps.add(Command(command=f"{exec_cmd} bash", capture=False))
     steps.run()
 
 
 @app.callback()
-def main(version: bool = False):
-    response = requests.get(
-        url="https://api.github.com/repos/crowdjustice/legl-dev/releases",
-        headers={"Accept": "application/vnd.github.v3+json"},
-    )
-    releases = response.json()
-    latest_vesrion = pkg_resources.parse_version(releases[0]["tag_name"])
-    current_version = pkg_resources.parse_version(
-        pkg_resources.require("legl_dev")[0].version
-    )
+def main(
+    ctx: typer.Context,
+    version: bool = False,
+    workers: int = typer.Option(
+        Steps.max_workers,
+        envvar="LEGL_DEV_WORKERS",
+        help="Maximum number of independent steps to run at once",
+    ),
+    trace: Optional[str] = typer.Option(
+        None,
+        metavar="FILE",
+        help="Write a Chrome trace of every step's timings to this file",
+    ),
+):
+    Steps.max_workers = workers
+    Steps.trace_file = trace
+    current_version = release.current_version()
+
+    if version:
+        typer.echo(f"v{current_version}")
+        raise typer.Exit()
+
+    if ctx.resilient_parsing:
+        return
 
-    if latest_vesrion > current_version:
+    latest_version = release.latest_version()
+    if latest_version and release.parse_version(latest_version) > release.parse_version(
+        current_version
+    ):
         update = typer.confirm(
-            f"A newer version ({latest_vesrion}) of legl-dev is availible, would you like to update?"
+            f"A newer version ({latest_version}) of legl-dev is availible, would you like to update?"
         )
         if update:
             command = Command(command=f"pip install --upgrade legl-dev")
             command.run()
 
-    if version:
-        typer.echo(f"v{current_version}")
-        raise typer.Exit()
-
 
 if __name__ == "__main__":
     app()
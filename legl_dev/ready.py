@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import json
+import os
+import time
+from typing import List, Optional
+
+import typer
+from legl_dev.command import Command, capture_output
+
+READY = "ready"
+STARTING = "starting"
+EXITED = "exited"
+
+# Services without a healthcheck are ready once this succeeds inside them,
+# or as soon as they're running when they have no probe
+PROBES = {"database": 'pg_isready -q -U "${POSTGRES_USER:-postgres}"'}
+DEFAULT_TIMEOUT = 120
+FIRST_DELAY = 0.05
+MAX_DELAY = 2.0
+
+
+def timeout() -> float:
+    return float(os.environ.get("LEGL_DEV_READY_TIMEOUT", DEFAULT_TIMEOUT))
+
+
+def _container(docker_cmd: str, service: str) -> Optional[dict]:
+    output = capture_output(
+        docker_cmd.split() + ["ps", "--all", "--format", "json", service]
+    )
+    if not output or not output.strip():
+        return None
+    # older compose releases print a list, newer ones a line per container
+    output = output.strip()
+    if output.startswith("["):
+        containers = json.loads(output)
+    else:
+        containers = [json.loads(line) for line in output.splitlines() if line]
+    return containers[0] if containers else None
+
+
+def check(docker_cmd: str, service: str) -> str:
+    container = _container(docker_cmd, service)
+    if container is None:
+        return STARTING
+    state = container.get("State")
+    if state in ("exited", "dead"):
+        return EXITED
+    if state != "running":
+        return STARTING
+    if container.get("Health"):
+        return READY if container["Health"] == "healthy" else STARTING
+    probe = PROBES.get(service)
+    if probe is None:
+        return READY
+    result = capture_output(
+        docker_cmd.split() + ["exec", "-T", service, "sh", "-c", probe]
+    )
+    return STARTING if result is None else READY
+
+
+class WaitFor(Command):
+    def __init__(
+        self,
+        docker_cmd: str,
+        service: str,
+        name: Optional[str] = None,
+        depends_on: Optional[List[str]] = None,
+    ) -> None:
+        self.docker_cmd = docker_cmd
+        self.service = service
+        super().__init__(
+            command=f"wait for {service}",
+            name=name or f"wait for {service}",
+            depends_on=depends_on,
+        )
+
+    def run(self, prefix: bool = False) -> bool:
+        self._command_output(prefix)
+        deadline = timeout()
+        start = time.monotonic()
+        delay = FIRST_DELAY
+        while not self.cancelled:
+            state = check(self.docker_cmd, self.service)
+            waited = time.monotonic() - start
+            if state == READY:
+                self.returncode = 0
+                self._echo(
+                    f"✅ {self.service} ready after {waited:.1f}s",
+                    prefix=prefix,
+                    fg=typer.colors.GREEN,
+                )
+                return True
+            if state == EXITED:
+                message = f"{self.service} exited while starting"
+                break
+            if waited + delay > deadline:
+                message = f"{self.service} still not ready after {waited:.1f}s"
+                break
+            # back off so a slow service isn't hammered with docker calls
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_DELAY)
+        else:
+            message = f"Stopped waiting for {self.service}"
+        self.returncode = 1
+        self._echo(f"💥 {message} 💥", prefix=prefix, fg=typer.colors.BRIGHT_RED)
+        return False
+
+
+def wait_for(
+    docker_cmd: str, services: List[str], after: str, suffix: str = ""
+) -> List[WaitFor]:
+    # every service is polled on its own, so dependents start as soon as the
+    # services they need are ready
+    return [
+        WaitFor(
+            docker_cmd,
+            service,
+            name=f"wait for {service}{suffix}",
+            depends_on=[after],
+        )
+        for service in services
+    ]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import functools
+import os
+import re
+import subprocess
+import sys
+import time
+
+from legl_dev.cache import cache_dir, read_json, write_json
+
+RELEASES_URL = "https://api.github.com/repos/crowdjustice/legl-dev/releases"
+CACHE_TTL = 60 * 60 * 24
+REQUEST_TIMEOUT = 3
+
+
+def _cache_file():
+    return cache_dir() / "release.json"
+
+
+@functools.lru_cache(maxsize=None)
+def current_version() -> str:
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # Python < 3.8
+        from importlib_metadata import PackageNotFoundError, version
+
+    try:
+        return version("legl-dev")
+    except PackageNotFoundError:
+        return "0.0.0"
+
+
+def parse_version(version: str) -> tuple:
+    return tuple(int(part) for part in re.findall(r"\d+", version))
+
+
+def latest_version():
+    if os.environ.get("LEGL_DEV_NO_UPDATE_CHECK"):
+        return None
+    cached = read_json(_cache_file(), {})
+    if time.time() - cached.get("checked_at", 0) > CACHE_TTL:
+        # Stamp the cache before spawning so concurrent invocations
+        # don't all start their own refresh
+        try:
+            write_json(
+                _cache_file(),
+                {"checked_at": time.time(), "latest": cached.get("latest")},
+            )
+        except OSError:
+            # without a writable cache every invocation would spawn a refresh
+            return cached.get("latest")
+        refresh_in_background()
+    return cached.get("latest")
+
+
+def refresh_in_background():
+    subprocess.Popen(
+        [sys.executable, "-m", "legl_dev.release"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def refresh():
+    import requests
+
+    try:
+        response = requests.get(
+            url=os.environ.get("LEGL_DEV_RELEASES_URL", RELEASES_URL),
+            headers={"Accept": "application/vnd.github.v3+json"},
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        latest = response.json()[0]["tag_name"]
+    except (requests.RequestException, ValueError, LookupError, TypeError):
+        return
+    write_json(_cache_file(), {"checked_at": time.time(), "latest": latest})
+
+
+if __name__ == "__main__":
+    refresh()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import os
+import pathlib
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+# A project name, optionally with extras, followed by a version specifier,
+# a direct reference, an environment marker or nothing
+_REQUIREMENT = re.compile(
+    r"^\s*([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*(?:\[[^\]]*\])?\s*"
+    r"(?:[<>=!~;@]|#|$)"
+)
+
+
+def canonical(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def package_name(requirement: str) -> Optional[str]:
+    # None for comments, options like -r and -e, and bare URLs or paths
+    match = _REQUIREMENT.match(requirement)
+    return match.group(1) if match else None
+
+
+def _parts(requirement: str) -> Tuple[Set[str], str, str]:
+    # the extras, environment marker and comment around the version specifier
+    requirement, _, comment = requirement.partition(" #")
+    requirement, _, marker = requirement.partition(";")
+    match = re.search(r"\[([^\]]*)\]", requirement)
+    extras = {
+        extra.strip() for extra in (match.group(1) if match else "").split(",")
+    } - {""}
+    return extras, marker.strip(), comment.strip()
+
+
+def _pinned(
+    name: str, version: str, extras: Set[str], marker: str, comment: str
+) -> str:
+    line = name + (f"[{','.join(sorted(extras))}]" if extras else "")
+    line += f"=={version}" + (f" ; {marker}" if marker else "")
+    return line + (f"  # {comment}" if comment else "")
+
+
+def parse_show(output: str) -> Dict[str, str]:
+    # `pip show` prints a block of "Field: value" lines per package
+    versions = {}
+    for block in re.split(r"^---$", output, flags=re.M):
+        fields = dict(
+            line.split(": ", 1) for line in block.splitlines() if ": " in line
+        )
+        if "Name" in fields and "Version" in fields:
+            versions[fields["Name"]] = fields["Version"]
+    return versions
+
+
+def pin(
+    path: str, versions: Dict[str, str], requested: Optional[List[str]] = None
+) -> None:
+    # only the version is replaced, extras and markers are kept from the
+    # requested spec or the existing line
+    specs = {
+        canonical(package_name(spec)): spec
+        for spec in requested or []
+        if package_name(spec) is not None
+    }
+    try:
+        lines = pathlib.Path(path).read_text().splitlines()
+    except FileNotFoundError:
+        lines = []
+
+    # everything before the first requirement stays at the top, later comments
+    # move with the requirement below them
+    header, entries, comments = [], {}, []
+    for line in lines:
+        name = package_name(line)
+        if name is not None:
+            entries[canonical(name)] = comments + [line]
+            comments = []
+        elif not entries:
+            header.append(line)
+        elif line.strip():
+            comments.append(line)
+    for name, version in versions.items():
+        previous = entries.get(canonical(name), [])
+        extras, marker, comment = _parts(previous[-1] if previous else "")
+        if canonical(name) in specs:
+            requested_extras, requested_marker, _ = _parts(specs[canonical(name)])
+            extras |= requested_extras
+            marker = requested_marker or marker
+        entries[canonical(name)] = previous[:-1] + [
+            _pinned(name, version, extras, marker, comment)
+        ]
+
+    while header and not header[-1].strip():
+        header.pop()
+    output: List[str] = header + ([""] if header and entries else [])
+    for name in sorted(entries):
+        output += entries[name]
+    output += comments
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write("\n".join(output) + "\n")
+    os.replace(tmp, path)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import os
+import pathlib
+import shlex
+import time
+from typing import List, Optional
+
+from legl_dev import fingerprint
+from legl_dev.cache import project_dir, read_json, remove, write_json
+from legl_dev.command import Command
+
+# The connection details come from the official postgres image's environment
+_DATABASE = '-U "${POSTGRES_USER:-postgres}" -d "${POSTGRES_DB:-${POSTGRES_USER:-postgres}}"'
+DUMP = f"pg_dump -Fc {_DATABASE}"
+RESTORE = f"pg_restore --clean --if-exists --no-owner --single-transaction {_DATABASE}"
+DEFAULT_LIMIT_MB = 2048
+
+
+def snapshot_dir() -> pathlib.Path:
+    return project_dir() / "snapshots"
+
+
+def _index_file() -> pathlib.Path:
+    return snapshot_dir() / "index.json"
+
+
+def path(key: str) -> pathlib.Path:
+    return snapshot_dir() / f"{key}.dump"
+
+
+def current_key() -> str:
+    return fingerprint.fingerprint(
+        fingerprint.MIGRATION_INPUTS + fingerprint.FACTORY_INPUTS
+    )[:16]
+
+
+def limit() -> int:
+    return int(os.environ.get("LEGL_DEV_SNAPSHOT_LIMIT_MB", DEFAULT_LIMIT_MB)) << 20
+
+
+def exists(key: str) -> bool:
+    return key in read_json(_index_file(), {}) and path(key).exists()
+
+
+def snapshots() -> List[dict]:
+    index = read_json(_index_file(), {})
+    return sorted(
+        ({"key": key, **info} for key, info in index.items()),
+        key=lambda snapshot: snapshot["last_used"],
+        reverse=True,
+    )
+
+
+def dump_command(docker_cmd: str, key: str) -> Command:
+    tmp = shlex.quote(str(path(key).with_suffix(".tmp")))
+    # a failed dump must not leave a partial file behind
+    return Command(
+        command=(
+            f"mkdir -p {shlex.quote(str(snapshot_dir()))} && "
+            f"{{ {docker_cmd} exec -T database sh -c {shlex.quote(DUMP)} > {tmp} "
+            f"|| {{ rm -f {tmp}; exit 1; }}; }} && "
+            f"mv {tmp} {shlex.quote(str(path(key)))}"
+        ),
+        shell=True,
+        name="snapshot database",
+    )
+
+
+def restore_command(docker_cmd: str, key: str) -> Command:
+    return Command(
+        command=(
+            f"{docker_cmd} exec -T database sh -c {shlex.quote(RESTORE)} "
+            f"< {shlex.quote(str(path(key)))}"
+        ),
+        shell=True,
+        name="restore database",
+    )
+
+
+def register(key: str) -> List[str]:
+    index = read_json(_index_file(), {})
+    now = time.time()
+    index[key] = {
+        "size": path(key).stat().st_size,
+        "created_at": now,
+        "last_used": now,
+    }
+    write_json(_index_file(), index)
+    return prune()
+
+
+def touch(key: str) -> None:
+    index = read_json(_index_file(), {})
+    if key in index:
+        index[key]["last_used"] = time.time()
+        write_json(_index_file(), index)
+
+
+def prune(max_size: Optional[int] = None) -> List[str]:
+    max_size = limit() if max_size is None else max_size
+    index = read_json(_index_file(), {})
+    # least recently used first, but always keep the newest snapshot
+    keys = sorted(index, key=lambda key: index[key]["last_used"])[:-1]
+    total = sum(info["size"] for info in index.values())
+    removed = []
+    for key in keys:
+        if total <= max_size:
+            break
+        total -= index.pop(key)["size"]
+        remove(path(key))
+        removed.append(key)
+    if removed:
+        write_json(_index_file(), index)
+    return removed
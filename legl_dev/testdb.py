@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import shlex
+
+from legl_dev import fingerprint
+from legl_dev.command import Command
+
+TEMPLATE_PREFIX = "legl_dev_template_"
+
+# Runs inside `manage.py shell -c`. The template is made the way pytest-django
+# makes a test database, then copied for each xdist worker with Postgres'
+# CREATE DATABASE ... TEMPLATE, which is a file copy rather than a migrate
+SCRIPT = """
+from django.db import connection
+
+template = {template!r}
+rebuild = {rebuild!r}
+creation = connection.creation
+test_name = creation._get_test_db_name()
+quote = connection.ops.quote_name
+with connection._nodb_cursor() as cursor:
+    cursor.execute(
+        "SELECT datname FROM pg_database WHERE datname LIKE %s", [{prefix!r} + "%"]
+    )
+    templates = {{row[0] for row in cursor.fetchall()}}
+
+if rebuild or template not in templates:
+    print("Migrating the test database template " + template, flush=True)
+    creation.create_test_db(verbosity=1, autoclobber=True, serialize=False)
+    connection.close()
+    with connection._nodb_cursor() as cursor:
+        # templates for older migrations are never used again
+        for name in templates | {{template}}:
+            cursor.execute("DROP DATABASE IF EXISTS " + quote(name))
+        cursor.execute(
+            "CREATE DATABASE " + quote(template) + " TEMPLATE " + quote(test_name)
+        )
+
+with connection._nodb_cursor() as cursor:
+    for index in range({workers}):
+        name = "%s_gw%d" % (test_name, index)
+        cursor.execute("DROP DATABASE IF EXISTS " + quote(name))
+        cursor.execute("CREATE DATABASE " + quote(name) + " TEMPLATE " + quote(template))
+print("Cloned %d worker databases from %s" % ({workers}, template), flush=True)
+"""
+
+
+def template_name() -> str:
+    return TEMPLATE_PREFIX + fingerprint.fingerprint(fingerprint.MIGRATION_INPUTS)[:16]
+
+
+def clone_command(runner: str, workers: int, rebuild: bool = False) -> Command:
+    # runner is how commands are run in the backend, e.g. `docker compose run --rm backend`
+    script = SCRIPT.format(
+        template=template_name(),
+        prefix=TEMPLATE_PREFIX,
+        rebuild=rebuild,
+        workers=workers,
+    )
+    return Command(
+        command=f"{runner} python manage.py shell -c {shlex.quote(script)}",
+        shell=True,
+        name="clone test databases",
+    )
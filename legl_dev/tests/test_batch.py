@@ -0,0 +1,68 @@
+import sys
+
+import pytest
+from legl_dev import batch
+from legl_dev.batch import ManagementCommands
+
+FAKE_DJANGO = """
+import sys
+
+def call_command(name, *args):
+    if name == "broken":
+        raise RuntimeError("broken command")
+    if name == "exits":
+        sys.exit(3)
+    print("ran", name, *args)
+"""
+
+
+@pytest.fixture
+def fake_manage(tmp_path, monkeypatch):
+    package = tmp_path / "django" / "core" / "management"
+    package.mkdir(parents=True)
+    (tmp_path / "django" / "__init__.py").write_text("")
+    (tmp_path / "django" / "core" / "__init__.py").write_text("")
+    (package / "__init__.py").write_text(FAKE_DJANGO)
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path))
+
+    def make(commands):
+        step = ManagementCommands("docker compose", commands)
+        # run the batch script locally instead of in the container
+        step.args = [sys.executable, "-c", step.args[-1]]
+        return step
+
+    return make
+
+
+def test_batch_runs_every_command_in_one_process(fake_manage, capsys):
+    step = fake_manage(["migrate", "run_factories --fast"])
+    assert step.run()
+    output = capsys.readouterr().out
+    assert "Running: manage.py migrate" in output
+    assert "ran migrate" in output
+    assert "ran run_factories --fast" in output
+    assert output.count("Command successful") == 2
+    assert batch.MARKER not in output
+
+
+def test_batch_stops_at_the_first_failure(fake_manage, capsys):
+    step = fake_manage(["migrate", "broken", "seed_emails"])
+    assert not step.run()
+    assert step.returncode == 1
+    output = capsys.readouterr().out
+    assert "Command successful" in output
+    assert output.count("Command exited with code 1") == 1
+    assert "RuntimeError: broken command" in output
+    assert "ran seed_emails" not in output
+
+
+def test_batch_reports_exit_codes(fake_manage):
+    step = fake_manage(["exits"])
+    assert not step.run()
+    assert step.returncode == 3
+
+
+def test_batch_command_is_readable():
+    step = ManagementCommands("docker compose", ["migrate", "seed_emails"])
+    assert step.args[:6] == ["docker", "compose", "exec", "-T", "server", "python"]
+    assert step.name == "manage.py migrate, seed_emails"
@@ -0,0 +1,140 @@
+import subprocess
+import time
+
+import pytest
+import typer
+from legl_dev import branches, main
+
+BRANCH_COUNT = 10000
+TIME_BUDGET = 10
+
+
+def _git(*args, **kwargs):
+    return subprocess.run(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@t", *args],
+        check=True,
+        capture_output=True,
+        universal_newlines=True,
+        **kwargs,
+    ).stdout.strip()
+
+
+def _heads():
+    return set(_git("for-each-ref", "--format=%(refname:short)", "refs/heads/").split())
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    root = tmp_path / "repo"
+    root.mkdir()
+    monkeypatch.chdir(root)
+    _git("init", "-q", "-b", "main")
+    _git("commit", "-q", "--allow-empty", "-m", "init")
+    merged_sha = _git("rev-parse", "HEAD")
+    _git("checkout", "-q", "-b", "unmerged")
+    _git("commit", "-q", "--allow-empty", "-m", "work in progress")
+    _git("checkout", "-q", "main")
+    for name in ("dev", "master", "release/1.0", "feature/device"):
+        _git("branch", name)
+    _git("worktree", "add", "-q", str(tmp_path / "worktree"), "-b", "checked-out")
+    return root, merged_sha
+
+
+def test_gitclean_deletes_merged_branches(repo, capsys):
+    main.gitclean(
+        into="HEAD",
+        protect=branches.PROTECTED + ["release/*"],
+        dry_run=False,
+        prune=False,
+        remote="origin",
+    )
+    # "dev" used to protect anything containing it
+    assert _heads() == {
+        "main",
+        "master",
+        "dev",
+        "release/1.0",
+        "unmerged",
+        "checked-out",
+    }
+    assert "Deleted 1 branches merged into HEAD" in capsys.readouterr().out
+
+
+def test_gitclean_dry_run_lists_without_deleting(repo, capsys):
+    before = _heads()
+    main.gitclean(
+        into="HEAD",
+        protect=branches.PROTECTED,
+        dry_run=True,
+        prune=False,
+        remote="origin",
+    )
+    assert _heads() == before
+    output = capsys.readouterr().out
+    assert "2 branches merged into HEAD would be deleted" in output
+    assert "  release/1.0" in output and "  feature/device" in output
+
+
+def test_protection_can_be_configured_per_repo(repo):
+    _, sha = repo
+    _git("config", "--add", branches.PROTECT_CONFIG, "release/*")
+    _git("config", "--add", branches.PROTECT_CONFIG, "feature/*")
+    assert branches.merged("HEAD", branches.protected_patterns([])) == [
+        ("dev", sha),
+        ("master", sha),
+    ]
+
+
+def test_gitclean_prunes_remote_tracking_branches(repo, tmp_path):
+    _git("init", "-q", "--bare", str(tmp_path / "remote.git"))
+    _git("remote", "add", "origin", str(tmp_path / "remote.git"))
+    _git("push", "-q", "origin", "main", "dev")
+    _git("--git-dir", str(tmp_path / "remote.git"), "branch", "-D", "dev")
+    main.gitclean(
+        into="HEAD",
+        protect=branches.PROTECTED,
+        dry_run=False,
+        prune=True,
+        remote="origin",
+    )
+    remotes = _git("for-each-ref", "--format=%(refname:short)", "refs/remotes/")
+    assert remotes.split() == ["origin/main"]
+
+
+def test_deletion_is_all_or_nothing(repo):
+    _, sha = repo
+    error = branches.delete([("dev", sha), ("master", "0" * 39 + "1")])
+    assert error
+    assert {"dev", "master"} <= _heads()
+
+
+def test_gitclean_outside_a_repo_fails(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(typer.Exit):
+        main.gitclean(
+            into="HEAD", protect=[], dry_run=True, prune=False, remote="origin"
+        )
+
+
+def test_gitclean_scales_to_thousands_of_branches(repo, capsys):
+    _, sha = repo
+    _git(
+        "update-ref",
+        "--stdin",
+        input="".join(
+            f"create refs/heads/merged/{index} {sha}\n" for index in range(BRANCH_COUNT)
+        ),
+    )
+    start = time.monotonic()
+    main.gitclean(
+        into="HEAD",
+        protect=branches.PROTECTED + ["release/*"],
+        dry_run=False,
+        prune=False,
+        remote="origin",
+    )
+    elapsed = time.monotonic() - start
+    with capsys.disabled():
+        print(f"\ngitclean {BRANCH_COUNT} branches: {elapsed:.2f}s")
+    assert not any(name.startswith("merged/") for name in _heads())
+    assert elapsed < TIME_BUDGET
@@ -0,0 +1,119 @@
+import tracemalloc
+
+import pytest
+import typer
+from legl_dev import capture
+from legl_dev.command import Command, Steps
+
+
+def test_capture_splits_lines_across_chunks():
+    output = capture.Capture("test")
+    assert output.feed(b"one\ntw") == ["one"]
+    assert output.feed(b"o\r\nthree") == ["two"]
+    assert output.close() == ["three"]
+    assert list(output.tail) == ["one", "two", "three"]
+    assert output.log.path.read_bytes() == b"one\ntwo\r\nthree"
+
+
+def test_capture_bounds_lines_without_newlines(monkeypatch):
+    monkeypatch.setattr(capture, "MAX_LINE", 4)
+    output = capture.Capture("test")
+    assert output.feed(b"x" * 10) == ["xxxx", "xxxx"]
+    assert output.close() == ["xx"]
+
+
+def test_logs_rotate_between_runs_and_by_size():
+    path = capture.log_path("test")
+    for run in range(5):
+        log = capture.RotatingLog(path, backups=2)
+        log.write(f"run {run}\n".encode())
+        log.close()
+    assert path.read_text() == "run 4\n"
+    assert path.with_name(path.name + ".1").read_text() == "run 3\n"
+    assert path.with_name(path.name + ".2").read_text() == "run 2\n"
+    assert not path.with_name(path.name + ".3").exists()
+
+    log = capture.RotatingLog(path, max_bytes=10, backups=2)
+    for chunk in (b"aaaaaa", b"bbbbbb", b"cccccc"):
+        log.write(chunk)
+    log.close()
+    assert path.read_bytes() == b"cccccc"
+    assert path.with_name(path.name + ".1").read_bytes() == b"bbbbbb"
+
+
+def test_large_output_is_captured_in_constant_memory(monkeypatch, capfd):
+    monkeypatch.setattr(capture, "MAX_LOG_BYTES", 4 << 20)
+    # 24MB of output, with a final 8MB line without any newline
+    command = Command(
+        command="yes 'some test output' | head -c 16777216; head -c 8388608 /dev/zero",
+        shell=True,
+        name="noisy",
+        capture=True,
+    )
+    tracemalloc.start()
+    try:
+        assert command.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < capture.TAIL_LINES * capture.MAX_LINE + (1 << 20)
+    assert len(command.tail) == capture.TAIL_LINES
+    assert command.log_file.stat().st_size <= 4 << 20
+    assert command.log_file.with_name(command.log_file.name + ".3").exists()
+    assert len(capfd.readouterr().out) >= 24 << 20
+
+
+def test_parallel_failures_are_replayed(capsys):
+    steps = Steps(
+        [
+            Command(command="sh -c 'echo boom; exit 1'", shell=True, name="fail"),
+            Command(command="echo fine", name="fine", depends_on=[]),
+        ],
+        workers=2,
+    )
+    with pytest.raises(typer.Exit):
+        steps.run()
+    output = capsys.readouterr().out.splitlines()
+    replay = output.index("📜 Last 1 lines from fail:")
+    assert output[replay + 1] == "boom"
+    log_file = capture.log_path("fail")
+    assert output[replay + 2] == f"📜 Full output of fail is in {log_file}"
+    assert log_file.read_text() == "boom\n"
+
+
+def test_sequential_steps_are_captured_by_default(capfd):
+    Steps([Command(command="echo captured", name="echo")]).run()
+    assert "captured\n" in capfd.readouterr().out
+    assert capture.log_path("echo").read_text() == "captured\n"
+
+
+def test_interactive_steps_keep_the_terminal(capfd):
+    Steps([Command(command="echo interactive", name="echo", capture=False)]).run()
+    assert "interactive\n" in capfd.readouterr().out
+    assert not capture.log_path("echo").exists()
+
+
+TTY_CHECK = "python -c 'import sys; print(sys.stdout.isatty(), sys.stderr.isatty())'"
+
+
+def test_captured_steps_see_a_terminal_when_we_have_one(monkeypatch, capfd):
+    monkeypatch.setattr("legl_dev.command._terminal_output", lambda: True)
+    Steps([Command(command=TTY_CHECK, shell=True, name="tty")]).run()
+    assert "True True\n" in capfd.readouterr().out
+    assert capture.log_path("tty").read_text() == "True True\n"
+
+
+def test_prefixed_and_redirected_steps_get_a_pipe(monkeypatch, capfd):
+    monkeypatch.setattr("legl_dev.command._terminal_output", lambda: True)
+    Steps(
+        [
+            Command(command=TTY_CHECK, shell=True, name="tty", depends_on=[]),
+            Command(command="true", name="other", depends_on=[]),
+        ],
+        workers=2,
+    ).run()
+    assert "[tty] False False\n" in capfd.readouterr().out
+
+    monkeypatch.setattr("legl_dev.command._terminal_output", lambda: False)
+    Steps([Command(command=TTY_CHECK, shell=True, name="tty")]).run()
+    assert "False False\n" in capfd.readouterr().out
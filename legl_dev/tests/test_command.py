@@ -1,22 +1,26 @@
+import json
+import subprocess
+import time
 from unittest import mock
 
+import pytest
+import typer
+from legl_dev import timing
 from legl_dev.command import Command, Steps
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_command_run(run):
     command = Command(command="echo test")
     command.run()
-    run.assert_called_with(
-        ["echo", "test"], universal_newlines=True, shell=False, check=True
-    )
+    run.assert_called_with(command, ["echo", "test"], False)
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_command_run_with_shell(run):
     command = Command(command="echo test", shell=True)
     command.run()
-    run.assert_called_with("echo test", universal_newlines=True, shell=True, check=True)
+    run.assert_called_with(command, "echo test", False)
 
 
 def test_adding_commands_to_steps():
@@ -56,7 +60,7 @@ def test_steps_dont_overflow_instance():
     assert steps_two.steps == [test_command_two]
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_standard_start(run):
     test_command_one = Command(command="echo test one")
     test_command_two = Command(command="echo test two")
@@ -64,14 +68,227 @@ def test_standard_start(run):
     steps.add(test_command_two)
     steps.run()
     calls = [
-        mock.call(
-            ["echo", "test", "one"], universal_newlines=True, shell=False, check=True
-        ),
-        mock.call(
-            ["echo", "test", "two"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
-        ),
+        mock.call(test_command_one, ["echo", "test", "one"], False),
+        mock.call(test_command_two, ["echo", "test", "two"], False),
     ]
     run.assert_has_calls(calls)
+
+
+def test_steps_default_to_running_after_the_previous_step():
+    test_command_one = Command(command="echo test one")
+    test_command_two = Command(command="echo test two")
+    steps = Steps([test_command_one, test_command_two])
+    assert steps._graph() == {
+        test_command_one: set(),
+        test_command_two: {test_command_one},
+    }
+
+
+def test_steps_resolve_dependencies_by_name():
+    test_command_one = Command(command="echo test one", name="one")
+    test_command_two = Command(command="echo test two", name="two", depends_on=[])
+    test_command_three = Command(
+        command="echo test three", depends_on=["one", "two"]
+    )
+    steps = Steps([test_command_one, test_command_two, test_command_three])
+    assert steps._graph()[test_command_three] == {test_command_one, test_command_two}
+
+
+def test_steps_reject_unknown_dependencies():
+    steps = Steps([Command(command="echo test", depends_on=["missing"])])
+    with pytest.raises(ValueError):
+        steps.run()
+
+
+def test_independent_steps_run_concurrently():
+    steps = Steps(
+        [
+            Command(command="sleep 0.5", name="one"),
+            Command(command="sleep 0.5", name="two", depends_on=[]),
+        ],
+        workers=2,
+    )
+    start = time.monotonic()
+    steps.run()
+    assert time.monotonic() - start < 0.9
+
+
+def test_parallel_output_is_prefixed(capsys):
+    steps = Steps(
+        [
+            Command(command="echo test one", name="one"),
+            Command(command="echo test two", name="two", depends_on=[]),
+        ],
+        workers=2,
+    )
+    steps.run()
+    output = capsys.readouterr().out.splitlines()
+    assert "[one] test one" in output
+    assert "[two] test two" in output
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_single_worker_runs_steps_in_dependency_order(run):
+    test_command_one = Command(command="echo test one", depends_on=["two"])
+    test_command_two = Command(command="echo test two", name="two", depends_on=[])
+    steps = Steps([test_command_one, test_command_two], workers=1)
+    steps.run()
+    assert [c[0][1] for c in run.call_args_list] == [
+        ["echo", "test", "two"],
+        ["echo", "test", "one"],
+    ]
+
+
+def test_command_run_reports_failure():
+    command = Command(command="sh -c 'exit 3'", shell=True)
+    assert not command.run()
+    assert command.returncode == 3
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_steps_stop_at_the_first_failure(run):
+    run.side_effect = [None, subprocess.CalledProcessError(2, "fail"), None]
+    steps = Steps(
+        [
+            Command(command="echo test one"),
+            Command(command="echo test two"),
+            Command(command="echo test three"),
+        ]
+    )
+    with pytest.raises(typer.Exit) as exit:
+        steps.run()
+    assert exit.value.exit_code == 2
+    assert run.call_count == 2
+
+
+def test_parallel_steps_dont_start_dependents_after_a_failure(tmp_path):
+    marker = tmp_path / "ran"
+    steps = Steps(
+        [
+            Command(command="false", name="fail"),
+            Command(command="sleep 0.2", name="slow", depends_on=[]),
+            Command(command=f"touch {marker}", depends_on=["fail", "slow"]),
+        ],
+        workers=2,
+    )
+    with pytest.raises(typer.Exit):
+        steps.run()
+    assert not marker.exists()
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_named_steps_resume_from_the_failed_step(run):
+    def pipeline():
+        return Steps(
+            [
+                Command(command="echo test one"),
+                Command(command="echo test two"),
+                Command(command="echo test three"),
+            ],
+            name="test",
+        )
+
+    run.side_effect = [None, subprocess.CalledProcessError(1, "fail")]
+    with pytest.raises(typer.Exit):
+        pipeline().run()
+
+    run.reset_mock()
+    run.side_effect = None
+    pipeline().run(resume=True)
+    assert [c[0][1] for c in run.call_args_list] == [
+        ["echo", "test", "two"],
+        ["echo", "test", "three"],
+    ]
+
+    # a successful run clears the checkpoint
+    run.reset_mock()
+    pipeline().run(resume=True)
+    assert run.call_count == 3
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_resume_ignores_checkpoints_from_a_different_pipeline(run):
+    run.side_effect = [None, subprocess.CalledProcessError(1, "fail")]
+    with pytest.raises(typer.Exit):
+        Steps(
+            [Command(command="echo test one"), Command(command="echo test two")],
+            name="test",
+        ).run()
+
+    run.reset_mock()
+    run.side_effect = None
+    Steps(
+        [Command(command="echo other one"), Command(command="echo other two")],
+        name="test",
+    ).run(resume=True)
+    assert run.call_count == 2
+
+
+def test_prefixed_steps_record_their_peak_rss():
+    command = Command(
+        command="python -c 'bytearray(64 << 20)'", shell=True, name="allocate"
+    )
+    assert command.run(prefix=True)
+    assert command.returncode == 0
+    assert command.peak_rss > 64 << 20
+
+
+def test_steps_print_timings_and_write_a_trace(tmp_path, monkeypatch, capsys):
+    trace_file = tmp_path / "trace.json"
+    monkeypatch.setattr(Steps, "trace_file", str(trace_file))
+    monkeypatch.setattr(timing, "_events", [])
+    steps = Steps(
+        [
+            Command(command="sleep 0.2", name="one"),
+            Command(command="false", name="two", depends_on=[]),
+            Command(command="echo test three", name="three", depends_on=["two"]),
+        ],
+        workers=2,
+        name="traced",
+    )
+    with pytest.raises(typer.Exit):
+        steps.run()
+
+    output = capsys.readouterr().out.splitlines()
+    assert "⏱  Step timings" in output
+    assert any(line.startswith("  two  ") and "exit   1" in line for line in output)
+    assert "  three  not run" in output
+
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    steps_traced = {e["name"]: e for e in events if e["cat"] == "step"}
+    assert set(steps_traced) == {"one", "two"}
+    assert steps_traced["one"]["dur"] >= 200000
+    assert steps_traced["two"]["args"]["returncode"] == 1
+    assert steps_traced["one"]["tid"] != steps_traced["two"]["tid"]
+    pipeline = next(e for e in events if e["name"] == "traced")
+    assert pipeline["ph"] == "X" and pipeline["dur"] >= steps_traced["one"]["dur"]
+
+
+def test_missing_commands_fail_with_127(capsys):
+    command = Command(command="legl-dev-missing-command --help")
+    assert not command.run()
+    assert command.returncode == 127
+    assert "Couldn't run legl-dev-missing-command --help" in capsys.readouterr().out
+
+
+def test_missing_commands_in_parallel_fail_the_pipeline_cleanly(capsys):
+    steps = Steps(
+        [
+            Command(command="legl-dev-missing-command", name="missing"),
+            Command(command="echo test two", name="two", depends_on=[]),
+        ],
+        workers=2,
+    )
+    with pytest.raises(typer.Exit) as exit:
+        steps.run()
+    assert exit.value.exit_code == 127
+    assert "⏱  Step timings" in capsys.readouterr().out
+
+
+def test_sequential_steps_record_their_peak_rss():
+    command = Command(
+        command="python -c 'bytearray(64 << 20)'", shell=True, name="allocate"
+    )
+    assert command.run()
+    assert command.returncode == 0
+    assert command.peak_rss > 64 << 20
@@ -0,0 +1,84 @@
+import os
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+from legl_dev import client, daemon, release
+
+
+@pytest.fixture
+def running_daemon(monkeypatch):
+    monkeypatch.setenv("LEGL_DEV_NO_UPDATE_CHECK", "1")
+    assert daemon.start()
+    yield daemon.pid()
+    daemon.stop()
+
+
+def _legl_dev(*args, **env):
+    return subprocess.run(
+        [sys.executable, "-m", "legl_dev.client", *args],
+        capture_output=True,
+        universal_newlines=True,
+        env={**os.environ, **env},
+    )
+
+
+def test_client_falls_back_without_a_daemon(monkeypatch):
+    monkeypatch.setenv("LEGL_DEV_NO_UPDATE_CHECK", "1")
+    assert client.run_in_daemon(["--version"]) is None
+    result = _legl_dev("--version")
+    assert result.returncode == 0
+    assert result.stdout == f"v{release.current_version()}\n"
+
+
+def test_daemon_runs_commands_with_the_clients_io(running_daemon, tmp_path):
+    result = _legl_dev("--version")
+    assert result.returncode == 0
+    assert result.stdout == f"v{release.current_version()}\n"
+
+    result = _legl_dev("not-a-command")
+    assert result.returncode == 2
+    assert "No such command" in result.stderr
+
+    # commands run in the client's directory
+    (tmp_path / "project").mkdir()
+    result = subprocess.run(
+        [sys.executable, "-m", "legl_dev.client", "db", "list"],
+        cwd=tmp_path / "project",
+        capture_output=True,
+        universal_newlines=True,
+    )
+    assert result.returncode == 0
+    assert daemon.pid() == running_daemon
+
+
+def test_daemon_socket_is_private(running_daemon):
+    assert stat.S_IMODE(os.stat(client.socket_path()).st_mode) & 0o077 == 0
+
+
+def test_daemon_stop_removes_the_socket(running_daemon):
+    assert os.path.exists(client.socket_path())
+    assert daemon.stop()
+    assert daemon.pid() is None
+    assert not os.path.exists(client.socket_path())
+    assert client.run_in_daemon(["--version"]) is None
+
+
+def test_daemon_latency_benchmark(running_daemon):
+    def best_of(runs, **env):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            assert _legl_dev("--version", **env).returncode == 0
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    with_daemon = best_of(5)
+    without_daemon = best_of(5, LEGL_DEV_NO_DAEMON="1")
+    print(
+        f"\nlegl-dev --version: {without_daemon * 1000:.0f}ms without the daemon, "
+        f"{with_daemon * 1000:.0f}ms with it"
+    )
+    assert with_daemon < without_daemon
@@ -0,0 +1,133 @@
+import os
+import shlex
+import subprocess
+import sys
+from unittest import mock
+
+import pytest
+from legl_dev import durations, main
+
+JUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest">
+<testcase classname="app.tests.test_models.TestSave" name="test_save" time="2.5"/>
+<testcase classname="app.tests.test_models.TestSave" name="test_update" time="1.5"/>
+<testcase classname="app.tests.test_views" name="test_get" time="0.5"/>
+</testsuite></testsuites>
+"""
+
+
+def test_record_stores_test_and_module_durations(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "app" / "tests").mkdir(parents=True)
+    (tmp_path / "app" / "tests" / "test_models.py").write_text("")
+    (tmp_path / durations.JUNIT_FILE).write_text(JUNIT)
+    assert durations.record() == (
+        {
+            "app/tests/test_models.py": 4.0,
+            "app/tests/test_views.py": 0.5,
+        },
+        {},
+    )
+    assert not (tmp_path / durations.JUNIT_FILE).exists()
+    stored = durations.load()
+    assert stored["tests"]["app/tests/test_models.py::test_update"] == 1.5
+    assert stored["modules"]["app/tests/test_views.py"] == 0.5
+
+
+WORKER_JUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest">
+<testcase classname="test_a" name="test_one" time="3.0">
+<properties><property name="xdist_worker" value="gw0"/></properties></testcase>
+<testcase classname="test_a" name="test_two" time="1.0">
+<properties><property name="xdist_worker" value="gw1"/></properties></testcase>
+<testcase classname="test_b" name="test_one" time="0.5">
+<properties><property name="xdist_worker" value="gw1"/></properties></testcase>
+</testsuite></testsuites>
+"""
+
+
+def test_record_totals_what_each_worker_ran(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / durations.JUNIT_FILE).write_text(WORKER_JUNIT)
+    modules, workers = durations.record()
+    assert modules == {"test_a.py": 4.0, "test_b.py": 0.5}
+    assert workers == {
+        "gw0": {"test_a.py": 3.0},
+        "gw1": {"test_a.py": 1.0, "test_b.py": 0.5},
+    }
+
+
+def test_the_worker_plugin_tags_junit_reports(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "test_a.py").write_text("def test_one():\n    pass\n")
+    (tmp_path / "test_b.py").write_text("def test_one():\n    pass\n")
+    script = durations.with_worker_plugin(
+        f"{shlex.quote(sys.executable)} -m pytest -q -p no:cacheprovider "
+        f"--junitxml={durations.JUNIT_FILE} test_a.py test_b.py"
+    )
+    # the container mounts the repo at /code
+    script = script.replace("/code/", f"{tmp_path}/")
+    env = {**os.environ, "PYTEST_XDIST_WORKER": "gw3", "PYTHONPATH": "/elsewhere"}
+    subprocess.run(["sh", "-c", script], env=env, check=True, capture_output=True)
+    assert durations.record()[1].keys() == {"gw3"}
+    assert sorted(durations.load()["modules"]) == ["test_a.py", "test_b.py"]
+
+
+@mock.patch(
+    "legl_dev.main.durations.record",
+    return_value=({}, {"gw0": {"a.py": 9.0}, "gw1": {"b.py": 2.0, "c.py": 1.0}}),
+)
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_parallel_runs_report_each_workers_actual_time(
+    run, _, tmp_path, monkeypatch, capsys
+):
+    monkeypatch.chdir(tmp_path)
+    main.pytest(
+        full_diff=False,
+        create_db=False,
+        last_failed=False,
+        warnings=False,
+        snapshot_update=False,
+        show_capture=False,
+        parallel=True,
+        all_logs=False,
+        warm_runner=False,
+        changed=False,
+        since=None,
+        shard=None,
+        watch=False,
+        template_db=False,
+        path="",
+    )
+    command = run.call_args[0][0]
+    assert command.shell
+    assert command.command.startswith("docker compose run --rm backend sh -c ")
+    assert f"-p {durations.WORKER_PLUGIN}" in command.command
+    output = capsys.readouterr().out
+    assert "gw0:    1 files  actual      9.0s" in output
+    assert "gw1:    2 files  actual      3.0s" in output
+    assert "actual slowest 9.0s, fastest 3.0s" in output
+
+
+def test_estimate_uses_the_average_for_unknown_files():
+    assert durations.estimate(["a.py", "b.py", "c.py"], {"a.py": 1, "b.py": 3}) == {
+        "a.py": 1,
+        "b.py": 3,
+        "c.py": 2,
+    }
+
+
+def test_balance_spreads_the_slowest_files():
+    plan = durations.balance({"a": 8, "b": 7, "c": 6, "d": 5, "e": 4}, 2)
+    assert plan == [(8 + 5 + 4, ["a", "d", "e"]), (7 + 6, ["b", "c"])]
+
+
+def test_balance_with_more_shards_than_files():
+    plan = durations.balance({"a": 1}, 3)
+    assert plan == [(1, ["a"]), (0, []), (0, [])]
+
+
+@pytest.mark.parametrize("shard", ["0/2", "3/2", "a/b", "1"])
+def test_parse_shard_rejects_invalid_shards(shard):
+    with pytest.raises(ValueError):
+        durations.parse_shard(shard)
@@ -0,0 +1,210 @@
+import subprocess
+import time
+from unittest import mock
+
+import black
+import pytest
+from legl_dev import formatter, main
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    tmp_path = tmp_path / "repo"
+    tmp_path.mkdir()
+    monkeypatch.chdir(tmp_path)
+    subprocess.check_call(["git", "init", "-q"])
+    (tmp_path / "committed.py").write_text("x = 1\n")
+    (tmp_path / "renamed.js").write_text("x\n")
+    (tmp_path / "deleted.py").write_text("x = 1\n")
+    subprocess.check_call(["git", "add", "."])
+    subprocess.check_call(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qm", "init"]
+    )
+    return tmp_path
+
+
+def test_changed_files_includes_modified_staged_and_untracked(repo):
+    (repo / "committed.py").write_text("x = 2\n")
+    (repo / "new dir").mkdir()
+    (repo / "new dir" / "untracked.ts").write_text("x\n")
+    (repo / "staged.scss").write_text("x\n")
+    subprocess.check_call(["git", "add", "staged.scss"])
+    subprocess.check_call(["git", "mv", "renamed.js", "moved.js"])
+    (repo / "deleted.py").unlink()
+    assert formatter.changed_files() == [
+        "committed.py",
+        "moved.js",
+        "new dir/untracked.ts",
+        "staged.scss",
+    ]
+
+
+def test_route_by_extension():
+    assert formatter.route(["a.py", "b.tsx", "c.txt", "d.yml", "e.pyi"]) == (
+        ["a.py", "e.pyi"],
+        ["b.tsx", "d.yml"],
+    )
+
+
+def test_cache_skips_files_formatted_at_the_same_hash(repo):
+    cache = formatter.FormatCache()
+    cache.record(["committed.py"])
+    assert formatter.FormatCache().pending(["committed.py", "renamed.js"]) == [
+        "renamed.js"
+    ]
+    (repo / "committed.py").write_text("x = 2\n")
+    assert formatter.FormatCache().pending(["committed.py"]) == ["committed.py"]
+
+
+def test_cache_is_dropped_when_formatter_config_changes(repo):
+    formatter.FormatCache().record(["committed.py"])
+    (repo / "pyproject.toml").write_text("[tool.black]\nline-length = 100\n")
+    assert formatter.FormatCache().pending(["committed.py"]) == ["committed.py"]
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_format_changed_only_formats_changed_files(run, repo):
+    (repo / "committed.py").write_text("x = 2\n")
+    (repo / "style.css").write_text("a {}\n")
+    main.format(push=False, changed=True, in_process=False)
+    assert sorted(c[0][1] for c in run.call_args_list) == [
+        "black committed.py",
+        "isort --profile black committed.py",
+        "yarn prettier --write style.css",
+    ]
+
+    run.reset_mock()
+    main.format(push=False, changed=True, in_process=False)
+    run.assert_not_called()
+
+
+MESSY_SOURCE = """import sys
+from legl_dev.command import Steps, Command
+import os, json
+from typing import List,Dict
+def function_{index}(a,b = 1, *args, **kwargs) :
+    value = {{'key':a,"other" : b , 'list':[1,2,3,]}}
+    if a==b: return os.path.join( "a",'b' )
+    return json.dumps(value) + str(sys.argv) + str(List) + str(Dict)+str(Steps)+str(Command)
+class Thing_{index}( object ) :
+    def method(self):  return 'x'
+"""
+
+
+MESSY_STUB = """from typing import List
+def function(a,b = 1) -> List[int] :
+    ...
+class Thing( object ) :
+
+    x : int
+
+
+    def method(self) -> str:  ...
+"""
+
+
+DEFAULT_PYPROJECT = "[tool.black]\nline-length = 100\n"
+# The first line isn't Python, black only leaves it alone when it's skipped
+SETTINGS_PYPROJECT = f"""[tool.black]
+line-length = 100
+target-version = ["py38"]
+skip-source-first-line = true
+skip-magic-trailing-comma = true
+required-version = "{black.__version__.split(".")[0]}"
+force-exclude = "module_1\\\\.py"
+"""
+FIRST_LINE = "%%% a notebook cell marker\n"
+
+
+def _write_messy_files(root, count, pyproject=DEFAULT_PYPROJECT):
+    first_line = FIRST_LINE if pyproject == SETTINGS_PYPROJECT else ""
+    (root / "pkg").mkdir(parents=True)
+    for index in range(count):
+        (root / "pkg" / f"module_{index}.py").write_text(
+            first_line + MESSY_SOURCE.format(index=index)
+        )
+    (root / "pkg" / "stubs.pyi").write_text(first_line + MESSY_STUB)
+    (root / "pyproject.toml").write_text(pyproject)
+
+
+def _read_tree(root):
+    return {
+        path.relative_to(root): path.read_bytes()
+        for pattern in ("*.py", "*.pyi")
+        for path in sorted(root.rglob(pattern))
+    }
+
+
+@pytest.mark.parametrize(
+    "pyproject", [DEFAULT_PYPROJECT, SETTINGS_PYPROJECT], ids=["default", "settings"]
+)
+def test_in_process_formatting_matches_the_cli(
+    pyproject, tmp_path, monkeypatch, capsys
+):
+    count = formatter.POOL_THRESHOLD * 2
+    cli_root, api_root = tmp_path / "cli", tmp_path / "api"
+    _write_messy_files(cli_root, count, pyproject)
+    _write_messy_files(api_root, count, pyproject)
+    before = _read_tree(api_root)
+
+    start = time.monotonic()
+    subprocess.check_call(["isort", ".", "--profile", "black", "-q"], cwd=cli_root)
+    subprocess.check_call(["black", ".", "-q"], cwd=cli_root)
+    cli_time = time.monotonic() - start
+
+    monkeypatch.chdir(api_root)
+    start = time.monotonic()
+    assert formatter.PythonFormatter().run()
+    api_time = time.monotonic() - start
+
+    after = _read_tree(api_root)
+    assert after == _read_tree(cli_root)
+    assert len(after) == count + 1
+    assert all(after[path] != before[path] for path in after)
+    with capsys.disabled():
+        print(
+            f"\nformat {count} files: cli {cli_time:.2f}s, in-process {api_time:.2f}s"
+        )
+
+
+def test_in_process_formatting_of_named_files_matches_the_cli(tmp_path, monkeypatch):
+    cli_root, api_root = tmp_path / "cli", tmp_path / "api"
+    _write_messy_files(cli_root, 3, SETTINGS_PYPROJECT)
+    _write_messy_files(api_root, 3, SETTINGS_PYPROJECT)
+    files = [f"pkg/module_{index}.py" for index in range(3)] + ["pkg/stubs.pyi"]
+    subprocess.check_call(["isort", "--profile", "black", "-q"] + files, cwd=cli_root)
+    subprocess.check_call(["black", "-q"] + files, cwd=cli_root)
+
+    monkeypatch.chdir(api_root)
+    assert formatter.PythonFormatter(files).run()
+    assert _read_tree(api_root) == _read_tree(cli_root)
+    # force-exclude applies to named files too
+    assert b"%%%" in (api_root / "pkg" / "module_1.py").read_bytes()
+    assert (api_root / "pkg" / "module_1.py").read_text() != FIRST_LINE + (
+        MESSY_SOURCE.format(index=1)
+    )
+
+
+def test_unsupported_black_settings_fall_back_to_the_cli(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "fine.py").write_text("x=1\n")
+    (tmp_path / "pyproject.toml").write_text('[tool.black]\nrequired-version = "1"\n')
+    step = formatter.PythonFormatter(["fine.py"])
+    # black itself refuses to run with the wrong version
+    assert not step.run()
+    assert "running isort and black as commands" in capsys.readouterr().out
+    assert (tmp_path / "fine.py").read_text() == "x=1\n"
+
+    (tmp_path / "pyproject.toml").write_text("[tool.black]\nline-ranges = ['1-1']\n")
+    with pytest.raises(ValueError):
+        formatter._setup_formatters(str(tmp_path))
+
+
+def test_in_process_formatting_reports_failures(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "broken.py").write_text("def broken(:\n")
+    (tmp_path / "fine.py").write_text("x=1\n")
+    step = formatter.PythonFormatter(["broken.py", "fine.py"])
+    assert not step.run()
+    assert step.returncode == 1
+    assert (tmp_path / "fine.py").read_text() == "x = 1\n"
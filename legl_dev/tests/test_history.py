@@ -0,0 +1,83 @@
+import time
+from unittest import mock
+
+import pytest
+from legl_dev import history, main
+from legl_dev.command import Command, Steps
+
+
+def _record(command, durations, step="step"):
+    for duration in durations:
+        command_step = Command(command="echo test", name=step)
+        command_step.duration, command_step.returncode = duration, 0
+        history.record(command, [command_step], duration, 0)
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_steps_runs_are_recorded(run):
+    Steps(
+        [Command(command="echo test one"), Command(command="echo test two")],
+        name="test",
+    ).run()
+    durations = history.load("test")
+    assert set(durations) == {
+        ("test", "echo test one"),
+        ("test", "echo test two"),
+        ("test", "total"),
+    }
+    assert all(len(values) == 1 for values in durations.values())
+
+
+def test_failed_runs_are_left_out_of_the_stats():
+    command = Command(command="false", name="fail")
+    command.duration, command.returncode = 1.0, 1
+    history.record("test", [command], 1.0, 1)
+    assert history.load() == {}
+
+
+def test_history_keeps_a_bounded_number_of_runs(monkeypatch):
+    monkeypatch.setattr(history, "RETENTION", 10)
+    monkeypatch.setattr(history, "PRUNE_EVERY", 5)
+    _record("test", [float(i) for i in range(40)])
+    _record("other", [1.0])
+    durations = history.load()
+    assert durations[("test", "step")] == [float(i) for i in range(30, 40)]
+    assert durations[("other", "step")] == [1.0]
+
+
+def test_recording_is_cheap():
+    _record("test", [1.0])
+    start = time.perf_counter()
+    _record("test", [1.0] * 20)
+    assert (time.perf_counter() - start) / 20 < 0.02
+
+
+def test_percentile_interpolates():
+    assert history.percentile([4, 1, 3, 2], 0.5) == 2.5
+    assert history.percentile([1, 2, 3, 4, 5], 0.95) == pytest.approx(4.8)
+    assert history.percentile([7], 0.95) == 7
+
+
+def test_regression_compares_recent_runs_to_the_baseline():
+    assert history.regression([10.0] * 30 + [10.5] * 5) is None
+    assert history.regression([10.0] * 30 + [15.0] * 5) == pytest.approx(0.5)
+    # small absolute changes aren't worth flagging
+    assert history.regression([0.1] * 30 + [0.5] * 5) is None
+    assert history.regression([10.0] * 4 + [15.0] * 5) is None
+
+
+def test_stats_flags_regressions(capsys):
+    _record("build", [10.0] * 30 + [20.0] * 5, step="docker compose build")
+    _record("pytest", [5.0] * 10, step="pytest")
+    main.stats(command=None)
+    output = capsys.readouterr().out.splitlines()
+    build = next(line for line in output if "build docker compose build" in line)
+    assert "100% slower" in build
+    pytest_line = next(line for line in output if "pytest pytest" in line)
+    assert "slower" not in pytest_line
+    assert "5.0s" in pytest_line
+
+
+def test_stats_without_history(capsys):
+    main.stats(command=None)
+    assert capsys.readouterr().out == "No timings recorded yet\n"
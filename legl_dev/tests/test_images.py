@@ -0,0 +1,121 @@
+import os
+from unittest import mock
+
+from legl_dev import images
+
+PLAIN_PROGRESS = """#1 [internal] load build definition from Dockerfile
+#1 DONE 0.0s
+#4 [1/4] FROM docker.io/library/python:3.10@sha256:abc
+#4 CACHED
+#5 [2/4] COPY requirements.txt .
+#5 CACHED
+#6 [3/4] RUN pip install -r requirements.txt
+#6 0.512 Collecting django
+#6 DONE 30.1s
+#7 [4/4] COPY . .
+#7 DONE 0.2s
+"""
+
+
+def test_hit_rate_counts_cached_build_steps(tmp_path):
+    log = tmp_path / "build.log"
+    log.write_text(PLAIN_PROGRESS)
+    assert images.hit_rate(log) == (2, 4)
+
+
+def test_hit_rate_without_a_log():
+    assert images.hit_rate(None) == (0, 0)
+
+
+@mock.patch(
+    "legl_dev.images.capture_output",
+    return_value='{"name": "app", "services": {"server": {"build": {"context": "/app"}}, '
+    '"worker": {"build": {"context": "/app", "dockerfile": "Dockerfile.worker"}, '
+    '"image": "worker:dev"}, "database": {"image": "postgres:14"}}}',
+)
+def test_services_only_lists_built_ones(capture_output):
+    assert images.services("docker compose") == {
+        "server": {
+            "image": "app-server",
+            "context": "/app",
+            "dockerfile": "/app/Dockerfile",
+        },
+        "worker": {
+            "image": "worker:dev",
+            "context": "/app",
+            "dockerfile": "/app/Dockerfile.worker",
+        },
+    }
+    capture_output.assert_called_once_with(
+        ["docker", "compose", "config", "--format", "json"]
+    )
+
+
+@mock.patch("legl_dev.images.capture_output", return_value=None)
+def test_build_steps_fall_back_to_compose(capture_output):
+    steps = images.build_steps("docker compose", "a" * 64, no_cache=True)
+    assert [step.command.split() for step in steps] == [
+        ["docker", "compose", "build", "--no-cache"]
+    ]
+
+
+def _cache(service, digest, size, mtime):
+    path = images.cache_dir() / service / digest
+    path.mkdir(parents=True)
+    (path / "blob").write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_the_new_cache_replaces_the_old_one():
+    cache = _cache("server", "abc", 10, 1000)
+    new = _cache("server", "abc.new", 20, 1000)
+    images._swap(new, cache)
+    assert (cache / "blob").read_bytes() == b"x" * 20
+    assert not new.exists()
+    assert not cache.with_name("abc.old").exists()
+
+
+def test_a_service_reuses_its_latest_cache_when_inputs_change():
+    _cache("server", "old", 10, 1000)
+    latest = _cache("server", "latest", 10, 2000)
+    _cache("worker", "newest", 10, 3000)
+    step = images.BakeService("server", "app-server", "f" * 64)
+    assert f"server.cache-from=type=local,src={latest}" in step.command
+
+
+def test_prune_evicts_the_least_recently_built_caches():
+    oldest = _cache("server", "oldest", 100, 1000)
+    kept = _cache("server", "kept", 100, 1500)
+    _cache("worker", "newer", 100, 2000)
+    _cache("server", "newest", 100, 3000)
+    assert images.prune(max_size=200, keep=[kept]) == ["server/oldest", "worker/newer"]
+    assert not oldest.exists()
+    assert kept.exists()
+
+
+def test_image_tag_follows_the_dockerfile_and_lockfiles(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "backend").mkdir()
+    (tmp_path / "backend" / "Dockerfile").write_text("FROM python:3.10\n")
+    (tmp_path / "backend" / "requirements.txt").write_text("django==4.1\n")
+    (tmp_path / "yarn.lock").write_text("# yarn\n")
+    tag = images.image_tag("backend/Dockerfile", "backend")
+    assert len(tag) == 16
+
+    # lockfiles outside the build context and other files don't count
+    (tmp_path / "yarn.lock").write_text("# yarn v2\n")
+    (tmp_path / "backend" / "views.py").write_text("# views\n")
+    assert images.image_tag("backend/Dockerfile", "backend") == tag
+
+    (tmp_path / "backend" / "requirements.txt").write_text("django==4.2\n")
+    assert images.image_tag("backend/Dockerfile", "backend") != tag
+
+    # the same inputs in another checkout give the same tag
+    tag = images.image_tag(str(tmp_path / "backend" / "Dockerfile"), "backend")
+    other = tmp_path / "other"
+    (other / "backend").mkdir(parents=True)
+    (other / "backend" / "Dockerfile").write_text("FROM python:3.10\n")
+    (other / "backend" / "requirements.txt").write_text("django==4.2\n")
+    monkeypatch.chdir(other)
+    assert images.image_tag("backend/Dockerfile", str(other / "backend")) == tag
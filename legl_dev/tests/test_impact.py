@@ -0,0 +1,162 @@
+import sqlite3
+import time
+from unittest import mock
+
+import pytest
+from legl_dev import impact
+from legl_dev.cache import write_json
+
+
+def _write_coverage(path, contexts):
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE file (id INTEGER PRIMARY KEY, path TEXT);
+        CREATE TABLE context (id INTEGER PRIMARY KEY, context TEXT);
+        CREATE TABLE line_bits (file_id INTEGER, context_id INTEGER, numbits BLOB);
+        """)
+    files = {}
+    for context_id, (context, paths) in enumerate(contexts.items(), start=1):
+        connection.execute("INSERT INTO context VALUES (?, ?)", (context_id, context))
+        for path in paths:
+            file_id = files.setdefault(path, len(files) + 1)
+            connection.execute(
+                "INSERT OR IGNORE INTO file VALUES (?, ?)", (file_id, path)
+            )
+            connection.execute(
+                "INSERT INTO line_bits VALUES (?, ?, ?)", (file_id, context_id, b"")
+            )
+    connection.commit()
+    connection.close()
+
+
+@pytest.fixture
+def fresh_map():
+    with mock.patch("legl_dev.impact._is_stale", return_value=False):
+        yield
+
+
+def test_read_coverage_maps_tests_to_files(tmp_path):
+    _write_coverage(
+        tmp_path / "coverage",
+        {
+            "": ["/code/app/models.py"],
+            "app/tests/test_models.py::test_save|run": [
+                "/code/app/models.py",
+                "/code/app/utils.py",
+            ],
+            "app/tests/test_models.py::test_save|setup": ["/code/app/fixtures.py"],
+        },
+    )
+    assert impact.read_coverage(tmp_path / "coverage") == {
+        "app/tests/test_models.py::test_save": {
+            "app/models.py",
+            "app/utils.py",
+            "app/fixtures.py",
+        }
+    }
+
+
+def test_record_merges_partial_runs(tmp_path):
+    coverage = tmp_path / "coverage"
+    _write_coverage(coverage, {"tests/test_a.py::test_a|run": ["/code/a.py"]})
+    impact.record(full=True, path=coverage)
+    assert not coverage.exists()
+    _write_coverage(coverage, {"tests/test_b.py::test_b|run": ["/code/b.py"]})
+    impact.record(full=False, path=coverage)
+    with mock.patch("legl_dev.impact._is_stale", return_value=False):
+        assert impact.select({"a.py", "b.py"})[0] == [
+            "tests/test_a.py::test_a",
+            "tests/test_b.py::test_b",
+        ]
+
+
+def test_select_without_a_map_runs_everything():
+    assert impact.select({"app/models.py"})[0] is None
+
+
+def test_select_with_a_stale_map_runs_everything():
+    write_json(
+        impact._map_file(),
+        {"commit": "abc", "updated_at": 0, "tests": {"t.py::t": ["a.py"]}},
+    )
+    tests, reason = impact.select({"a.py"})
+    assert tests is None
+    assert "stale" in reason
+
+
+def test_select_picks_tests_covering_changed_files(fresh_map):
+    write_json(
+        impact._map_file(),
+        {
+            "commit": "abc",
+            "updated_at": time.time(),
+            "tests": {
+                "app/tests/test_models.py::test_save[one]": ["app/models.py"],
+                "app/tests/test_models.py::test_save[two]": ["app/models.py"],
+                "app/tests/test_views.py::test_get": ["app/views.py"],
+            },
+        },
+    )
+    assert impact.select({"app/models.py"})[0] == [
+        "app/tests/test_models.py::test_save"
+    ]
+    assert impact.select({"README.md"})[0] == []
+
+
+def test_select_runs_everything_for_files_outside_the_map(fresh_map):
+    write_json(
+        impact._map_file(),
+        {
+            "commit": "abc",
+            "updated_at": time.time(),
+            "tests": {
+                "t.py::t": ["a.py"],
+                "t.py::rendered": ["a.py", "app/templates/covered.html"],
+            },
+        },
+    )
+    for path in ("app/templates/page.html", "app/fixtures/data.json"):
+        tests, reason = impact.select({path})
+        assert tests is None
+        assert path in reason
+    # non-Python files the coverage map knows about still select their tests
+    assert impact.select({"app/templates/covered.html"})[0] == ["t.py::rendered"]
+    assert impact.select({"docs/setup.md", "notes.txt"})[0] == []
+
+
+def test_select_runs_everything_when_config_changes(fresh_map):
+    write_json(
+        impact._map_file(),
+        {"commit": "abc", "updated_at": time.time(), "tests": {"t.py::t": ["a.py"]}},
+    )
+    tests, reason = impact.select({"a.py", "app/migrations/0002_add_field.py"})
+    assert tests is None
+    assert "migrations" in reason
+
+
+@mock.patch("legl_dev.main.durations.record", return_value=({}, {}))
+@mock.patch("legl_dev.main.impact.record")
+@mock.patch("legl_dev.main.impact.select", return_value=(None, "no impact map yet"))
+@mock.patch("legl_dev.main.impact.changed_files", return_value={"app/models.py"})
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_last_failed_runs_dont_replace_the_map(run, changed, select, record, _):
+    from legl_dev import main
+
+    main.pytest(
+        full_diff=False,
+        create_db=False,
+        last_failed=True,
+        warnings=False,
+        snapshot_update=False,
+        show_capture=False,
+        parallel=False,
+        all_logs=False,
+        warm_runner=False,
+        changed=True,
+        since=None,
+        shard=None,
+        watch=False,
+        template_db=False,
+        path="",
+    )
+    record.assert_called_once_with(full=False)
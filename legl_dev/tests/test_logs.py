@@ -0,0 +1,120 @@
+import sys
+from unittest import mock
+
+import pytest
+import typer
+from legl_dev import logs, main
+
+
+def _python(code):
+    return [sys.executable, "-c", code]
+
+
+def test_log_args():
+    assert logs.log_args("docker compose", "server", 50, since="10m") == [
+        "docker",
+        "compose",
+        "logs",
+        "--no-log-prefix",
+        "--tail",
+        "50",
+        "--since",
+        "10m",
+        "--follow",
+        "server",
+    ]
+    assert logs.log_args("docker compose", "server", -1, follow=False)[-3:] == [
+        "--tail",
+        "all",
+        "server",
+    ]
+
+
+def test_each_service_is_prefixed(capsys):
+    multiplexer = logs.Multiplexer(
+        {
+            "server": _python("print('started'); print('listening')"),
+            "database": _python("print('ready')"),
+        }
+    )
+    assert multiplexer.run() == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(lines) == [
+        "database | ready",
+        "server   | listening",
+        "server   | started",
+    ]
+    # each service's lines keep their order
+    assert lines.index("server   | started") < lines.index("server   | listening")
+
+
+def test_grep_filters_lines(capsys):
+    multiplexer = logs.Multiplexer(
+        {"server": _python("print('GET /'); print('ERROR boom'); print('GET /x')")},
+        grep="ERROR|/x",
+    )
+    multiplexer.run()
+    assert capsys.readouterr().out.splitlines() == [
+        "server | ERROR boom",
+        "server | GET /x",
+    ]
+
+
+def test_a_chatty_service_is_bounded_by_the_queue(capsys, monkeypatch):
+    monkeypatch.setattr(logs, "QUEUE_SIZE", 10)
+    multiplexer = logs.Multiplexer(
+        {
+            "server": _python("for i in range(20000): print(i)"),
+            "worker": _python("print('x' * 100000)"),
+        }
+    )
+    assert multiplexer.lines.maxsize == 10
+    assert multiplexer.run() == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert sum(line.startswith("server") for line in lines) == 20000
+    # a long line is split rather than read whole
+    assert "".join(line[len("worker | ") :] for line in lines if "worker" in line) == (
+        "x" * 100000
+    )
+
+
+def test_a_failing_stream_sets_the_exit_code(capsys):
+    multiplexer = logs.Multiplexer(
+        {
+            "server": _python("print('ok')"),
+            "missing": _python("import sys; print('no such service'); sys.exit(3)"),
+        }
+    )
+    assert multiplexer.run() == 3
+    assert "missing | no such service" in capsys.readouterr().out
+
+
+@mock.patch("legl_dev.logs.Multiplexer.run", autospec=True, return_value=0)
+@mock.patch("legl_dev.main.capture_output", return_value="database\nserver\n")
+def test_logs_streams_every_service(capture_output, run):
+    main.show_logs(services=None, tail=100, since=None, grep=None, follow=True)
+    capture_output.assert_called_once_with(
+        ["docker", "compose", "config", "--services"]
+    )
+    multiplexer = run.call_args[0][0]
+    assert sorted(multiplexer.streams) == ["database", "server"]
+    assert multiplexer.streams["server"] == logs.log_args(
+        "docker compose", "server", 100
+    )
+
+
+@mock.patch("legl_dev.logs.Multiplexer.run", autospec=True, return_value=0)
+@mock.patch("legl_dev.main.capture_output")
+def test_logs_for_chosen_services(capture_output, run):
+    main.show_logs(services=["server"], tail=10, since="1h", grep="ERROR", follow=True)
+    capture_output.assert_not_called()
+    multiplexer = run.call_args[0][0]
+    assert multiplexer.streams == {
+        "server": logs.log_args("docker compose", "server", 10, since="1h")
+    }
+    assert multiplexer.pattern.pattern == "ERROR"
+
+
+def test_logs_rejects_a_bad_pattern():
+    with pytest.raises(typer.BadParameter):
+        main.show_logs(services=["server"], tail=10, since=None, grep="(", follow=True)
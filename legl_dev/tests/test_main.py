@@ -1,40 +1,40 @@
 from unittest import mock
 
-from legl_dev import main
+import pytest
+from legl_dev import images, main, ready, snapshot
+from legl_dev.command import Steps
 
 
-@mock.patch("legl_dev.command.subprocess.run")
-def test_standard_start_not_verbose(run):
+@mock.patch("legl_dev.ready.check", return_value=ready.READY)
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_standard_start_not_verbose(run, check):
     main.start(verbose=False)
-    calls = [
-        mock.call(
-            ["docker", "compose", "up", "-d"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
-        ),
-    ]
-    run.assert_has_calls(calls)
+    # the waits run in parallel when there are several CPUs
+    assert [c[0][1] for c in run.call_args_list] == [["docker", "compose", "up", "-d"]]
+    assert run.call_args[0][0].capture
+    assert sorted(c[0][1] for c in check.call_args_list) == ["database", "server"]
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_standard_start(run):
     main.start()
     calls = [
-        mock.call(
-            ["docker", "compose", "up"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
-        ),
+        mock.call(mock.ANY, ["docker", "compose", "up"], False),
     ]
     run.assert_has_calls(calls)
+    # attached compose output is interactive, Ctrl+C stops the services
+    assert not run.call_args[0][0].capture
 
 
-@mock.patch("legl_dev.command.subprocess.run")
-def test_install_pip(run):
+SHOW_EXAMPLE = "Name: example\nVersion: 1.2.0\nSummary: An example\n"
+
+
+@mock.patch("legl_dev.main.capture_output", return_value=SHOW_EXAMPLE)
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_install_pip(run, capture_output, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
     main.install(
-        package="example",
+        packages=["example"],
         pip=True,
         yarn=False,
         self=False,
@@ -43,25 +43,25 @@ def test_install_pip(run):
     )
     calls = [
         mock.call(
+            mock.ANY,
             ["docker", "compose", "exec", "server", "pip", "install", "example"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
-        ),
-        mock.call(
-            "docker compose exec server pip freeze | grep example >> requirements.txt",
-            universal_newlines=True,
-            shell=True,
-            check=True,
+            False,
         ),
     ]
     run.assert_has_calls(calls)
+    capture_output.assert_called_once_with(
+        ["docker", "compose", "exec", "server", "pip", "show", "example"]
+    )
+    assert (tmp_path / "requirements.txt").read_text() == "example==1.2.0\n"
 
 
-@mock.patch("legl_dev.command.subprocess.run")
-def test_install_pip_upgrade(run):
+@mock.patch("legl_dev.main.capture_output", return_value=SHOW_EXAMPLE)
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_install_pip_upgrade(run, capture_output, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "requirements.txt").write_text("example==1.0.0\n")
     main.install(
-        package="example",
+        packages=["example"],
         pip=True,
         yarn=False,
         self=False,
@@ -70,6 +70,7 @@ def test_install_pip_upgrade(run):
     )
     calls = [
         mock.call(
+            mock.ANY,
             [
                 "docker",
                 "compose",
@@ -80,24 +81,51 @@ def test_install_pip_upgrade(run):
                 "--upgrade",
                 "example",
             ],
-            universal_newlines=True,
-            shell=False,
-            check=True,
-        ),
-        mock.call(
-            "docker compose exec server pip freeze | grep example >> requirements.txt",
-            universal_newlines=True,
-            shell=True,
-            check=True,
+            False,
         ),
     ]
     run.assert_has_calls(calls)
+    assert (tmp_path / "requirements.txt").read_text() == "example==1.2.0\n"
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.main.capture_output")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_install_many_packages_at_once(run, capture_output, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "requirements.txt").write_text(
+        "# pinned by hand\nrequests==2.0.0\ndjango==4.2\ndjango-filter==23.1\n"
+    )
+    capture_output.return_value = (
+        "Name: Django\nVersion: 4.2.7\n---\nName: celery\nVersion: 5.3.4\n"
+    )
+    main.install(
+        packages=["Django>=4.2", "celery[redis]"],
+        pip=True,
+        yarn=False,
+        self=False,
+        version="main",
+        upgrade=False,
+    )
+    assert _commands(run) == [
+        "docker compose exec server pip install Django>=4.2 celery[redis]"
+    ]
+    capture_output.assert_called_once_with(
+        ["docker", "compose", "exec", "server", "pip", "show", "Django", "celery"]
+    )
+    assert (tmp_path / "requirements.txt").read_text() == (
+        "# pinned by hand\n"
+        "\n"
+        "celery[redis]==5.3.4\n"
+        "Django==4.2.7\n"
+        "django-filter==23.1\n"
+        "requests==2.0.0\n"
+    )
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_install_yarn(run):
     main.install(
-        package="example",
+        packages=["example"],
         pip=False,
         yarn=True,
         self=False,
@@ -106,19 +134,18 @@ def test_install_yarn(run):
     )
     calls = [
         mock.call(
+            mock.ANY,
             ["docker", "compose", "exec", "server", "yarn", "add", "example"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
+            False,
         ),
     ]
     run.assert_has_calls(calls)
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_install_yarn_upgrade(run):
     main.install(
-        package="example",
+        packages=["example"],
         pip=False,
         yarn=True,
         self=False,
@@ -127,19 +154,18 @@ def test_install_yarn_upgrade(run):
     )
     calls = [
         mock.call(
+            mock.ANY,
             ["docker", "compose", "exec", "server", "yarn", "up", "example"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
+            False,
         ),
     ]
     run.assert_has_calls(calls)
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_install_self(run):
     main.install(
-        package="example",
+        packages=["example"],
         pip=False,
         yarn=False,
         self=True,
@@ -147,26 +173,20 @@ def test_install_self(run):
         upgrade=False,
     )
     calls = [
+        mock.call(mock.ANY, ["pip", "uninstall", "legl-dev", "-y"], False),
         mock.call(
-            ["pip", "uninstall", "legl-dev", "-y"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
-        ),
-        mock.call(
+            mock.ANY,
             ["pip", "install", "git+https://github.com/CrowdJustice/legl-dev.git@main"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
+            False,
         ),
     ]
     run.assert_has_calls(calls)
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_install_self_upgrade(run):
     main.install(
-        package="example",
+        packages=["example"],
         pip=False,
         yarn=False,
         self=True,
@@ -174,25 +194,319 @@ def test_install_self_upgrade(run):
         upgrade=True,
     )
     calls = [
-        mock.call(
-            ["pip", "install", "--upgrade", "legl-dev"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
-        ),
+        mock.call(mock.ANY, ["pip", "install", "--upgrade", "legl-dev"], False),
     ]
     run.assert_has_calls(calls)
 
 
-@mock.patch("legl_dev.command.subprocess.run")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
 def test_remote_server_commands(run):
     main.shell()
     calls = [
-        mock.call(
-            ["docker", "compose", "exec", "server", "bash"],
-            universal_newlines=True,
-            shell=False,
-            check=True,
-        ),
+        mock.call(mock.ANY, ["docker", "compose", "exec", "server", "bash"], False),
     ]
     run.assert_has_calls(calls)
+    assert not run.call_args[0][0].capture
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # the stages run in a fixed order regardless of how many CPUs there are
+    monkeypatch.setattr(Steps, "max_workers", 1)
+    monkeypatch.setattr(ready, "check", mock.Mock(return_value=ready.READY))
+    # without a compose config the images are built by compose itself
+    monkeypatch.setattr(images, "services", mock.Mock(return_value=None))
+    (tmp_path / "Dockerfile").write_text("FROM python:3.10\n")
+    (tmp_path / "app" / "migrations").mkdir(parents=True)
+    (tmp_path / "app" / "migrations" / "0001_initial.py").write_text("# initial\n")
+    (tmp_path / "app" / "factories.py").write_text("# factories\n")
+    return tmp_path
+
+
+def _build(**kwargs):
+    options = dict(
+        cache=True,
+        resume=False,
+        force=False,
+        use_snapshot=False,
+        batch=False,
+        registry=None,
+        push=False,
+    )
+    main.build(**{**options, **kwargs})
+
+
+def _commands(run):
+    return [c[0][1] if c[0][0].shell else " ".join(c[0][1]) for c in run.call_args_list]
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_build_runs_every_stage_the_first_time(run, project):
+    _build()
+    assert _commands(run) == [
+        "docker compose build",
+        "docker compose up -d",
+        "docker compose exec server python manage.py migrate",
+        "docker compose stop database",
+        "docker compose rm -f database",
+        "docker compose up database -d",
+        "docker compose exec server python manage.py migrate",
+        "docker compose exec server python manage.py run_factories",
+        "docker compose exec server python manage.py seed_emails",
+        "docker compose stop",
+    ]
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_build_skips_unchanged_stages(run, project, capsys):
+    _build()
+    run.reset_mock()
+    _build()
+    assert run.call_count == 0
+    assert (
+        "Skipping image: Dockerfiles and lockfiles unchanged" in capsys.readouterr().out
+    )
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_build_only_reruns_factories_when_factories_change(run, project):
+    _build()
+    run.reset_mock()
+    (project / "app" / "factories.py").write_text("# more factories\n")
+    _build()
+    assert _commands(run) == [
+        "docker compose up -d",
+        "docker compose exec server python manage.py run_factories",
+        "docker compose exec server python manage.py seed_emails",
+        "docker compose stop",
+    ]
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_build_force_runs_every_stage(run, project):
+    _build()
+    run.reset_mock()
+    _build(force=True)
+    assert run.call_count == 10
+
+
+def _fake_dump(command, args, prefix):
+    if command.shell and "pg_dump" in args:
+        snapshot.snapshot_dir().mkdir(parents=True, exist_ok=True)
+        snapshot.path(snapshot.current_key()).write_bytes(b"dump")
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True, side_effect=_fake_dump)
+def test_build_snapshots_the_database_after_factories(run, project):
+    _build(use_snapshot=True)
+    assert "pg_dump" in _commands(run)[-2]
+    assert snapshot.exists(snapshot.current_key())
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True, side_effect=_fake_dump)
+def test_build_restores_a_matching_snapshot(run, project):
+    _build(use_snapshot=True)
+    (project / "app" / "factories.py").write_text("# more factories\n")
+    _build(use_snapshot=True)
+    (project / "app" / "factories.py").write_text("# factories\n")
+    run.reset_mock()
+    _build(use_snapshot=True)
+    commands = _commands(run)
+    assert len(commands) == 3
+    assert "pg_restore" in commands[1]
+    assert str(snapshot.path(snapshot.current_key())) in commands[1]
+
+
+@mock.patch("legl_dev.batch.ManagementCommands.run", return_value=True)
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_build_batches_management_commands(run, batch_run, project):
+    _build(batch=True)
+    assert _commands(run) == [
+        "docker compose build",
+        "docker compose up -d",
+        "docker compose exec server python manage.py migrate",
+        "docker compose stop database",
+        "docker compose rm -f database",
+        "docker compose up database -d",
+        "docker compose stop",
+    ]
+    batch_run.assert_called_once()
+
+
+BAKE_OUTPUT = """#1 [internal] load build definition from Dockerfile
+#5 [server 1/3] FROM docker.io/library/python:3.10
+#5 CACHED
+#6 [server 2/3] COPY requirements.txt .
+#6 CACHED
+#7 [server 3/3] RUN pip install -r requirements.txt
+#7 DONE 42.0s
+"""
+
+
+def _fake_bake(command, args, prefix):
+    if isinstance(command, images.BakeService):
+        command.log_file = command.new_cache.parent / "build.log"
+        command.new_cache.mkdir(parents=True)
+        command.log_file.write_text(BAKE_OUTPUT)
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True, side_effect=_fake_bake)
+def test_build_bakes_each_service_with_a_local_cache(run, project, capsys):
+    images.services.return_value = {
+        "server": {"image": "app-server"},
+        "worker": {"image": "app-worker"},
+    }
+    _build()
+    commands = _commands(run)
+    assert "docker buildx create --name legl-dev" in commands[0]
+    assert commands[1].startswith("docker buildx bake --builder=legl-dev")
+    assert "server.tags=app-server" in commands[1]
+    assert "server.cache-to=type=local" in commands[1]
+    assert commands[1].endswith(" server")
+    assert commands[2].endswith(" worker")
+    assert commands[3] == "docker compose up -d"
+    assert sorted(path.parent.name for path in images._entries()) == [
+        "server",
+        "worker",
+    ]
+    output = capsys.readouterr().out
+    assert "server:  67%  2/3 steps cached" in output
+    assert "worker:  67%  2/3 steps cached" in output
+
+    # the next build reads the cache the last one wrote
+    run.reset_mock()
+    _build(force=True)
+    assert "server.cache-from=type=local,src=" in _commands(run)[1]
+
+
+class FakeRegistry:
+    # stands in for a local registry:2 and the docker CLI talking to it
+    def __init__(self):
+        self.images = set()
+
+    def __call__(self, args):
+        if args[:2] == ["docker", "pull"]:
+            return "" if args[2] in self.images else None
+        if args[:2] == ["docker", "push"]:
+            self.images.add(args[2])
+        return ""
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True, side_effect=_fake_bake)
+def test_build_reuses_images_from_a_registry(
+    run, project, cache_dir, monkeypatch, capsys
+):
+    registry = FakeRegistry()
+    monkeypatch.setattr(images, "capture_output", registry)
+    (project / "requirements.txt").write_text("django==4.2\n")
+    images.services.return_value = {
+        "server": {
+            "image": "app-server",
+            "context": str(project),
+            "dockerfile": str(project / "Dockerfile"),
+        }
+    }
+    remote = "localhost:5000/legl/server:" + images.image_tag(
+        str(project / "Dockerfile"), str(project)
+    )
+
+    _build(registry="localhost:5000/legl", push=True)
+    assert "docker buildx bake" in _commands(run)[1]
+    assert registry.images == {remote}
+
+    # a fresh checkout on another machine pulls instead of building
+    monkeypatch.setenv("LEGL_DEV_CACHE_DIR", str(cache_dir / "elsewhere"))
+    run.reset_mock()
+    capsys.readouterr()
+    _build(registry="localhost:5000/legl")
+    assert not any("bake" in command for command in _commands(run))
+    assert f"server: pulled {remote}" in capsys.readouterr().out
+
+    # new lockfiles are a miss, and aren't pushed without --push
+    (project / "requirements.txt").write_text("django==5.0\n")
+    run.reset_mock()
+    _build(registry="localhost:5000/legl")
+    assert "docker buildx bake" in _commands(run)[1]
+    assert registry.images == {remote}
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_makemigrations_keeps_its_stdin(run):
+    main.migrate(merge=False, make=True, run=True, force=False, database="default")
+    assert _commands(run) == [
+        "docker compose exec server python manage.py makemigrations",
+        "docker compose exec server python manage.py migrate",
+    ]
+    assert [c[0][0].capture for c in run.call_args_list] == [False, True]
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_build_waits_for_the_database_before_migrating(run, project, monkeypatch):
+    events = []
+    monkeypatch.setattr(
+        ready, "check", lambda docker_cmd, service: events.append(service) or "ready"
+    )
+    run.side_effect = lambda command, args, prefix: events.append(command.name)
+    _build()
+    assert events[1:8] == [
+        "start services",
+        "database",
+        "server",
+        "migrate",
+        "stop database",
+        "remove database",
+        "start database",
+    ]
+    assert events[8:10] == ["database", "migrate fresh database"]
+
+
+def _migrate(**kwargs):
+    options = dict(merge=False, make=False, run=True, force=False, database="default")
+    main.migrate(**{**options, **kwargs})
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_migrate_skips_when_no_migrations_changed(run, project, capsys):
+    _migrate()
+    assert run.call_count == 1
+    run.reset_mock()
+    _migrate()
+    run.assert_not_called()
+    assert "Skipping migrate: migrations unchanged" in capsys.readouterr().out
+
+    _migrate(force=True)
+    assert _commands(run) == ["docker compose exec server python manage.py migrate"]
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_migrate_reports_new_migrations_per_app(run, project, capsys):
+    _migrate()
+    (project / "app" / "migrations" / "0002_add_field.py").write_text("# add\n")
+    (project / "billing" / "migrations").mkdir(parents=True)
+    (project / "billing" / "migrations" / "__init__.py").write_text("")
+    (project / "billing" / "migrations" / "0001_initial.py").write_text("# initial\n")
+    capsys.readouterr()
+    _migrate()
+    output = capsys.readouterr().out
+    assert "New migrations in app: 0002_add_field" in output
+    assert "New migrations in billing: 0001_initial" in output
+    assert run.call_count == 2
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_migrate_tracks_each_database(run, project):
+    _migrate()
+    run.reset_mock()
+    _migrate(database="reporting")
+    assert _commands(run) == [
+        "docker compose exec server python manage.py migrate --database reporting"
+    ]
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_a_rebuilt_database_counts_as_migrated(run, project):
+    _build()
+    run.reset_mock()
+    _migrate()
+    run.assert_not_called()
@@ -0,0 +1,72 @@
+import json
+from unittest import mock
+
+import pytest
+from legl_dev import ready
+
+
+def _ps(**container):
+    return json.dumps({"Service": "database", **container}) + "\n"
+
+
+@pytest.mark.parametrize(
+    "ps, probe, expected",
+    [
+        ("", None, ready.STARTING),
+        (_ps(State="created", Health=""), None, ready.STARTING),
+        (_ps(State="exited", Health=""), None, ready.EXITED),
+        (_ps(State="running", Health="starting"), None, ready.STARTING),
+        (_ps(State="running", Health="healthy"), None, ready.READY),
+        # without a healthcheck the database has to accept connections
+        (_ps(State="running", Health=""), None, ready.STARTING),
+        (_ps(State="running", Health=""), "", ready.READY),
+        # older compose releases print a list
+        ("[" + _ps(State="running", Health="healthy") + "]", None, ready.READY),
+    ],
+)
+def test_check(ps, probe, expected):
+    with mock.patch("legl_dev.ready.capture_output", side_effect=[ps, probe]):
+        assert ready.check("docker compose", "database") == expected
+
+
+def test_services_without_a_probe_are_ready_once_running():
+    ps = _ps(Service="server", State="running", Health="")
+    with mock.patch("legl_dev.ready.capture_output", return_value=ps) as output:
+        assert ready.check("docker compose", "server") == ready.READY
+    output.assert_called_once()
+
+
+@mock.patch("legl_dev.ready.time.sleep")
+@mock.patch("legl_dev.ready.check")
+def test_waiting_backs_off_until_the_service_is_ready(check, sleep, capsys):
+    check.side_effect = [ready.STARTING] * 8 + [ready.READY]
+    step = ready.WaitFor("docker compose", "database")
+    assert step.run()
+    assert step.returncode == 0
+    delays = [c[0][0] for c in sleep.call_args_list]
+    assert delays[:3] == [0.05, 0.1, 0.2]
+    assert max(delays) == ready.MAX_DELAY
+    assert "database ready after" in capsys.readouterr().out
+
+
+@mock.patch("legl_dev.ready.check", return_value=ready.STARTING)
+def test_waiting_gives_up_at_the_deadline(check, monkeypatch, capsys):
+    monkeypatch.setenv("LEGL_DEV_READY_TIMEOUT", "0.3")
+    step = ready.WaitFor("docker compose", "database")
+    assert not step.run()
+    assert step.returncode == 1
+    assert "database still not ready after" in capsys.readouterr().out
+
+
+@mock.patch("legl_dev.ready.time.sleep")
+@mock.patch("legl_dev.ready.check", return_value=ready.EXITED)
+def test_waiting_stops_when_the_service_exits(check, sleep, capsys):
+    assert not ready.WaitFor("docker compose", "database").run()
+    sleep.assert_not_called()
+    assert "database exited while starting" in capsys.readouterr().out
+
+
+def test_services_are_waited_on_independently():
+    waits = ready.wait_for("docker compose", ["database", "server"], after="up")
+    assert [wait.name for wait in waits] == ["wait for database", "wait for server"]
+    assert all(wait.depends_on == ["up"] for wait in waits)
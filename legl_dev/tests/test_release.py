@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import pytest
+from legl_dev import release
+from legl_dev.cache import read_json, write_json
+from legl_dev.main import app
+from typer.testing import CliRunner
+
+
+@pytest.fixture
+def release_server(monkeypatch):
+    class Handler(BaseHTTPRequestHandler):
+        delay = 0
+        hits = []
+
+        def do_GET(self):
+            Handler.hits.append(self.path)
+            time.sleep(Handler.delay)
+            body = json.dumps([{"tag_name": "9.9.9"}]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv(
+        "LEGL_DEV_RELEASES_URL", f"http://127.0.0.1:{server.server_port}/releases"
+    )
+    yield Handler
+    server.shutdown()
+
+
+def test_refresh_writes_cache(release_server, cache_dir):
+    release.refresh()
+    assert read_json(cache_dir / "release.json")["latest"] == "9.9.9"
+    assert release_server.hits == ["/releases"]
+
+
+@mock.patch("legl_dev.release.REQUEST_TIMEOUT", 0.2)
+def test_refresh_gives_up_after_timeout(release_server, cache_dir):
+    release_server.delay = 1
+    start = time.monotonic()
+    release.refresh()
+    assert time.monotonic() - start < 1
+    assert read_json(cache_dir / "release.json") is None
+
+
+@mock.patch("legl_dev.release.subprocess.Popen")
+def test_stale_cache_refreshes_in_background(popen, cache_dir):
+    write_json(cache_dir / "release.json", {"checked_at": 0, "latest": "1.0.0"})
+    assert release.latest_version() == "1.0.0"
+    popen.assert_called_once()
+    assert popen.call_args[0][0][1:] == ["-m", "legl_dev.release"]
+    # a second invocation doesn't spawn another refresh
+    release.latest_version()
+    popen.assert_called_once()
+
+
+@mock.patch("legl_dev.release.subprocess.Popen")
+def test_unwritable_cache_skips_the_check(popen, cache_dir, monkeypatch):
+    monkeypatch.setattr(release, "write_json", mock.Mock(side_effect=PermissionError))
+    assert release.latest_version() is None
+    popen.assert_not_called()
+
+
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+@mock.patch("legl_dev.release.subprocess.Popen")
+def test_warm_cache_adds_no_startup_latency(popen, run, release_server, cache_dir):
+    release_server.delay = 2
+    write_json(cache_dir / "release.json", {"checked_at": time.time(), "latest": "0.0.1"})
+    start = time.monotonic()
+    result = CliRunner().invoke(app, ["shell"])
+    elapsed = time.monotonic() - start
+    assert result.exit_code == 0
+    assert elapsed < 0.5
+    assert release_server.hits == []
+    popen.assert_not_called()
+
+
+@mock.patch("legl_dev.main.release.latest_version")
+def test_version_skips_release_check(latest_version):
+    result = CliRunner().invoke(app, ["--version"])
+    assert result.exit_code == 0
+    latest_version.assert_not_called()
@@ -0,0 +1,79 @@
+import pytest
+from legl_dev import requirements
+
+
+@pytest.mark.parametrize(
+    "line, name",
+    [
+        ("django", "django"),
+        ("Django==4.2.7", "Django"),
+        ("celery[redis]>=5", "celery"),
+        ("zope.interface ; python_version < '3.12'", "zope.interface"),
+        ("legl-dev @ git+https://github.com/CrowdJustice/legl-dev.git", "legl-dev"),
+        ("requests  # for the API client", "requests"),
+        ("# a comment", None),
+        ("-r base.txt", None),
+        ("-e ./vendor/thing", None),
+        ("git+https://github.com/CrowdJustice/legl-dev.git", None),
+        ("", None),
+    ],
+)
+def test_package_name(line, name):
+    assert requirements.package_name(line) == name
+
+
+def test_parse_show():
+    output = "Name: Django\nVersion: 4.2.7\nRequires: asgiref\n---\nName: celery\nVersion: 5.3.4\n"
+    assert requirements.parse_show(output) == {"Django": "4.2.7", "celery": "5.3.4"}
+
+
+def test_pin_dedupes_and_sorts(tmp_path):
+    path = tmp_path / "requirements.txt"
+    path.write_text(
+        "--index-url https://pypi.org/simple\n"
+        "\n"
+        "zope.interface==5.0\n"
+        "# the API client\n"
+        "requests==2.0.0\n"
+        "Django==4.1\n"
+        "django==4.2\n"
+        "django_filter==23.1\n"
+    )
+    requirements.pin(str(path), {"Django": "4.2.7", "Zope-Interface": "6.1"})
+    assert path.read_text() == (
+        "--index-url https://pypi.org/simple\n"
+        "\n"
+        "Django==4.2.7\n"
+        "django_filter==23.1\n"
+        "# the API client\n"
+        "requests==2.0.0\n"
+        "Zope-Interface==6.1\n"
+    )
+
+
+def test_pin_creates_the_file(tmp_path):
+    path = tmp_path / "requirements.txt"
+    requirements.pin(str(path), {"requests": "2.31.0"})
+    assert path.read_text() == "requests==2.31.0\n"
+    requirements.pin(str(path), {"requests": "2.31.0"})
+    assert path.read_text() == "requests==2.31.0\n"
+
+
+def test_pin_keeps_extras_markers_and_comments(tmp_path):
+    path = tmp_path / "requirements.txt"
+    path.write_text(
+        "celery[redis]==5.2\n"
+        'Django==4.1 ; python_version >= "3.8"\n'
+        "requests==2.0.0  # for the API client\n"
+    )
+    requirements.pin(
+        str(path),
+        {"celery": "5.3.4", "Django": "4.2.7", "requests": "2.31.0", "uvicorn": "0.23"},
+        requested=["celery[msgpack]", "Django", "uvicorn[standard] ; os_name != 'nt'"],
+    )
+    assert path.read_text() == (
+        "celery[msgpack,redis]==5.3.4\n"
+        'Django==4.2.7 ; python_version >= "3.8"\n'
+        "requests==2.31.0  # for the API client\n"
+        "uvicorn[standard]==0.23 ; os_name != 'nt'\n"
+    )
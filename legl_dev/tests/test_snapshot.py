@@ -0,0 +1,53 @@
+from unittest import mock
+
+from legl_dev import snapshot
+
+
+def _make_snapshot(key, size):
+    snapshot.snapshot_dir().mkdir(parents=True, exist_ok=True)
+    snapshot.path(key).write_bytes(b"x" * size)
+    return snapshot.register(key)
+
+
+def test_register_records_snapshot():
+    _make_snapshot("one", 10)
+    assert snapshot.exists("one")
+    assert [s["key"] for s in snapshot.snapshots()] == ["one"]
+    assert snapshot.snapshots()[0]["size"] == 10
+
+
+@mock.patch("legl_dev.snapshot.limit", return_value=25)
+def test_register_evicts_least_recently_used(limit):
+    with mock.patch("legl_dev.snapshot.time.time", return_value=1):
+        _make_snapshot("one", 10)
+    with mock.patch("legl_dev.snapshot.time.time", return_value=2):
+        _make_snapshot("two", 10)
+    with mock.patch("legl_dev.snapshot.time.time", return_value=3):
+        snapshot.touch("one")
+    with mock.patch("legl_dev.snapshot.time.time", return_value=4):
+        assert _make_snapshot("three", 10) == ["two"]
+    assert not snapshot.path("two").exists()
+    assert [s["key"] for s in snapshot.snapshots()] == ["three", "one"]
+
+
+def test_prune_keeps_the_newest_snapshot():
+    with mock.patch("legl_dev.snapshot.time.time", return_value=1):
+        _make_snapshot("one", 10)
+    with mock.patch("legl_dev.snapshot.time.time", return_value=2):
+        _make_snapshot("two", 10)
+    assert snapshot.prune(0) == ["one"]
+    assert snapshot.exists("two")
+
+
+def test_dump_creates_the_snapshot_directory_when_it_runs():
+    command = snapshot.dump_command("echo", "one")
+    assert not snapshot.snapshot_dir().exists()
+    assert command.run()
+    assert snapshot.path("one").read_bytes().startswith(b"exec -T database")
+    assert not snapshot.path("one").with_suffix(".tmp").exists()
+
+
+def test_failed_dump_leaves_no_partial_file():
+    assert not snapshot.dump_command("false", "one").run()
+    assert not snapshot.path("one").exists()
+    assert not snapshot.path("one").with_suffix(".tmp").exists()
@@ -0,0 +1,47 @@
+import subprocess
+import sys
+
+from legl_dev import release
+
+# Cumulative import time of legl_dev.main relative to typer's, measured in the
+# same run so a slow machine slows both. Typer and click account for most of
+# it; anything heavier should be imported lazily inside the command that
+# needs it.
+STARTUP_BUDGET_RATIO = 2.5
+LAZY_MODULES = {"pkg_resources", "requests"}
+
+
+def _import_times():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import legl_dev.main"],
+        capture_output=True,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_heavy_modules_are_not_imported_at_startup():
+    assert not LAZY_MODULES & set(_import_times())
+
+
+def test_startup_import_budget():
+    # best of three to keep a noisy machine from failing the build
+    ratio = min(
+        times["legl_dev.main"] / times["typer"]
+        for times in (_import_times() for _ in range(3))
+    )
+    assert ratio < STARTUP_BUDGET_RATIO, (
+        f"legl_dev.main took {ratio:.1f}x as long as typer to import"
+    )
+
+
+def test_parse_version():
+    assert release.parse_version("1.10.0") > release.parse_version("1.9.2")
+    assert release.parse_version("v1.3.0") == release.parse_version("1.3.0")
@@ -0,0 +1,168 @@
+import json
+import subprocess
+import sys
+from unittest import mock
+
+import pytest
+import typer
+from legl_dev import main, testdb
+
+# Records the SQL the script runs instead of talking to Postgres
+FAKE_DJANGO = """
+import json, os
+
+state_file = os.environ["FAKE_DJANGO_STATE"]
+with open(state_file) as f:
+    state = json.load(f)
+
+
+class Cursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        with open(state_file, "w") as f:
+            json.dump(state, f)
+
+    def execute(self, sql, params=None):
+        state["sql"].append(sql)
+        if sql.startswith("CREATE DATABASE"):
+            state["databases"].append(sql.split()[2].strip('"'))
+        elif sql.startswith("DROP DATABASE"):
+            name = sql.split()[-1].strip('"')
+            state["databases"] = [d for d in state["databases"] if d != name]
+
+    def fetchall(self):
+        return [(name,) for name in state["databases"]]
+
+
+class Creation:
+    def _get_test_db_name(self):
+        return "test_app"
+
+    def create_test_db(self, **kwargs):
+        state["migrations"] += 1
+        state["databases"].append("test_app")
+
+
+class Ops:
+    def quote_name(self, name):
+        return '"%s"' % name
+
+
+class Connection:
+    creation = Creation()
+    ops = Ops()
+
+    def _nodb_cursor(self):
+        return Cursor()
+
+    def close(self):
+        pass
+
+
+connection = Connection()
+"""
+
+
+@pytest.fixture
+def fake_postgres(tmp_path, monkeypatch):
+    package = tmp_path / "django" / "db"
+    package.mkdir(parents=True)
+    (tmp_path / "django" / "__init__.py").write_text("")
+    (package / "__init__.py").write_text(FAKE_DJANGO)
+    state_file = tmp_path / "state.json"
+    state_file.write_text(json.dumps({"sql": [], "databases": [], "migrations": 0}))
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path))
+    monkeypatch.setenv("FAKE_DJANGO_STATE", str(state_file))
+
+    def run(workers, rebuild=False):
+        script = testdb.SCRIPT.format(
+            template=testdb.template_name(),
+            prefix=testdb.TEMPLATE_PREFIX,
+            rebuild=rebuild,
+            workers=workers,
+        )
+        subprocess.check_call([sys.executable, "-c", script])
+        return json.loads(state_file.read_text())
+
+    return run
+
+
+def test_the_template_is_migrated_once_and_cloned_per_worker(fake_postgres):
+    state = fake_postgres(workers=4)
+    assert state["migrations"] == 1
+    template = testdb.template_name()
+    assert sorted(state["databases"]) == sorted(
+        [template, "test_app"] + [f"test_app_gw{index}" for index in range(4)]
+    )
+    assert f'CREATE DATABASE "test_app_gw3" TEMPLATE "{template}"' in state["sql"]
+
+    # more workers only means more clones
+    state = fake_postgres(workers=8)
+    assert state["migrations"] == 1
+    assert "test_app_gw7" in state["databases"]
+
+
+def test_the_template_is_rebuilt_when_migrations_change(fake_postgres, monkeypatch):
+    old = testdb.template_name()
+    fake_postgres(workers=2)
+    monkeypatch.setattr(testdb, "template_name", lambda: testdb.TEMPLATE_PREFIX + "new")
+    state = fake_postgres(workers=2)
+    assert state["migrations"] == 2
+    assert old not in state["databases"]
+    assert testdb.TEMPLATE_PREFIX + "new" in state["databases"]
+
+    state = fake_postgres(workers=2, rebuild=True)
+    assert state["migrations"] == 3
+
+
+def test_template_names_follow_the_migrations(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "app" / "migrations").mkdir(parents=True)
+    (tmp_path / "app" / "migrations" / "0001_initial.py").write_text("# initial\n")
+    first = testdb.template_name()
+    assert first.startswith(testdb.TEMPLATE_PREFIX)
+    assert len(first) <= 63
+    (tmp_path / "app" / "migrations" / "0002_add_field.py").write_text("# add\n")
+    assert testdb.template_name() != first
+
+
+def _pytest(**kwargs):
+    options = dict(
+        full_diff=False,
+        create_db=False,
+        last_failed=False,
+        warnings=False,
+        snapshot_update=False,
+        show_capture=False,
+        parallel=True,
+        all_logs=False,
+        warm_runner=False,
+        changed=False,
+        since=None,
+        shard=None,
+        watch=False,
+        template_db=True,
+        path="",
+    )
+    main.pytest(**{**options, **kwargs})
+
+
+@mock.patch("legl_dev.main.durations.record", return_value=({}, {}))
+@mock.patch("legl_dev.main.os.cpu_count", return_value=6)
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_pytest_clones_worker_databases_first(run, cpu_count, _):
+    _pytest(create_db=True)
+    clone, pytest_run = [c[0][0] for c in run.call_args_list]
+    assert clone.name == "clone test databases"
+    assert clone.command.startswith("docker compose run --rm backend python manage.py")
+    assert "range(6)" in clone.command and "rebuild = True" in clone.command
+    assert " -n 6 " in pytest_run.command
+    assert "--reuse-db" in pytest_run.command
+    assert "--create-db" not in pytest_run.command
+
+
+def test_template_db_needs_parallel():
+    with pytest.raises(typer.BadParameter):
+        _pytest(parallel=False)
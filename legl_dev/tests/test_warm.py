@@ -0,0 +1,53 @@
+from unittest import mock
+
+from legl_dev import main, warm
+
+
+@mock.patch("legl_dev.warm.status", return_value=(True, "abc"))
+def test_ensure_reuses_a_matching_runner(status):
+    steps, _ = warm.ensure("docker compose", "abc")
+    assert steps == []
+
+
+@mock.patch("legl_dev.warm.status", return_value=(False, None))
+def test_ensure_starts_a_missing_runner(status):
+    steps, _ = warm.ensure("docker compose", "abc")
+    assert [step.name for step in steps] == ["start warm runner"]
+    assert f"--label {warm.LABEL}=abc" in steps[0].command
+
+
+@mock.patch("legl_dev.warm.status", return_value=(True, "old"))
+def test_ensure_restarts_a_stale_runner(status):
+    steps, reason = warm.ensure("docker compose", "new")
+    assert [step.name for step in steps] == ["stop warm runner", "start warm runner"]
+    assert "dependencies changed" in reason
+
+
+@mock.patch("legl_dev.warm.status", return_value=(True, "abc"))
+@mock.patch("legl_dev.main.fingerprint.fingerprint", return_value="abc")
+@mock.patch("legl_dev.command.Command._execute", autospec=True)
+def test_pytest_dispatches_to_the_warm_runner(run, fingerprint, status):
+    main.pytest(
+        full_diff=False,
+        create_db=False,
+        last_failed=False,
+        warnings=False,
+        snapshot_update=False,
+        show_capture=False,
+        parallel=False,
+        all_logs=False,
+        warm_runner=True,
+        changed=False,
+        since=None,
+        shard=None,
+        watch=False,
+        template_db=False,
+        path="app/tests/test_models.py",
+    )
+    args = run.call_args[0][1]
+    assert args[:2] == ["docker", "exec"]
+    assert args[3:5] == [warm.container_name(), "pytest"]
+    assert args[-2:] == [
+        "--junitxml=/code/.legl-dev-junit.xml",
+        "/code/app/tests/test_models.py",
+    ]
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+from legl_dev import watch
+from legl_dev.command import Command
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(os, "uname") or os.uname().sysname != "Linux",
+    reason="inotify is Linux only",
+)
+
+
+@pytest.fixture
+def src(tmp_path, monkeypatch):
+    root = tmp_path / "src"
+    (root / "app" / "tests").mkdir(parents=True)
+    (root / "app" / "__pycache__").mkdir()
+    monkeypatch.chdir(root)
+    return root
+
+
+def _later(delay, action):
+    timer = threading.Timer(delay, action)
+    timer.start()
+    return timer
+
+
+def test_bursts_of_changes_are_coalesced(src):
+    with watch.Watcher() as watcher:
+
+        def burst():
+            for index in range(5):
+                (src / "app" / f"module_{index}.py").write_text("x = 1\n")
+                time.sleep(watch.DEBOUNCE / 4)
+
+        _later(0.05, burst)
+        changed = watcher.changes()
+        assert changed == {f"app/module_{index}.py" for index in range(5)}
+        # nothing is left over for the next call
+        assert watcher.read(0.1) == set()
+
+
+def test_irrelevant_files_are_ignored(src):
+    with watch.Watcher() as watcher:
+        (src / "app" / "notes.txt").write_text("x")
+        (src / "app" / ".module.py.swp").write_text("x")
+        (src / "app" / "__pycache__" / "module.cpython-311.pyc").write_text("x")
+        (src / "app" / "module.py~").write_text("x")
+        assert watcher.read(0.2) == set()
+        (src / "requirements.txt").write_text("django\n")
+        assert watcher.read(0.2) == {"requirements.txt"}
+
+
+def test_templates_and_fixtures_are_changes(src):
+    (src / "app" / "templates").mkdir()
+    (src / "app" / "fixtures").mkdir()
+    with watch.Watcher() as watcher:
+        (src / "app" / "templates" / "page.html").write_text("<p></p>")
+        (src / "app" / "fixtures" / "data.json").write_text("[]")
+        assert watcher.read(0.2) == {
+            "app/templates/page.html",
+            "app/fixtures/data.json",
+        }
+
+
+def test_new_directories_are_watched_without_rescanning(src):
+    with watch.Watcher() as watcher:
+        with mock.patch("legl_dev.watch.os.walk", wraps=os.walk) as walk:
+            (src / "app" / "tests" / "test_models.py").write_text("x = 1\n")
+            assert watcher.read(0.2) == {"app/tests/test_models.py"}
+            walk.assert_not_called()
+
+            (src / "app" / "billing").mkdir()
+            (src / "app" / "billing" / "models.py").write_text("x = 1\n")
+            changed = watcher.changes()
+            walk.assert_called_once_with(os.path.join(".", "app/billing"))
+
+        assert changed == {"app/billing/models.py"}
+        (src / "app" / "billing" / "views.py").write_text("x = 1\n")
+        assert watcher.read(0.2) == {"app/billing/views.py"}
+
+
+def test_moves_and_deletes_are_changes(src):
+    (src / "app" / "old.py").write_text("x = 1\n")
+    with watch.Watcher() as watcher:
+        os.rename(src / "app" / "old.py", src / "app" / "new.py")
+        assert watcher.read(0.2) == {"app/old.py", "app/new.py"}
+        os.remove(src / "app" / "new.py")
+        assert watcher.read(0.2) == {"app/new.py"}
+
+
+def test_overflow_is_reported_instead_of_blocking(src):
+    with watch.Watcher() as watcher:
+        watcher._handle(-1, watch.IN_Q_OVERFLOW, "")
+        assert watcher.changes() == set()
+        assert watcher.overflowed
+
+
+def test_a_run_is_cancelled_when_a_file_changes(src):
+    command = Command(command="sleep 10", name="slow", capture=True)
+    with watch.Watcher() as watcher:
+        _later(0.3, lambda: (src / "app" / "models.py").write_text("x = 1\n"))
+        start = time.monotonic()
+        completed, changed = watch.run_until_changed(command, watcher)
+    assert time.monotonic() - start < 2
+    assert not completed
+    assert changed == {"app/models.py"}
+    assert command.cancelled
+    assert command.returncode == -15
+
+
+def test_irrelevant_changes_dont_cancel_a_run(src):
+    command = Command(command="sleep 0.5", name="slow", capture=True)
+    with watch.Watcher() as watcher:
+        _later(0.1, lambda: (src / "app" / "notes.txt").write_text("x"))
+        completed, changed = watch.run_until_changed(command, watcher)
+    assert completed and changed == set()
+    assert command.returncode == 0
+
+
+def test_test_runs_have_their_own_pid_file():
+    first, second = watch.TestRun("pytest a"), watch.TestRun("pytest b")
+    assert first.pid_file != second.pid_file
+    assert first.pid_file in first.command
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import typer
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+_origin = time.perf_counter()
+_trace_lock = threading.Lock()
+_events = []
+_lanes = {}
+
+
+def now() -> float:
+    return time.perf_counter() - _origin
+
+
+def reap(process) -> int:
+    # wait4 rather than Popen.wait so the child's own peak RSS isn't lost, on
+    # Linux it includes what the child inherited from legl-dev before exec
+    _, status, usage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return usage.ru_maxrss * _RSS_UNIT
+
+
+def trace(name: str, started: float, finished: float, **args) -> None:
+    with _trace_lock:
+        lane = _lanes.setdefault(threading.get_ident(), len(_lanes) + 1)
+        _events.append(
+            {
+                "name": name,
+                "cat": "step" if "command" in args else "pipeline",
+                "ph": "X",
+                "ts": round(started * 1e6),
+                "dur": round((finished - started) * 1e6),
+                "pid": os.getpid(),
+                "tid": lane,
+                "args": args,
+            }
+        )
+
+
+def write_trace(path: str) -> None:
+    # Chrome trace event format, opens in chrome://tracing, Perfetto or speedscope
+    with _trace_lock:
+        data = {"traceEvents": list(_events), "displayTimeUnit": "ms"}
+    with open(path, "w") as f:
+        json.dump(data, f, indent=1)
+
+
+def format_size(size: Optional[int]) -> str:
+    if size is None:
+        return "-"
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def summary(steps: List, skipped: set, wall_time: float) -> None:
+    typer.secho("⏱  Step timings", fg=typer.colors.CYAN)
+    width = max(len(step.name) for step in steps)
+    for step in steps:
+        if step in skipped:
+            timings = "skipped"
+        elif step.duration is None:
+            timings = "not run"
+        else:
+            returncode = "-" if step.returncode is None else step.returncode
+            timings = (
+                f"{step.duration:8.1f}s  exit {returncode:>3}  "
+                f"peak rss {format_size(step.peak_rss):>9}"
+            )
+        typer.echo(f"  {step.name[:60]:<{min(width, 60)}}  {timings}")
+    typer.echo(f"  total wall time {wall_time:.1f}s")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import sys
+from typing import List, Optional, Tuple
+
+from legl_dev.cache import project_dir
+from legl_dev.command import Command, capture_output
+
+LABEL = "legl-dev.fingerprint"
+
+
+def container_name() -> str:
+    return f"legl-dev-warm-{project_dir().name}"
+
+
+def status() -> Tuple[bool, Optional[str]]:
+    output = capture_output(
+        [
+            "docker",
+            "inspect",
+            "--format",
+            f'{{{{.State.Running}}}} {{{{index .Config.Labels "{LABEL}"}}}}',
+            container_name(),
+        ]
+    )
+    if output is None:
+        return False, None
+    running, _, digest = output.strip().partition(" ")
+    return running == "true", digest or None
+
+
+def stop_command() -> Command:
+    return Command(command=f"docker rm -f {container_name()}", name="stop warm runner")
+
+
+def start_command(docker_cmd: str, digest: str) -> Command:
+    return Command(
+        command=(
+            f"{docker_cmd} run -d --rm --name {container_name()} "
+            f"--label {LABEL}={digest} backend sleep infinity"
+        ),
+        name="start warm runner",
+    )
+
+
+def ensure(docker_cmd: str, digest: str) -> Tuple[List[Command], str]:
+    running, current = status()
+    if running and current == digest:
+        return [], "reusing the warm runner"
+    if current is None and not running:
+        return [start_command(docker_cmd, digest)], "starting a warm runner"
+    if running:
+        reason = "dependencies changed, restarting the warm runner"
+    else:
+        reason = "restarting the stopped warm runner"
+    return [stop_command(), start_command(docker_cmd, digest)], reason
+
+
+def exec_command(args: str, name: Optional[str] = None) -> Command:
+    tty = "-it" if sys.stdin.isatty() and sys.stdout.isatty() else "-i"
+    return Command(command=f"docker exec {tty} {container_name()} {args}", name=name)
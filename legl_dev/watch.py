@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import shlex
+import struct
+import threading
+import uuid
+from typing import Dict, Optional, Set, Tuple
+
+from legl_dev import impact, warm
+from legl_dev.command import Command, capture_output
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_ONLYDIR
+)
+EVENT = struct.Struct("iIII")
+
+# Quiet time that ends a burst of events, e.g. a formatter rewriting files
+DEBOUNCE = 0.2
+IGNORED_DIRS = {"node_modules", "__pycache__", "venv", "env", "htmlcov"}
+
+
+def is_relevant(path: str) -> bool:
+    name = os.path.basename(path)
+    if name.startswith(".") or name.endswith("~"):
+        return False
+    # the same files impact.select can't ignore
+    return impact.matches(path, impact.FULL_RUN_TRIGGERS) or not impact.matches(
+        path, impact.NO_TEST_IMPACT
+    )
+
+
+def _is_ignored_dir(name: str) -> bool:
+    return name.startswith(".") or name in IGNORED_DIRS
+
+
+class Watcher:
+    def __init__(self, root: str = ".") -> None:
+        self.root = root
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: Dict[int, str] = {}
+        # set when the kernel queue overflowed and events were lost
+        self.overflowed = False
+        self._watch_tree(root, collect=False)
+
+    def __enter__(self) -> "Watcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+    def _watch(self, path: str) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(
+                    error, "Out of inotify watches, raise fs.inotify.max_user_watches"
+                )
+            # the directory went away before we got to it
+            return
+        self.dirs[wd] = os.path.normpath(os.path.relpath(path, self.root))
+
+    def _watch_tree(self, top: str, collect: bool = True) -> Set[str]:
+        # only walks when a directory appears, returns the files already in it
+        files = set()
+        for path, dirs, names in os.walk(top):
+            dirs[:] = [name for name in dirs if not _is_ignored_dir(name)]
+            self._watch(path)
+            if collect:
+                files.update(
+                    os.path.normpath(
+                        os.path.relpath(os.path.join(path, name), self.root)
+                    )
+                    for name in names
+                )
+        return files
+
+    def read(self, timeout: Optional[float] = None) -> Set[str]:
+        # waits for events without polling, returns the relevant changed paths
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                changed |= self._handle(wd, mask, os.fsdecode(name))
+        return {path for path in changed if is_relevant(path)}
+
+    def _handle(self, wd: int, mask: int, name: str) -> Set[str]:
+        if mask & IN_Q_OVERFLOW:
+            self.overflowed = True
+            return set()
+        if mask & IN_IGNORED:
+            self.dirs.pop(wd, None)
+            return set()
+        parent = self.dirs.get(wd)
+        if parent is None or not name:
+            return set()
+        path = os.path.normpath(os.path.join(parent, name))
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and not _is_ignored_dir(name):
+                return self._watch_tree(os.path.join(self.root, path))
+            return set()
+        if mask & IN_CREATE:
+            # new files are reported when they're closed after writing
+            return set()
+        return {path}
+
+    def changes(self, pending: Optional[Set[str]] = None) -> Set[str]:
+        # blocks until something changes, then coalesces the rest of the burst
+        changed = set(pending or ())
+        while not changed and not self.overflowed:
+            changed = self.read()
+        # any event restarts the quiet period, even one that isn't relevant
+        # on its own like a file being created before it's written
+        while select.select([self.fd], [], [], DEBOUNCE)[0]:
+            changed |= self.read(0)
+        return changed
+
+
+def run_until_changed(command: Command, watcher: Watcher) -> Tuple[bool, Set[str]]:
+    # runs the command, cancelling it as soon as a relevant file changes
+    done_read, done_write = os.pipe()
+
+    def target():
+        try:
+            command.run()
+        finally:
+            os.write(done_write, b"x")
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    changed = set()
+    # anything but the command finishing cancels it, including Ctrl+C
+    finished = False
+    try:
+        while True:
+            ready, _, _ = select.select([watcher.fd, done_read], [], [])
+            if done_read in ready:
+                finished = True
+                break
+            changed = watcher.read(0)
+            if changed or watcher.overflowed:
+                break
+    finally:
+        if not finished:
+            command.cancel()
+        thread.join()
+        os.close(done_read)
+        os.close(done_write)
+    return not command.cancelled, changed
+
+
+class TestRun(Command):
+    __test__ = False
+
+    def __init__(self, pytest_args: str) -> None:
+        # record the pid inside the container, docker exec doesn't pass signals on
+        self.pid_file = f"/tmp/legl-dev-watch-{uuid.uuid4().hex}.pid"
+        script = f"echo $$ > {self.pid_file} && exec {pytest_args}"
+        super().__init__(
+            command=f"docker exec -i {warm.container_name()} sh -c "
+            + shlex.quote(script),
+            shell=True,
+            name="pytest",
+        )
+
+    def cancel(self) -> None:
+        capture_output(
+            [
+                "docker",
+                "exec",
+                warm.container_name(),
+                "sh",
+                "-c",
+                f"kill -TERM $(cat {self.pid_file}); rm -f {self.pid_file}",
+            ]
+        )
+        super().cancel()
@@ -7,9 +7,15 @@ packages = ["legl_dev"]
 
 package_data = {"": ["*"]}
 
-install_requires = ["black", "isort==5.9.3", "typer==0.6.1", "requests"]
-
-entry_points = {"console_scripts": ["legl-dev = legl_dev.main:app"]}
+install_requires = [
+    "black",
+    "isort==5.9.3",
+    "typer==0.6.1",
+    "requests",
+    'importlib-metadata; python_version < "3.8"',
+]
+
+entry_points = {"console_scripts": ["legl-dev = legl_dev.client:main"]}
 
 setup_kwargs = {
     "name": "legl-dev",